@@ -0,0 +1,185 @@
+"""
+Description: Dashboard aggregates materialised in the store at write time.
+
+The Tableau dashboard used to compute rankings, week-over-week changes and regional top lists from
+the full exported files every time it was opened, which grows with the history and the number of
+keywords. Instead, every payload updates small summary tables in the store as it is stored: the
+latest value and week-over-week change per keyword, the rank of every region, and the rank of every
+related query along with its movement since the previous fetch. Each update only touches the rows
+of the keyword, geo and range just fetched, and the summaries are exported as small extracts whose
+size does not depend on the length of the history.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from google_trends_writer import StreamingWriter, write_stream
+
+# Regions and related queries per keyword, geo and range in the extracts.
+extract_top = 10
+
+schema = [
+    """CREATE TABLE IF NOT EXISTS keyword_summary (
+        keyword TEXT NOT NULL,
+        geo TEXT NOT NULL,
+        range TEXT NOT NULL,
+        latest_date TEXT,
+        latest_value REAL,
+        week_mean REAL,
+        previous_week_mean REAL,
+        week_change REAL,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (keyword, geo, range)
+    )""",
+    """CREATE TABLE IF NOT EXISTS region_rank (
+        keyword TEXT NOT NULL,
+        geo TEXT NOT NULL,
+        range TEXT NOT NULL,
+        region TEXT NOT NULL,
+        value REAL,
+        rank INTEGER NOT NULL,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (keyword, geo, range, region)
+    )""",
+    """CREATE INDEX IF NOT EXISTS region_rank_top
+        ON region_rank (keyword, geo, range, rank)""",
+    """CREATE TABLE IF NOT EXISTS related_rank (
+        keyword TEXT NOT NULL,
+        geo TEXT NOT NULL,
+        range TEXT NOT NULL,
+        query TEXT NOT NULL,
+        value REAL,
+        rank INTEGER NOT NULL,
+        previous_rank INTEGER,
+        movement INTEGER,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (keyword, geo, range, query)
+    )""",
+    """CREATE INDEX IF NOT EXISTS related_rank_top
+        ON related_rank (keyword, geo, range, rank)""",
+]
+
+
+def ranks(values):
+
+    # 1 for the highest value, ties share the best rank.
+    return pd.Series(values).rank(method='min', ascending=False).astype(int).to_numpy()
+
+
+def week_change(dates, values):
+
+    # Mean of the last 7 days against the 7 days before, as a percentage. None without two full weeks or
+    # without interest in the earlier week.
+    dates = pd.to_datetime(pd.Series(dates)).to_numpy()
+    values = np.asarray(values, dtype=float)
+    if not len(dates):
+        return None, None, None
+
+    latest = dates.max()
+    week = values[dates > latest - np.timedelta64(7, 'D')]
+    previous = values[(dates <= latest - np.timedelta64(7, 'D')) & (dates > latest - np.timedelta64(14, 'D'))]
+    if not len(previous):
+        return float(week.mean()), None, None
+
+    week_mean, previous_mean = float(week.mean()), float(previous.mean())
+    change = (week_mean / previous_mean - 1.0) * 100.0 if previous_mean > 0 else None
+
+    return week_mean, previous_mean, change
+
+
+class DashboardAggregates(object):
+
+    def __init__(self, store):
+
+        # The summary tables live in the store, next to the tables they summarise.
+        self.store = store
+        with store.lock, store.connection:
+            for statement in schema:
+                store.connection.execute(statement)
+
+    def replace_rows(self, table, columns, keyword, geo, range_label, rows):
+
+        # The rows of one keyword, geo and range are replaced in a single transaction.
+        statement = ('INSERT INTO ' + table + ' (' + ', '.join(columns) + ') VALUES ('
+                     + ', '.join('?' * len(columns)) + ')')
+
+        with self.store.lock, self.store.connection:
+            self.store.connection.execute('DELETE FROM ' + table + ' WHERE keyword = ? AND geo = ? AND range = ?',
+                                          (keyword, geo, range_label))
+            self.store.connection.executemany(statement, rows)
+
+    # UPDATE THE SUMMARIES AS THE PAYLOADS ARE STORED
+
+    def update_interest_over_time(self, pd_iot, keyword, geo, updated_at):
+
+        # One summary row per range of the payload.
+        rows = []
+        for range_label, pd_range in pd_iot.groupby('Range', sort=False):
+            pd_range = pd_range.sort_values('Date')
+            week_mean, previous_mean, change = week_change(pd_range['Date'], pd_range['Value'])
+            rows.append((keyword, geo, range_label, pd.Timestamp(pd_range['Date'].iloc[-1]).strftime('%Y-%m-%d'),
+                         float(pd_range['Value'].iloc[-1]), week_mean, previous_mean, change, updated_at))
+
+        self.store.bulk_upsert('keyword_summary',
+                               ['keyword', 'geo', 'range', 'latest_date', 'latest_value', 'week_mean',
+                                'previous_week_mean', 'week_change', 'updated_at'],
+                               ['keyword', 'geo', 'range'], rows)
+
+    def update_interest_by_region(self, pd_ibr, keyword, geo, updated_at):
+
+        # Without a geo, every row carries its own in a Geo column, as in the multi-geo fan-out.
+        groups = pd_ibr.groupby(['Geo', 'Range'], sort=False) if geo is None else (
+            ((geo, range_label), pd_range) for range_label, pd_range in pd_ibr.groupby('Range', sort=False))
+
+        for (region_geo, range_label), pd_range in groups:
+            values = pd_range['Value'].to_numpy(dtype=float)
+            rows = zip([keyword] * len(values), [region_geo] * len(values), [range_label] * len(values),
+                       pd_range['Region'], values, ranks(values).tolist(), [updated_at] * len(values))
+            self.replace_rows('region_rank', ['keyword', 'geo', 'range', 'region', 'value', 'rank', 'updated_at'],
+                              keyword, region_geo, range_label, rows)
+
+    def update_related_queries(self, pd_srch, keyword, geo, updated_at):
+
+        for range_label, pd_range in pd_srch.groupby('Range', sort=False):
+
+            # The ranks of the previous fetch. Storing the same fetch again keeps the movement it was stored with.
+            previous = self.store.query("""
+                SELECT query, rank, previous_rank, updated_at FROM related_rank
+                WHERE keyword = ? AND geo = ? AND range = ?""", (keyword, geo, range_label))
+            previous_ranks = {
+                query: (previous_rank if stored_at == updated_at else rank)
+                for query, rank, previous_rank, stored_at in previous.itertuples(index=False)}
+
+            values = pd_range['Value'].to_numpy(dtype=float)
+            rows = []
+            for query, value, rank in zip(pd_range['Keyword'], values, ranks(values).tolist()):
+                previous_rank = previous_ranks.get(query)
+                previous_rank = None if previous_rank is None or pd.isna(previous_rank) else int(previous_rank)
+                movement = None if previous_rank is None else previous_rank - rank
+                rows.append((keyword, geo, range_label, query, value, rank, previous_rank, movement, updated_at))
+
+            self.replace_rows('related_rank', ['keyword', 'geo', 'range', 'query', 'value', 'rank', 'previous_rank',
+                                               'movement', 'updated_at'], keyword, geo, range_label, rows)
+
+    # EXPORT THE EXTRACTS FOR THE TABLEAU DASHBOARD
+
+    def export_extracts(self, directory, top=extract_top):
+
+        # Three small files, each replaced in one step once complete.
+        write_stream([self.store.query("""
+            SELECT keyword AS Keyword, geo AS Geo, range AS Range, latest_date AS Date, latest_value AS Value,
+                   week_change AS WeekChange, updated_at AS Updated
+            FROM keyword_summary ORDER BY keyword, geo, range""")],
+            [StreamingWriter(directory + 'keywordSummary.csv')])
+
+        write_stream([self.store.query("""
+            SELECT keyword AS Keyword, geo AS Geo, range AS Range, rank AS Rank, region AS Region, value AS Value
+            FROM region_rank WHERE rank <= ? ORDER BY keyword, geo, range, rank""", (top,))],
+            [StreamingWriter(directory + 'regionRank.csv')])
+
+        write_stream([self.store.query("""
+            SELECT keyword AS Keyword, geo AS Geo, range AS Range, rank AS Rank, query AS Query, value AS Value,
+                   previous_rank AS PreviousRank, movement AS Movement
+            FROM related_rank WHERE rank <= ? ORDER BY keyword, geo, range, rank""", (top,))],
+            [StreamingWriter(directory + 'relatedMovement.csv')])
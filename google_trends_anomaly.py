@@ -0,0 +1,162 @@
+"""
+Description: Streaming spike detection over many keyword and geo series at once.
+
+The detector keeps its rolling statistics for every series as rows of NumPy arrays: an
+exponentially weighted mean and variance, and a fixed window of recent values for a robust
+z-score (median and median absolute deviation). Each new fetch only updates the statistics with
+the dates it adds, one vectorised step per date across every series, instead of recomputing the
+full history. Values that stand out on the robust z-score and rise well above their baseline are
+flagged as spikes.
+
+The state is saved between runs in a single .npz file.
+
+"""
+
+import json
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Scale factor that makes the median absolute deviation comparable to a standard deviation.
+mad_scale = 0.6745
+
+
+class SpikeDetector(object):
+
+    def __init__(self, window=28, alpha=0.1, z_threshold=3.5, min_change=0.5, min_value=10, min_periods=7):
+
+        # Size of the robust window, EWMA smoothing and flagging thresholds.
+        self.window = window
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.min_change = min_change
+        self.min_value = min_value
+        self.min_periods = min_periods
+
+        # One row per series. Series are keyed on 'keyword|geo'.
+        self.keys = []
+        self.rows = {}
+        self.mean = np.zeros(0)
+        self.variance = np.zeros(0)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.last_day = np.zeros(0, dtype=np.int64)
+        self.values = np.full((0, window), np.nan)
+
+    # SERIES ROWS
+
+    def row_indexes(self, keys):
+
+        # Add rows for the series seen for the first time, growing every array once.
+        new_keys = [key for key in dict.fromkeys(keys) if key not in self.rows]
+        if new_keys:
+            for key in new_keys:
+                self.rows[key] = len(self.keys)
+                self.keys.append(key)
+            grow = len(new_keys)
+            self.mean = np.concatenate([self.mean, np.zeros(grow)])
+            self.variance = np.concatenate([self.variance, np.zeros(grow)])
+            self.count = np.concatenate([self.count, np.zeros(grow, dtype=np.int64)])
+            self.last_day = np.concatenate([self.last_day, np.full(grow, np.iinfo(np.int64).min)])
+            self.values = np.vstack([self.values, np.full((grow, self.window), np.nan)])
+
+        return np.array([self.rows[key] for key in keys], dtype=np.int64)
+
+    # UPDATE
+
+    def update(self, keys, day, values):
+
+        # One step for many series: the value of every series in keys on the given day (days since the epoch).
+        rows = self.row_indexes(keys)
+        values = np.asarray(values, dtype=float)
+
+        # Only days after the last one seen by each series are new.
+        new = day > self.last_day[rows]
+        rows, values = rows[new], values[new]
+        if not len(rows):
+            return pd.DataFrame(columns=['Series', 'Day', 'Value', 'RobustZ', 'EwmaZ', 'Change'])
+
+        # Robust z-score against the recent window, before the new value joins it.
+        recent = self.values[rows]
+        with np.errstate(all='ignore'), warnings.catch_warnings():
+
+            # New series have empty windows, which are expected to give NaN.
+            warnings.simplefilter('ignore', RuntimeWarning)
+            median = np.nanmedian(recent, axis=1)
+            mad = np.nanmedian(np.abs(recent - median[:, np.newaxis]), axis=1)
+            robust_z = mad_scale * (values - median) / np.where(mad > 0, mad, np.nan)
+
+            # EWMA z-score and change against the EWMA baseline.
+            mean = self.mean[rows]
+            ewma_z = (values - mean) / np.sqrt(np.where(self.variance[rows] > 0, self.variance[rows], np.nan))
+            change = (values - mean) / np.where(mean > 0, mean, np.nan)
+
+        # A spike stands out on the robust z-score and rises well above its baseline.
+        flagged = ((self.count[rows] >= self.min_periods)
+                   & (values >= self.min_value)
+                   & (np.nan_to_num(robust_z) >= self.z_threshold)
+                   & (np.nan_to_num(change, nan=np.inf) >= self.min_change))
+
+        # Update the EWMA mean and variance.
+        difference = values - mean
+        first = self.count[rows] == 0
+        self.mean[rows] = np.where(first, values, mean + self.alpha * difference)
+        self.variance[rows] = np.where(first, 0.0, (1 - self.alpha) * (self.variance[rows] + self.alpha * difference ** 2))
+
+        # Push the values into the window, oldest value out.
+        self.values[rows, self.count[rows] % self.window] = values
+        self.count[rows] += 1
+        self.last_day[rows] = day
+
+        return pd.DataFrame({
+            'Series': [self.keys[row] for row in rows[flagged]],
+            'Day': day,
+            'Value': values[flagged],
+            'RobustZ': robust_z[flagged],
+            'EwmaZ': ewma_z[flagged],
+            'Change': change[flagged],
+        })
+
+    def update_frame(self, frame):
+
+        # A long-format frame with Series, Date and Value columns, such as a new fetch, one step per date.
+        days = (pd.to_datetime(frame['Date']).to_numpy().astype('datetime64[D]').astype(np.int64))
+        alerts = []
+        for day in np.unique(days):
+            selected = days == day
+            alerts.append(self.update(list(frame['Series'].to_numpy()[selected]), day, frame['Value'].to_numpy()[selected]))
+
+        alerts = pd.concat(alerts, ignore_index=True) if alerts else self.update([], 0, [])
+        alerts['Date'] = pd.to_datetime(alerts['Day'].astype(np.int64), unit='D')
+
+        return alerts.drop(columns=['Day'])
+
+    # PERSIST THE STATE BETWEEN RUNS
+
+    def save(self, path):
+        np.savez(path + '.tmp.npz', keys=np.array(json.dumps(self.keys)), mean=self.mean, variance=self.variance,
+                 count=self.count, last_day=self.last_day, values=self.values)
+        os.replace(path + '.tmp.npz', path)
+
+    @classmethod
+    def load(cls, path, **settings):
+
+        detector = cls(**settings)
+        if not os.path.exists(path):
+            return detector
+
+        with np.load(path) as state:
+            detector.keys = json.loads(str(state['keys']))
+            detector.rows = {key: row for row, key in enumerate(detector.keys)}
+            detector.mean = state['mean']
+            detector.variance = state['variance']
+            detector.count = state['count']
+            detector.last_day = state['last_day']
+            detector.values = state['values']
+
+        # A saved window of a different size starts again from empty windows.
+        if detector.values.shape[1] != detector.window:
+            detector.values = np.full((len(detector.keys), detector.window), np.nan)
+
+        return detector
@@ -22,13 +22,87 @@ for the availability of these modules.
 """
 
 # Import the Python Google Search Trends API Package.
-from pytrends.request import TrendReq
+from pytrends import exceptions
+from google_trends_proxy import ProxyScheduler, PooledTrendReq, classify_error, success
+from google_trends_cache import ResponseCache
+from google_trends_archive import ResponseArchive, ReplayTrendReq
+from google_trends_engine import TokenBucket, SharedTokenBucket, run_concurrently, stream_in_processes
+from google_trends_geo import country_name, resolution_levels, check_levels
+from google_trends_batch import plan_batches, rescale_batches
+from google_trends_incremental import tail_time_frame, merge_tail, window_from_history, max_daily_days
+from google_trends_stitch import plan_windows, window_time_frame, stitch_windows
+from google_trends_store import TrendsStore
+from google_trends_parquet import parquet_available, dataset_file
+from google_trends_metrics import Metrics
+from google_trends_manifest import RunManifest, run_unit
+from google_trends_crawler import crawl
+from google_trends_anomaly import SpikeDetector
+from google_trends_aggregate import DashboardAggregates
+from google_trends_writer import StreamingWriter, write_stream
+from google_trends_realtime import HourlyPoller, range_labels as hourly_range_labels
+from google_trends_daemon import RefreshQueue, run_daemon
+from google_trends_queue import WorkQueue, run_worker
+from google_trends_transform import (range_labels, series_report, interest_over_time_report, keyword_series_report,
+                                     interest_by_region_report, related_queries_report, concat_reports, compact_windows,
+                                     region_level_report, region_tree_report)
+from urllib.parse import quote
+from contextlib import contextmanager
 import pandas as pd
+import requests
+import argparse
+import threading
+import socket
+import copy
 import time
 import os
 
-# Connecting to Google.
-pytrends = TrendReq(hl='en-UK', tz=0)
+# Importing the module does no I/O. The client, the cache and the store are created when first needed,
+# and the pipeline runs from the command line through main().
+
+# Offline mode replays cached responses only. Set from the command line by main().
+offline = False
+
+# Set the root for the store, the incremental histories and the exported files, by default under the working
+# directory. Set from the command line by main().
+parent_directory = os.path.join(os.getcwd(), 'ds_tableau_public')
+history_directory = os.path.join(parent_directory, 'history')
+
+# Proxies to rotate through, empty for the direct connection. Set from the command line by main().
+proxies = []
+
+# Stand-in for trends.google.com, such as the stub server of google_trends_stub.py, None for Google itself.
+trends_url = None
+
+# Adapts the request rate per proxy and takes failing proxies out of rotation. Created on first use.
+scheduler = None
+scheduler_lock = threading.Lock()
+
+# Attempts per fetch before giving up.
+max_attempts = 5
+
+# Every request to Google takes a token from the bucket of its proxy, whose rate the scheduler adapts. This optional
+# bucket is a hard cap on the overall rate across every proxy, None to leave the pace to the scheduler. Set from the
+# command line by main().
+limiter = None
+
+# Stage timings and request counters for the run, exported by main().
+metrics = Metrics()
+
+# Idle clients per proxy, shared by every thread. A fetch checks a client out and returns it when done, so concurrent
+# fetches never share payload state and each client's cookie and keep-alive session outlive the threads using it.
+client_pool = {}
+client_pool_lock = threading.Lock()
+
+# Responses are kept on disk between runs so reruns within the TTL do not go back to Google.
+cache_directory = os.path.join(os.path.expanduser('~'), '.google_trends_cache')
+response_cache = None
+response_cache_lock = threading.Lock()
+
+# Archive every response fetched from Google in the archive folder of the parent directory. Off when the module is used
+# as a library, turned on by main() unless --no-archive is given.
+archive_responses = False
+response_archive = None
+response_archive_lock = threading.Lock()
 
 # Alternative proxy connection if you are blocked due to Google's limit:
 """
@@ -49,14 +123,247 @@ client will wait between bytes sent from the server. 99.9% of cases, this is the
 server sends the first byte.  
 
 https://requests.readthedocs.io/en/master/user/advanced/#timeouts
+
+Proxies are now passed on the command line (--proxies) and rotated by the ProxyScheduler.
 """
+
+
+# CONNECT TO GOOGLE
+
+def acquire_request(proxy=None):
+
+    # Wait for the proxy's own rate limit, then for the overall cap when there is one.
+    with metrics.timed('rate_limit_wait'):
+        get_scheduler().acquire(proxy)
+        if limiter is not None:
+            limiter.acquire()
+
+
+def get_client(proxy=None):
+
+    # Connecting to Google requests a cookie, so a client is only created when every client of the proxy is in use.
+    acquire_request(proxy)
+
+    # Every response received from Google is counted and measured by the metrics hook.
+    # Each client keeps its own keep-alive session through its proxy.
+    with metrics.timed('connect'):
+        return PooledTrendReq(hl='en-UK', tz=0, proxies=[proxy] if proxy else '',
+                              requests_args={'hooks': {'response': metrics.record_response}}, base_url=trends_url)
+
+
+@contextmanager
+def checkout_client(proxy=None):
+
+    # Take an idle client of the proxy, or connect a new one, and return it to the pool once the fetch is done.
+    with client_pool_lock:
+        idle = client_pool.setdefault(proxy, [])
+        pytrends = idle.pop() if idle else None
+
+    if pytrends is None:
+        pytrends = get_client(proxy)
+
+    try:
+        yield pytrends
+    finally:
+        with client_pool_lock:
+            client_pool[proxy].append(pytrends)
+
+
+def get_scheduler():
+
+    global scheduler
+
+    # Created on first use, once the proxies have been set.
+    with scheduler_lock:
+        if scheduler is None:
+            scheduler = ProxyScheduler(proxies)
+
+    return scheduler
+
+
 # The keyword list collection can take up to 5 keywords.
 kw_list = ["covid"]
 
+# Token and widget state returned by Google with the time it was built, keyed on the full payload tuple. Relative time
+# frames move on and tokens expire, so an entry is only reused for payload_ttl seconds.
+payload_cache = {}
+payload_ttl = 10 * 60
+
+# One lock per payload, so concurrent fetches of the same payload wait for a single token request.
+payload_locks = {}
+payload_locks_guard = threading.Lock()
+
+# The TrendReq attributes populated by build_payload() and read by the endpoint calls.
+payload_state_attributes = ['kw_list', 'geo', 'token_payload', 'interest_over_time_widget',
+                            'interest_by_region_widget', 'related_topics_widget_list',
+                            'related_queries_widget_list']
+
+
+# BUILD THE PAYLOAD ONCE PER (KEYWORDS, CATEGORY, TIMEFRAME, GEO, PROPERTY)
+
+def build_cached_payload(kw_list, cat=0, timeframe='today 1-m', geo='GB', gprop='', pytrends=None, proxy=None,
+                         cached=True):
+
+    # The full payload tuple identifies the token request.
+    key = (tuple(kw_list), cat, timeframe, geo, gprop)
+
+    pytrends = pytrends or get_client(proxy)
+
+    with payload_locks_guard:
+        payload_lock = payload_locks.setdefault(key, threading.Lock())
+
+    # The window of a 'now' time frame moves on every minute, so a polled payload is never reused.
+    reusable = cached and not timeframe.startswith('now ')
+
+    # Only go to Google for the token when the payload is new, has expired or is not to be reused.
+    with payload_lock:
+        entry = payload_cache.get(key) if reusable else None
+        if entry is None or time.time() - entry[0] > payload_ttl:
+            acquire_request(proxy)
+            # pytrends keeps the client's previous geo when given the worldwide geo '', so it is set first.
+            pytrends.geo = geo
+            with metrics.timed('build_payload'):
+                pytrends.build_payload(kw_list, cat=cat, timeframe=timeframe, geo=geo, gprop=gprop)
+            entry = (time.time(), {name: copy.deepcopy(getattr(pytrends, name)) for name in payload_state_attributes})
+            if reusable:
+                payload_cache[key] = entry
+
+    # Restore the widget state onto the client. Copies are used because the endpoint calls modify their widget.
+    for name, value in entry[1].items():
+        setattr(pytrends, name, copy.deepcopy(value))
+
+    return pytrends
+
+
+# CALL ONE ENDPOINT ON A CLIENT WITH ITS PAYLOAD IN PLACE
+
+def call_endpoint(pytrends, endpoint, resolution=''):
+
+    if endpoint == 'interest_over_time':
+        return pytrends.interest_over_time()
+    elif endpoint == 'interest_by_region':
+
+        # Every resolution of a geo shares the payload's token. pytrends only passes the resolution on for
+        # worldwide and US payloads, so it is set on the widget. The geo codes are kept for drilling down.
+        if resolution in resolution_levels:
+            pytrends.interest_by_region_widget['request']['resolution'] = resolution
+        return pytrends.interest_by_region(resolution=resolution, inc_low_vol=True, inc_geo_code=True)
+    elif endpoint == 'related_queries':
+        return pytrends.related_queries()
+    elif endpoint == 'related_topics':
+        return pytrends.related_topics()
+
+    raise ValueError("Unknown endpoint: " + endpoint)
+
+
+# OPEN THE RESPONSE CACHE
+
+def get_response_cache():
+
+    global response_cache
+
+    # The cache directory and its index are only read when the first response is needed. Responses of a stand-in for
+    # Google are kept apart, so they are never replayed as Google's.
+    with response_cache_lock:
+        if response_cache is None:
+            directory = cache_directory
+            if trends_url is not None:
+                directory = os.path.join(cache_directory, 'stand-ins', quote(trends_url, safe=''))
+            response_cache = ResponseCache(directory)
+
+    return response_cache
+
+
+# OPEN THE RESPONSE ARCHIVE
+
+def get_response_archive():
+
+    global response_archive
+
+    with response_archive_lock:
+        if response_archive is None:
+            response_archive = ResponseArchive(os.path.join(parent_directory, 'archive'))
+
+    return response_archive
+
+
+# FETCH A RESPONSE FROM THE CACHE OR FROM GOOGLE
+
+def fetch_response(endpoint, kw_list, time_frame, geo='GB', resolution='', cached=True):
+
+    # The cache key covers everything that changes the response.
+    key = (endpoint, tuple(kw_list), time_frame, geo, resolution)
+
+    # Offline runs replay whatever is cached, however old it is. Polled responses are only fresh once, so skip the cache.
+    response = get_response_cache().get(key, allow_expired=offline) if cached else None
+    if response is not None:
+        metrics.count('cache_hits_total', endpoint=endpoint)
+        return response
+
+    metrics.count('cache_misses_total', endpoint=endpoint)
+
+    if offline:
+        raise LookupError("No cached response for " + str(key) + " in offline mode.")
+
+    for attempt in range(max_attempts):
+
+        # Pick the proxy allowed the highest rate and wait for its turn.
+        with metrics.timed('rate_limit_wait'):
+            proxy = get_scheduler().choose()
+            if limiter is not None:
+                limiter.acquire()
+
+        try:
+            with checkout_client(proxy) as pytrends:
+
+                # Define the parameters for the payload.
+                build_cached_payload(kw_list, cat=0, timeframe=time_frame, geo=geo, gprop='', pytrends=pytrends,
+                                     proxy=proxy, cached=cached)
+
+                # Execute the payload request, recording the JSON bodies as Google returned them for the archive.
+                pytrends.raw_bodies = []
+                try:
+                    with metrics.timed(endpoint):
+                        response = call_endpoint(pytrends, endpoint, resolution)
+                finally:
+                    bodies, pytrends.raw_bodies = pytrends.raw_bodies, None
+
+        except (exceptions.ResponseError, requests.exceptions.RequestException) as error:
+
+            # Slow the proxy down on 429s and timeouts, then retry, possibly through another proxy.
+            outcome = classify_error(error)
+            get_scheduler().record(proxy, outcome)
+            metrics.count('request_errors_total', endpoint=endpoint, outcome=outcome)
+
+            if attempt == max_attempts - 1:
+                raise
+
+            metrics.count('retries_total', endpoint=endpoint)
+            time.sleep(get_scheduler().backoff(attempt))
+
+        else:
+            get_scheduler().record(proxy, success)
+            break
+
+    # Store the response for the following runs.
+    if cached:
+        get_response_cache().put(key, response)
+
+    # Archive the raw bodies returned by Google, so later parsers and report schemas can be rebuilt without refetching.
+    # Responses of a stand-in for Google are not archived.
+    if archive_responses and trends_url is None and bodies:
+        with metrics.timed('archive_response'):
+            get_response_archive().put(key, bodies)
+
+    return response
+
 
 # GET DATA FOR INTEREST OVERTIME
 
-def get_interest_over_time(month):
+def get_interest_over_time(month, geo='GB', keywords=None, cached=True):
+
+    # Default to the keyword list of the pipeline.
+    keywords = keywords or kw_list
 
     # Set value for time_frame.
     time_frame = "today 1-m"
@@ -66,37 +373,201 @@ def get_interest_over_time(month):
     elif month == 3:
         time_frame = "today 3-m"
 
-    # Define the parameters for the payload.
-    pytrends.build_payload(kw_list, cat=0, timeframe=time_frame, geo='GB', gprop='')
-
     # Execute the payload request.
-    pd_iot = pytrends.interest_over_time()
+    pd_iot = fetch_response('interest_over_time', keywords, time_frame, geo=geo, cached=cached)
 
-    # Remove index.
-    pd_iot.reset_index(inplace=True)
+    # Time the post-processing of the payload.
+    started = time.perf_counter()
 
-    # Rename API Columns.
-    pd_iot.rename(columns={'date': 'Date', 'covid': 'Value'}, inplace=True)
+    # Build the Date, Value, Label and Range columns in date order in a single pass, leaving the payload untouched.
+    pd_iot = interest_over_time_report(pd_iot, keywords[0], range_labels[month])
 
-    # Add additional columns required for the report.
-    pd_iot["Label"] = pd_iot["Value"]
+    # Record the processing time and the number of rows produced.
+    metrics.observe('stage_seconds', time.perf_counter() - started, stage='process_interest_over_time')
+    metrics.count('rows_total', len(pd_iot), endpoint='interest_over_time')
+
+    # Finally return the processed payload as a DateFrame.
+    return pd_iot
+
+
+# GET DATA FOR INTEREST OVERTIME FOR ANY NUMBER OF KEYWORDS
+
+def get_interest_over_time_batched(keywords, month, anchor=None):
+
+    # Set value for time_frame.
+    time_frame = "today 1-m"
 
-    # Set value for days label.
     if month == 1:
-        pd_iot["Range"] = "Last-30-Days"
+        time_frame = "today 1-m"
     elif month == 3:
-        pd_iot["Range"] = "Last-90-Days"
+        time_frame = "today 3-m"
+
+    # The anchor is shared by every payload, by default the first keyword.
+    anchor = anchor or keywords[0]
+
+    # Pack the keywords into as few 5-keyword payloads as possible.
+    batches = plan_batches(keywords, anchor)
+
+    # Execute the payload requests.
+    frames = run_concurrently([
+        (fetch_response, ('interest_over_time', batch, time_frame, 'GB')) for batch in batches
+    ])
+
+    # Time the post-processing of the payloads.
+    started = time.perf_counter()
 
-    # Sort the DataFrame.
-    pd_iot.sort_values(by=["Date"], inplace=True, ascending=True)
+    # Rescale every batch onto one 0-100 scale as a single long-format DataFrame.
+    pd_iot = rescale_batches(frames, batches, anchor)
+
+    # Add the Label and Range columns, ordered by keyword and date, in a single pass.
+    pd_iot = keyword_series_report(pd_iot, range_labels[month])
+
+    # Record the processing time and the number of rows produced.
+    metrics.observe('stage_seconds', time.perf_counter() - started, stage='process_interest_over_time_batched')
+    metrics.count('rows_total', len(pd_iot), endpoint='interest_over_time')
 
     # Finally return the processed payload as a DateFrame.
-    return pd_iot[["Date", "Value", "Label", "Range"]]
+    return pd_iot
+
+
+# GET DAILY DATA FOR INTEREST OVERTIME FOR ANY DATE RANGE
+
+def get_interest_over_time_range(keyword, start_date, end_date, geo='GB'):
+
+    # Split the date range into overlapping windows short enough for daily values.
+    windows = plan_windows(start_date, end_date)
+
+    # Execute the payload requests.
+    responses = run_concurrently([
+        (fetch_response, ('interest_over_time', [keyword], window_time_frame(window), geo)) for window in windows
+    ])
+
+    # Time the post-processing of the payloads.
+    started = time.perf_counter()
+
+    # Take the dates and values of every window without copying the payloads.
+    frames = [pd.DataFrame({'Date': response.index.to_numpy(), 'Value': response[keyword].to_numpy()}, copy=False)
+              for response in responses]
+
+    # Stitch the windows into one consistently scaled daily series.
+    pd_iot = stitch_windows(frames)
+
+    # Add the Label and Range columns in a single pass.
+    pd_iot = series_report(pd_iot['Date'].to_numpy(), pd_iot['Value'].to_numpy(),
+                           windows[0][0].strftime('%Y-%m-%d') + " to " + windows[-1][1].strftime('%Y-%m-%d'))
+
+    # Record the processing time and the number of rows produced.
+    metrics.observe('stage_seconds', time.perf_counter() - started, stage='process_interest_over_time_range')
+    metrics.count('rows_total', len(pd_iot), endpoint='interest_over_time')
+
+    # Finally return the processed payload as a DateFrame.
+    return pd_iot
+
+
+# REFRESH THE STORED INTEREST OVERTIME HISTORY
+
+def refresh_interest_over_time(keyword, geo='GB', overlap_days=7):
+
+    # One history file per keyword and geo.
+    path = os.path.join(history_directory, geo, quote(keyword, safe='') + '.csv')
+
+    # Without a stored history the full 90 days are fetched.
+    history = None
+    time_frame = "today 3-m"
+    today = pd.Timestamp.today().normalize()
+
+    if os.path.exists(path):
+        history = pd.read_csv(path, parse_dates=['Date'])
+        time_frame = tail_time_frame(history['Date'].max(), overlap_days)
+        tail_start = history['Date'].max() - pd.Timedelta(days=overlap_days)
+
+    # A history ending too long ago for one daily window to overlap it is bridged by stitched windows instead.
+    if history is not None and (today - tail_start).days >= max_daily_days:
+        pd_tail = get_interest_over_time_range(keyword, tail_start, today, geo)[['Date', 'Value']]
+    else:
+        # Execute the payload request.
+        pd_tail = fetch_response('interest_over_time', [keyword], time_frame, geo=geo)
+
+        # Remove index and rename API Columns.
+        pd_tail = pd_tail.reset_index().rename(columns={'date': 'Date', keyword: 'Value'})[['Date', 'Value']]
+
+    # Re-normalise the history against the overlap and append the new days.
+    if history is None:
+        history = pd_tail
+    else:
+        try:
+            history = merge_tail(history, pd_tail)
+        except ValueError as error:
+            # Without a factor the stored history cannot be brought up to date. It is left as it is on disk, and the
+            # caller decides how to get the days it is missing rather than being handed the stale history.
+            metrics.count('history_merge_failures_total')
+            raise ValueError("History not refreshed: " + path + ": " + str(error)) from error
+
+    # Store the refreshed history for the next run.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    history.to_csv(path, index=False, header=True)
+
+    # Finally return the refreshed history.
+    return history
+
+
+# GET DATA FOR INTEREST OVERTIME FROM THE STORED HISTORY
+
+def get_interest_over_time_from_history(history, month):
+
+    # Cut the 30 or 90-day window from the history.
+    pd_iot = window_from_history(history, 90 if month == 3 else 30)
+
+    # Finally return the window with the Label and Range columns, in date order.
+    return series_report(pd_iot['Date'].to_numpy(), pd_iot['Value'].to_numpy(), range_labels[month])
+
+
+# POLL HOURLY DATA FOR INTEREST OVERTIME
+
+def get_interest_over_time_hourly(batch, time_frame='now 1-H'):
+
+    # Execute the payload request, always going back to Google.
+    pd_poll = fetch_response('interest_over_time', batch, time_frame, geo='GB', cached=False)
+
+    # Record the number of rows produced.
+    metrics.count('rows_total', len(pd_poll), endpoint='interest_over_time_hourly')
+
+    # Finally return the payload without the partial flag, the last point is replaced by the next poll anyway.
+    return pd_poll.drop(columns=['isPartial'], errors='ignore')
+
+
+def poll_interest_over_time(keywords, time_frame='now 1-H', interval=300, flush_interval=900, count=0):
+
+    # The ring buffers pick up from the last flush.
+    realtime_directory = os.path.join(parent_directory, 'realtime')
+    os.makedirs(realtime_directory, exist_ok=True)
+    buffer_path = os.path.join(realtime_directory, 'buffers.npz')
+    poller = HourlyPoller.load(buffer_path, keywords, get_interest_over_time_hourly, time_frame)
+
+    # Every flush also exports the buffered points for the dashboard.
+    def export_buffers(poller):
+        with metrics.timed('write_csv'):
+            pd_hourly = poller.frame()
+            pd_hourly.to_csv(os.path.join(realtime_directory, 'hourlyTimeline.csv.tmp'), index=False, header=True)
+            os.replace(os.path.join(realtime_directory, 'hourlyTimeline.csv.tmp'),
+                       os.path.join(realtime_directory, 'hourlyTimeline.csv'))
+
+        # Display the latest hour for verification.
+        print("")
+        print("Hourly Interest Over Time Flushed: " + str(len(pd_hourly)) + " points")
+        print(poller.latest(keywords[0], seconds=60 * 60))
+
+    # Failed polls are retried on the next tick rather than stopping the poller.
+    return poller.run(buffer_path, interval, flush_interval, count,
+                      errors=(exceptions.ResponseError, requests.exceptions.RequestException), on_flush=export_buffers)
 
 
 # GET DATA FOR RELATED SEARCH TERMS
 
-def get_related_queries(month):
+def get_related_queries(month, geo='GB', keywords=None, cached=True):
+
+    # Default to the keyword list of the pipeline.
+    keywords = keywords or kw_list
 
     # Set value for time_frame.
     time_frame = "today 1-m"
@@ -106,40 +577,65 @@ def get_related_queries(month):
     elif month == 3:
         time_frame = "today 3-m"
 
-    # Define the parameters for the payload.
-    pytrends.build_payload(kw_list, cat=0, timeframe=time_frame, geo='GB', gprop='')
-
     # Execute the payload request.
-    dict_srch = pytrends.related_queries()
+    dict_srch = fetch_response('related_queries', keywords, time_frame, geo=geo, cached=cached)
 
-    # Convert dictionary into DataFrame.
-    pd_srch = pd.DataFrame(dict_srch["covid"]["top"])
+    # Time the post-processing of the payload.
+    started = time.perf_counter()
 
-    # Rename API Columns.
-    pd_srch.rename(columns={'query': 'Keyword', 'value': 'Value'}, inplace=True)
+    # Build the Keyword, Value and Range columns from the top related queries, highest value first.
+    pd_srch = related_queries_report(dict_srch[keywords[0]]["top"], range_labels[month])
 
-    # Add additional columns required for the report.
+    # Record the processing time and the number of rows produced.
+    metrics.observe('stage_seconds', time.perf_counter() - started, stage='process_related_queries')
+    metrics.count('rows_total', len(pd_srch), endpoint='related_queries')
+
+    # Finally return the processed payload as a DateFrame.
+    return pd_srch
+
+
+# GET DATA FOR INTEREST BY REGION
+
+def get_interest_by_region(month, geo='GB', resolution='GB', keywords=None, cached=True):
+
+    # Default to the keyword list of the pipeline.
+    keywords = keywords or kw_list
+
+    # Set value for time_frame.
+    time_frame = "today 1-m"
 
-    # Set value for days label.
     if month == 1:
-        pd_srch["Range"] = "Last-30-Days"
+        time_frame = "today 1-m"
     elif month == 3:
-        pd_srch["Range"] = "Last-90-Days"
+        time_frame = "today 3-m"
 
-    # Sort the DataFrame.
-    pd_srch.sort_values(by=["Value"], inplace=True, ascending=False)
+    # Execute the payload request.
+    pd_ibr = fetch_response('interest_by_region', keywords, time_frame, geo=geo, resolution=resolution, cached=cached)
+
+    # Time the post-processing of the payload.
+    started = time.perf_counter()
+
+    # Build the Country, Region, Value, Label and Range columns, highest interest first, in a single pass.
+    # Sorting the frame itself rather than a column slice of the payload avoids the copy and the SettingWithCopy warning.
+    pd_ibr = interest_by_region_report(pd_ibr, keywords[0], country_name(geo), range_labels[month])
+
+    # Record the processing time and the number of rows produced.
+    metrics.observe('stage_seconds', time.perf_counter() - started, stage='process_interest_by_region')
+    metrics.count('rows_total', len(pd_ibr), endpoint='interest_by_region')
 
     # Finally return the processed payload as a DateFrame.
-    return pd_srch
+    return pd_ibr
 
 
-# GET DATA FOR INTEREST BY REGION
+# GET DATA FOR INTEREST BY REGION AS A TREE OF COUNTRY, REGIONS AND CITIES
 
-def get_interest_by_region(month):
+def get_interest_by_region_tree(month, geo='GB', levels=('REGION', 'CITY'), keywords=None, cached=True):
 
-    # Set value for time_frame.
-    month = month
+    # Default to the keyword list of the pipeline. Unsupported levels fail before any request is sent.
+    keywords = keywords or kw_list
+    levels = check_levels(geo, levels)
 
+    # Set value for time_frame.
     time_frame = "today 1-m"
 
     if month == 1:
@@ -147,183 +643,802 @@ def get_interest_by_region(month):
     elif month == 3:
         time_frame = "today 3-m"
 
-    # Define the parameters for the payload.
-    pytrends.build_payload(kw_list, cat=0, timeframe=time_frame, geo='GB', gprop='')
+    # The tree is indexed on the geo code of every level below the country, e.g. Country, Region, City.
+    index_names = ['Country'] + [resolution_levels[level] for level in levels]
 
-    # Execute the payload request.
-    pd_ibr = pytrends.interest_by_region(resolution='GB', inc_low_vol=True, inc_geo_code=False)
+    # The country itself comes from the worldwide map, one response shared by every country fetched.
+    pd_world = fetch_response('interest_by_region', keywords, time_frame, geo='', resolution='COUNTRY', cached=cached)
+    if not pd_world.empty:
+        pd_world = pd_world[pd_world['geoCode'] == geo] if 'geoCode' in pd_world.columns else pd_world[pd_world.index == country_name(geo)]
+    frames = [region_level_report(pd_world, keywords[0], (), index_names, 'COUNTRY', range_labels[month])]
+
+    # Each level is fetched for every node of the level above, using the node's geo code as the payload's geo.
+    # Values are on the scale of their siblings: each node's children come from one payload.
+    parents = [(geo,)]
+    for level in levels:
+        payloads = run_concurrently([
+            (fetch_response, ('interest_by_region', keywords, time_frame, path[-1], level, cached)) for path in parents
+        ])
+
+        started = time.perf_counter()
+        children = []
+        for path, payload in zip(parents, payloads):
+            pd_level = region_level_report(payload, keywords[0], path, index_names, level, range_labels[month])
+            frames.append(pd_level)
+
+            # Only children with a geo code can be drilled into.
+            if 'geoCode' in payload.columns:
+                children.extend(path + (code,) for code in pd_level[index_names[len(path)]])
+        metrics.observe('stage_seconds', time.perf_counter() - started, stage='process_interest_by_region_tree')
+
+        parents = children
+
+    # Finally return every level as one tree-indexed DataFrame.
+    pd_tree = region_tree_report(frames, index_names)
+    metrics.count('rows_total', len(pd_tree), endpoint='interest_by_region')
+
+    return pd_tree
+
+
+# GET DATA FOR INTEREST BY REGION FOR MANY GEOS
+
+def manifest_unit(function, arguments):
+
+    # A unit of the run manifest is the function with every argument it is called with, e.g.
+    # ('get_interest_by_region', 1, 'GB', 'REGION'), so two calls only share a result when they are the same call.
+    return (function.__name__,) + tuple(arguments)
+
+
+def initialize_worker(shared_limiter, worker_offline, worker_proxies, worker_trends_url=None, worker_parent_directory=None,
+                      worker_archive_responses=False, worker_cache_directory=None):
+
+    # Worker processes take their tokens from the bucket shared with every other worker.
+    global limiter, offline, proxies, trends_url, parent_directory, history_directory, archive_responses, cache_directory
+    limiter = shared_limiter
+
+    # Workers started with fork inherit the parent's figures, which the parent already has.
+    metrics.drain()
+
+    # They also inherit the parent's pooled clients, whose keep-alive connections must not be shared between processes.
+    client_pool.clear()
+
+    # Workers started without fork do not inherit the settings made by main().
+    offline = worker_offline
+    proxies = worker_proxies
+    trends_url = worker_trends_url
+    archive_responses = worker_archive_responses
+    if worker_parent_directory is not None:
+        parent_directory = worker_parent_directory
+        history_directory = os.path.join(parent_directory, 'history')
+    if worker_cache_directory is not None:
+        cache_directory = worker_cache_directory
+
+
+def run_in_worker(function, arguments):
+
+    # Send the figures recorded by the call back with its result, for the parent to merge into the run's metrics.
+    result = function(*arguments)
+    return result, metrics.drain()
+
+
+def stream_interest_by_region_fan_out(geos, months=(1, 3), max_workers=4, manifest=None):
+
+    # Each worker process adapts its own proxy rates, so the workers share one budget: the rate the proxies are
+    # currently allowed in this process, within the overall cap.
+    rate = max(get_scheduler().total_rate(), get_scheduler().min_rate)
+    if limiter is not None:
+        rate = min(rate, limiter.rate)
+    shared_limiter = SharedTokenBucket(rate=rate, capacity=max(1, int(rate * 2)))
+
+    # Spread the fetch and post-processing for every geo and time frame over the worker pool.
+    calls = [(get_interest_by_region, (month, geo, 'REGION')) for geo in geos for month in months]
+
+    # With a run manifest every geo and time frame is checkpointed as it completes.
+    if manifest is not None:
+        calls = [(run_unit, (manifest, manifest_unit(function, arguments), function, arguments))
+                 for function, arguments in calls]
+
+    geo_codes = [geo for geo in geos for month in months]
+    calls = [(run_in_worker, call) for call in calls]
+
+    # Yield every geo and time frame as soon as its worker completes, with the geo code for partitioning.
+    for position, (pd_ibr, worker_metrics) in stream_in_processes(calls, max_workers, initializer=initialize_worker,
+                                                initargs=(shared_limiter, offline, proxies, trends_url, parent_directory,
+                                                          archive_responses, cache_directory)):
+        metrics.merge(*worker_metrics)
+        pd_ibr.insert(0, 'Geo', geo_codes[position])
+        yield pd_ibr
+
+
+def get_interest_by_region_fan_out(geos, months=(1, 3), max_workers=4, manifest=None):
+
+    # Finally return the merged payloads as a DateFrame.
+    return concat_reports(stream_interest_by_region_fan_out(geos, months, max_workers, manifest))
+
+
+# CRAWL THE RELATED QUERIES AND TOPICS
+
+def fetch_related_rows(batch, time_frame, geo='GB'):
 
-    # Remove index.
-    pd_ibr.reset_index(inplace=True)
+    # Execute the payload requests. Both endpoints share the token of the batch's payload.
+    dict_srch = fetch_response('related_queries', batch, time_frame, geo=geo)
+    dict_topics = fetch_response('related_topics', batch, time_frame, geo=geo)
 
-    # Rename API Columns.
-    pd_ibr.rename(columns={'geoName': 'Region', 'covid': 'Value'}, inplace=True)
+    # Flatten the top and rising queries and topics of every keyword into (source, kind, target, value) rows.
+    rows = []
+    for keyword in batch:
+        for kind, frame, column in [('top_query', dict_srch.get(keyword, {}).get('top'), 'query'),
+                                    ('rising_query', dict_srch.get(keyword, {}).get('rising'), 'query'),
+                                    ('top_topic', dict_topics.get(keyword, {}).get('top'), 'topic_title'),
+                                    ('rising_topic', dict_topics.get(keyword, {}).get('rising'), 'topic_title')]:
+            if frame is None or frame.empty or column not in frame.columns:
+                continue
+            values = pd.to_numeric(frame['value'], errors='coerce')
+            rows.extend((keyword, kind, target, value) for target, value in zip(frame[column], values))
+
+    return rows
+
+
+def crawl_related(seeds, month=1, geo='GB', max_depth=2, budget=60):
+
+    # Set value for time_frame.
+    time_frame = "today 3-m" if month == 3 else "today 1-m"
+
+    # Every level of the crawl is fetched concurrently, one payload per batch of 5 keywords.
+    def fetch_level(batches):
+        return run_concurrently([(fetch_related_rows, (batch, time_frame, geo)) for batch in batches])
+
+    pd_edges = crawl(seeds, fetch_level, max_depth=max_depth, budget=budget)
 
     # Add additional columns required for the report.
-    pd_ibr["Country"] = "United Kingdom"
-    pd_ibr["Label"] = pd_ibr["Value"]
+    pd_edges["Range"] = "Last-90-Days" if month == 3 else "Last-30-Days"
 
-    # Set value for days label.
-    if month == 1:
-        pd_ibr["Range"] = "Last-30-Days"
-    elif month == 3:
-        pd_ibr["Range"] = "Last-90-Days"
+    # Finally return the edge list as a DateFrame.
+    return pd_edges
 
-    # Change column order.
-    pd_ibr = pd_ibr[['Country', 'Region', 'Value', 'Label', 'Range']]
 
-    # Sort the DataFrame.
-    pd_ibr.sort_values(by=["Value"], inplace=True, ascending=False)
+# KEEP THE KEYWORDS FRESH FROM A LONG-RUNNING DAEMON
 
-    # Finally return the processed payload as a DateFrame.
-    return pd_ibr
+# Months of the time frames the daemon refreshes.
+daemon_time_frames = {'today 1-m': 1, 'today 3-m': 3}
 
 
-# CONCAT BOTH DATAFRAMED PAYLOADS
-def concat_payloads(pd_payload_one, pd_payload_two):
+def refresh_job(store, detector, aggregates, job):
 
-    # Concat the collection into a single DataFrame.
-    # Finally return the processed payload as a DateFrame.
-    return pd.concat([pd_payload_one, pd_payload_two])
+    # A job is (keyword, geo, endpoint, time frame). Requests made by this job, for the request budget.
+    keyword, geo, endpoint, time_frame = job
+    month = daemon_time_frames[time_frame]
+    requests_before = metrics.total('requests_total')
+    fetched_at = time.strftime('%Y-%m-%dT%H:%M:%S')
 
+    # Due jobs always go back to Google, a hot keyword can be due before its cached response expires.
+    if endpoint == 'interest_over_time':
+        pd_iot = get_interest_over_time(month, geo, [keyword], cached=False)
+        store.save_interest_over_time(pd_iot, keyword, geo, fetched_at)
+        aggregates.update_interest_over_time(pd_iot, keyword, geo, fetched_at)
 
-def create_unique_directory():
+        # The rolling statistics also give the volatility that sets how soon the keyword is due again.
+        store.save_alerts(detector.update_frame(pd_iot.assign(Series=keyword + '|' + geo)), fetched_at)
 
-    # Create a unique directory based on current date and time stamp.
-    # Stores payloads received at the end of the data pipeline.
+    elif endpoint == 'interest_by_region':
+        pd_ibr = get_interest_by_region(month, geo, 'REGION', [keyword], cached=False)
+        store.save_interest_by_region(pd_ibr, keyword, geo, fetched_at)
+        aggregates.update_interest_by_region(pd_ibr, keyword, geo, fetched_at)
 
-    # Map the individual date time elements.
-    year, month, day, hour, min, sec = map(int, time.strftime("%Y %m %d %H %M %S").split())
+    elif endpoint == 'related_queries':
+        pd_srch = get_related_queries(month, geo, [keyword], cached=False)
+        store.save_related_queries(pd_srch, keyword, geo, fetched_at)
+        aggregates.update_related_queries(pd_srch, keyword, geo, fetched_at)
 
-    # Create a unique directory name.
-    unique_directory = str(year) + str(month) + str(day) + "_" + str(hour) + str(min) + str(sec)
+    else:
+        raise ValueError("Unknown endpoint: " + endpoint)
 
-    # Create the path for the new unique directory.
-    full_path = os.path.join(parent_directory, unique_directory)
+    # Display the job for verification.
+    print("Refreshed: " + keyword + " " + geo + " " + endpoint + " " + time_frame)
 
-    # Create the directory.
-    os.mkdir(full_path)
+    return metrics.total('requests_total') - requests_before
 
-    # Finally return the full path to the new directory.
-    return full_path + "/"
 
+def job_requests(job):
 
-# =====================================================================================================================
+    # A due job always builds a fresh payload, so it makes a token and an endpoint request, plus a cookie request when
+    # no connected client is idle.
+    with client_pool_lock:
+        idle = any(client_pool.values())
+
+    return 2 if idle else 3
+
+
+def keyword_volatility(detector, job):
+
+    # Coefficient of variation of the keyword's EWMA statistics, 0 for a keyword without history yet.
+    row = detector.rows.get(job[0] + '|' + job[1])
+    if row is None or detector.mean[row] <= 0:
+        return 0.0
+
+    return float(detector.variance[row] ** 0.5 / detector.mean[row])
+
+
+def run_refresh_daemon(keywords, geos, hourly_budget=100, count=0):
 
-# 1. CREATE THE DIRECTORY.
+    # The daemon writes into the same store and rolling statistics as the pipeline.
+    os.makedirs(parent_directory, exist_ok=True)
+    store = TrendsStore(os.path.join(parent_directory, 'trends.db'))
+    aggregates = DashboardAggregates(store)
+    detector_path = os.path.join(parent_directory, 'detector.npz')
+    detector = SpikeDetector.load(detector_path)
 
-# Set the root for the unique directory locations.
-parent_directory = '/Users/julianmuscatdoublesin/PycharmProjects/PythonLibrary/ds_tableau_public/'
+    # The queue carries on from the state saved by the last daemon, for the jobs still asked for.
+    queue = RefreshQueue.load(os.path.join(parent_directory, 'queue.json'), hourly_budget=hourly_budget,
+                              job_cost=job_requests)
+    jobs = [(keyword, geo, endpoint, time_frame) for keyword in keywords for geo in geos
+            for endpoint in ['interest_over_time', 'interest_by_region', 'related_queries']
+            for time_frame in daemon_time_frames]
+    queue.retain(jobs)
+    for job in jobs:
+        queue.add(job)
 
-# Call the function that creates the unique directory for the current session.
-directory = create_unique_directory()
+    # Display the queue for verification.
+    print("")
+    print("Refresh Queue: " + str(len(queue.jobs)) + " jobs, " + str(queue.remaining_budget()) + " requests left this hour")
 
-# Display returned path for verification.
-print("")
-print("New Folder Created: " + directory)
+    try:
+        completed = run_daemon(queue, lambda job: refresh_job(store, detector, aggregates, job),
+                               lambda job: keyword_volatility(detector, job), count=count,
+                               errors=(exceptions.ResponseError, requests.exceptions.RequestException))
+    finally:
+        detector.save(detector_path)
+        store.close()
 
-# 2. GET INTEREST OVER TIME
+    return completed
 
-# Get 30-day payload.
-pd_iot_thirty = get_interest_over_time(1)
 
-# Display returned payload for verification.
-print("")
-print("Interest Over Time For The Last 30-days:")
-print(pd_iot_thirty)
+# SPLIT ONE KEYWORD LIST BETWEEN WORKER NODES
 
-# Get 90-day payload.
-pd_iot_ninety = get_interest_over_time(3)
+# Endpoints of the fetch units in the shared work queue, with the time frames of the daemon.
+queue_endpoints = ['interest_over_time', 'interest_by_region', 'related_queries']
 
-# Display returned payload for verification.
-print("")
-print("Interest Over Time For The Last 90-days:")
-print(pd_iot_ninety)
 
-# Concat both 30 and 90-day payloads into a single DataFrame.
-pd_iot_concat = concat_payloads(pd_iot_thirty, pd_iot_ninety)
+def queue_units(keywords, geos):
 
-# Display the final output for verification.
-print("")
-print("Interest Over Time Combined:")
-print(pd_iot_concat)
+    # One unit per endpoint, time frame, geo and batch of up to 5 keywords, so one request serves every keyword of the batch.
+    batches = [list(keywords[start:start + 5]) for start in range(0, len(keywords), 5)]
+    return [(endpoint, time_frame, geo, batch)
+            for endpoint in queue_endpoints for time_frame in daemon_time_frames for geo in geos for batch in batches]
 
-# Finally store the combined payloads into a CSV file.
-filename = 'multiTimeline.csv'
-pd_iot_concat.to_csv(directory + filename, index=False, header=True)
 
-# Display conformation for storage operation. The final step of the process.
-print("")
-print("Stored Interest Over Time Payload:")
-print("Filename: " + filename)
+def fetch_unit(store, aggregates, unit, fetched_at):
 
-# 3. GET INTEREST BY REGION
+    endpoint, time_frame, geo, batch = unit
+    month = daemon_time_frames[time_frame]
 
-# Get 30-day payload.
-pd_ibr_thirty = get_interest_by_region(1)
+    # Execute the payload request once for the batch.
+    resolution = 'REGION' if endpoint == 'interest_by_region' else ''
+    payload = fetch_response(endpoint, batch, time_frame, geo=geo, resolution=resolution)
 
-# Display returned payload for verification.
-print("")
-print("Regional Interest Over Time For The Last 30-days:")
-print(pd_ibr_thirty)
+    # Store every keyword of the batch. fetched_at is the time the unit was added to the round, so a unit fetched
+    # twice after its lease was reclaimed upserts the rows of its first fetch rather than adding a second set.
+    for keyword in batch:
+        if endpoint == 'interest_over_time':
+            pd_iot = interest_over_time_report(payload, keyword, range_labels[month])
+            store.save_interest_over_time(pd_iot, keyword, geo, fetched_at)
+            aggregates.update_interest_over_time(pd_iot, keyword, geo, fetched_at)
+        elif endpoint == 'interest_by_region':
+            pd_ibr = interest_by_region_report(payload, keyword, country_name(geo), range_labels[month])
+            store.save_interest_by_region(pd_ibr, keyword, geo, fetched_at)
+            aggregates.update_interest_by_region(pd_ibr, keyword, geo, fetched_at)
+        elif endpoint == 'related_queries':
+            pd_srch = related_queries_report(payload.get(keyword, {}).get('top'), range_labels[month])
+            store.save_related_queries(pd_srch, keyword, geo, fetched_at)
+            aggregates.update_related_queries(pd_srch, keyword, geo, fetched_at)
+        else:
+            raise ValueError("Unknown endpoint: " + endpoint)
 
-# Get 90-day payload.
-pd_ibr_ninety = get_interest_by_region(3)
+    # Display the unit for verification.
+    print("Fetched: " + endpoint + " " + time_frame + " " + geo + " " + ', '.join(batch))
 
-# Display returned payload for verification.
-print("")
-print("Regional Interest Over Time For The Last 90-days:")
-print(pd_ibr_ninety)
 
-# Concat both 30 and 90-day payloads into a single DataFrame.
-pd_ibr_concat = concat_payloads(pd_ibr_thirty, pd_ibr_ninety)
+def run_queue_worker(keywords, geos, round_id, worker=None, lease_seconds=300, count=0):
 
-# Display the final output for verification.
-print("")
-print("Regional Interest Over Time Combined:")
-print(pd_ibr_concat)
+    # Every worker writes into the same store and queue, in the shared parent directory.
+    os.makedirs(parent_directory, exist_ok=True)
+    store = TrendsStore(os.path.join(parent_directory, 'trends.db'))
+    aggregates = DashboardAggregates(store)
+    queue = WorkQueue(os.path.join(parent_directory, 'work_queue.db'), round_id, lease_seconds=lease_seconds)
 
-# Finally store the combined payloads into a CSV file.
-filename = 'geoMap.csv'
-pd_ibr_concat.to_csv(directory + filename, index=False, header=True)
+    # The first worker of the round adds the units, the others find them already there.
+    added = queue.add(queue_units(keywords, geos))
+    worker = worker or socket.gethostname() + ':' + str(os.getpid())
 
-# Display conformation for storage operation. The final step of the process.
-print("")
-print("Stored Regional Interest Over Time Payload:")
-print("Filename: " + filename)
+    # Display the queue for verification.
+    print("")
+    print("Work Queue: round " + round_id + ", " + str(added) + " units added, " + str(queue.outstanding())
+          + " outstanding, worker " + worker)
 
-# 4. GET RELATED SEARCH TERMS
+    try:
+        processed = run_worker(queue, worker, lambda unit: fetch_unit(store, aggregates, unit, queue.fetched_at(unit)),
+                               count=count, errors=(exceptions.ResponseError, requests.exceptions.RequestException, LookupError))
+        counts = queue.counts()
+    finally:
+        queue.close()
+        store.close()
 
-# Get 30-day payload.
-pd_srch_thirty = get_related_queries(1)
+    # Display the progress of the round.
+    print("")
+    print("Work Queue Units: " + ', '.join(state + ' ' + str(counts[state]) for state in sorted(counts)))
 
-# Display returned payload for verification.
-print("")
-print("Top Related Search Terms The Last 30-days:")
-print(pd_srch_thirty)
+    return processed
 
-# Get 90-day payload.
-pd_srch_ninety = get_related_queries(3)
 
-# Display returned payload for verification.
-print("")
-print("Top Related Search Terms The Last 90-days:")
-print(pd_srch_ninety)
+# REBUILD REPORTS FROM THE RESPONSE ARCHIVE
 
+# Range labels of the archived time frames.
+time_frame_labels = dict(hourly_range_labels, **{'today 1-m': range_labels[1], 'today 3-m': range_labels[3]})
 
-# Concat both 30 and 90-day payloads into a single DataFrame.
-pd_srch_concat = concat_payloads(pd_srch_thirty, pd_srch_ninety)
 
-# Display returned payload for verification.
-print("")
-print("Top Related Search Terms Combined:")
-print(pd_srch_concat)
+def parse_archived(entry, response, keyword):
 
-# Finally store the combined payloads into a CSV file.
-filename = 'relatedQueries.csv'
-pd_srch_concat.to_csv(directory + filename, index=False, header=True)
+    # The report frame of one keyword of an archived response, as built by the get_ functions, or None when
+    # Google returned nothing for it. Any function taking the same arguments can rebuild another schema.
+    label = time_frame_labels.get(entry['time_frame'], entry['time_frame'])
+
+    if entry['endpoint'] == 'interest_over_time':
+        return interest_over_time_report(response, keyword, label) if keyword in response.columns else None
+    elif entry['endpoint'] == 'interest_by_region':
+        return interest_by_region_report(response, keyword, country_name(entry['geo']), label) if keyword in response.columns else None
+    elif entry['endpoint'] == 'related_queries':
+        return related_queries_report(response.get(keyword, {}).get('top'), label)
+
+    raise ValueError("No report for endpoint: " + entry['endpoint'])
+
+
+def reparse_archive(endpoint, keyword=None, geo=None, since=None, until=None, parse=parse_archived):
+
+    # One report frame per archived fetch and keyword, with the search term, geo and fetch time as columns,
+    # streamed so any number of fetches can be rebuilt in one pass. The archived JSON is parsed again by pytrends.
+    archive = get_response_archive()
+    for entry, bodies in archive.responses(archive.entries(endpoint, keyword, geo, since, until)):
+        response = call_endpoint(ReplayTrendReq(entry, bodies), entry['endpoint'], entry['resolution'])
+        for term in entry['keywords']:
+            if keyword is not None and term != keyword:
+                continue
+            frame = parse(entry, response, term)
+            if frame is not None:
+                yield concat_reports([frame], Term=[term], Geo=[entry['geo']], FetchedAt=[entry['fetched_at']])
+
+
+# CONCAT ANY NUMBER OF DATAFRAMED PAYLOADS
+def concat_payloads(*payloads):
+
+    # Concat the collection into a single DataFrame, filling one preallocated array per column.
+    # Finally return the processed payload as a DateFrame.
+    return concat_reports(payloads)
+
+
+def create_unique_directory():
+
+    # Create a unique directory based on current date and time stamp.
+    # Stores payloads received at the end of the data pipeline.
+
+    # Map the individual date time elements.
+    year, month, day, hour, min, sec = map(int, time.strftime("%Y %m %d %H %M %S").split())
+
+    # Create a unique directory name.
+    unique_directory = str(year) + str(month) + str(day) + "_" + str(hour) + str(min) + str(sec)
+
+    # Create the path for the new unique directory.
+    full_path = os.path.join(parent_directory, unique_directory)
+
+    # Create the directory.
+    os.mkdir(full_path)
+
+    # Finally return the full path to the new directory.
+    return full_path + "/"
+
+
+# =====================================================================================================================
 
-# Display conformation for storage operation. The final step of the process.
-print("")
-print("Stored Related Search Terms Payload:")
-print("Filename: " + filename)
\ No newline at end of file
+# RUN THE PIPELINE FROM THE COMMAND LINE
+
+def region_levels_argument(text):
+
+    # The tree of the pipeline is fetched for the UK.
+    try:
+        return check_levels('GB', text.split(','))
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def main(argv=None):
+
+    global offline, parent_directory, history_directory, proxies, trends_url, archive_responses, limiter
+
+    # 1. READ THE COMMAND LINE.
+
+    parser = argparse.ArgumentParser(description="Download Google Search Trends data for the Tableau dashboard.")
+    parser.add_argument('--offline', action='store_true',
+                        help="rebuild the files purely from cached responses, without connecting to Google")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only request the days missing from the stored interest over time history")
+    parser.add_argument('--geos', type=lambda text: text.split(','), default=[],
+                        help="comma separated ISO geo codes to fan interest by region out over, e.g. GB,US,DE")
+    parser.add_argument('--directory', default=parent_directory,
+                        help="root for the store, the incremental histories and the exported files")
+    parser.add_argument('--proxies', type=lambda text: text.split(','), default=[],
+                        help="comma separated proxies to rotate through, e.g. https://34.203.233.13:80")
+    parser.add_argument('--max-rate', type=float,
+                        help="hard cap in requests per second over every proxy, on top of the rate adapted per proxy")
+    parser.add_argument('--trends-url',
+                        help="stand-in for trends.google.com, e.g. the stub server at http://127.0.0.1:8765/trends")
+    parser.add_argument('--crawl-depth', type=int, default=0,
+                        help="crawl related queries and topics from the keywords up to this depth, 0 to skip")
+    parser.add_argument('--crawl-budget', type=int, default=60,
+                        help="maximum number of requests the crawl may spend")
+    parser.add_argument('--resume', action='store_true',
+                        help="resume the last run that did not complete, only fetching the units still missing")
+    parser.add_argument('--poll', choices=['now 1-H', 'now 4-H', 'now 1-d', 'now 7-d'],
+                        help="poll the hourly interest over time on a schedule instead of running the pipeline")
+    parser.add_argument('--poll-interval', type=int, default=300,
+                        help="seconds between two polls")
+    parser.add_argument('--flush-interval', type=int, default=900,
+                        help="seconds between two flushes of the ring buffers to disk")
+    parser.add_argument('--poll-count', type=int, default=0,
+                        help="number of polls before stopping, 0 to poll until interrupted")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep the keywords fresh from a long-running daemon instead of running the pipeline")
+    parser.add_argument('--keywords', type=lambda text: text.split(','), default=kw_list,
+                        help="comma separated keywords the daemon keeps fresh")
+    parser.add_argument('--hourly-budget', type=int, default=100,
+                        help="maximum number of requests the daemon may make per hour")
+    parser.add_argument('--job-count', type=int, default=0,
+                        help="number of jobs the daemon runs before stopping, 0 to run until interrupted")
+    parser.add_argument('--region-levels', type=region_levels_argument, default=[],
+                        help="comma separated levels below the country, e.g. REGION,CITY, exported as a region tree")
+    parser.add_argument('--no-archive', action='store_true',
+                        help="do not archive the responses fetched from Google")
+    parser.add_argument('--reparse', choices=['interest_over_time', 'interest_by_region', 'related_queries'],
+                        help="rebuild the reports of an endpoint from the response archive instead of running the pipeline")
+    parser.add_argument('--archive-stats', action='store_true',
+                        help="display the fetches, objects and bytes held by the response archive and exit")
+    parser.add_argument('--since',
+                        help="first fetch time re-parsed from the archive, e.g. 2026-01-01")
+    parser.add_argument('--until',
+                        help="last fetch time re-parsed from the archive, e.g. 2026-06-30T23:59:59")
+    parser.add_argument('--worker', action='store_true',
+                        help="claim fetch units of the keywords from the work queue shared with other worker nodes")
+    parser.add_argument('--round', default=time.strftime('%Y-%m-%d'),
+                        help="refresh round shared by the worker nodes, by default today's date")
+    parser.add_argument('--worker-id',
+                        help="name of this worker in the work queue, by default host name and process id")
+    parser.add_argument('--lease-seconds', type=int, default=300,
+                        help="seconds a claimed unit is held before another worker may reclaim it")
+    args = parser.parse_args(argv)
+
+    # Apply the settings used by the fetchers.
+    offline = args.offline
+    parent_directory = args.directory
+    history_directory = os.path.join(parent_directory, 'history')
+    proxies = args.proxies
+    trends_url = args.trends_url
+    limiter = TokenBucket(rate=args.max_rate, capacity=max(1, int(args.max_rate))) if args.max_rate else None
+    archive_responses = not args.no_archive
+    incremental = args.incremental
+    geos = args.geos
+
+    # Display the size of the response archive, e.g. to see how much the content addressing saves.
+    if args.archive_stats:
+        stats = get_response_archive().stats()
+
+        print("")
+        print("Response Archive: " + os.path.join(parent_directory, 'archive'))
+        print("Fetches: " + str(stats['fetches']) + ", Objects: " + str(stats['objects']))
+        print("Bytes: " + str(stats['bytes']) + ", Stored Bytes: " + str(stats['stored_bytes']))
+        return
+
+    # Re-parse mode rebuilds the reports of one endpoint from the archived responses, without any request to Google.
+    if args.reparse:
+        reparsed_path = os.path.join(parent_directory, 'reparsed', args.reparse + '.csv')
+        rows = write_stream(reparse_archive(args.reparse, since=args.since, until=args.until),
+                            [StreamingWriter(reparsed_path)])
+
+        # Display conformation for the re-parse.
+        print("")
+        print("Re-parsed From The Archive: " + reparsed_path)
+        print("Rows: " + str(rows))
+        return
+
+    # Polling mode keeps the latest hours in memory and skips the full pipeline.
+    if args.poll:
+        polls = poll_interest_over_time(kw_list, args.poll, args.poll_interval, args.flush_interval, args.poll_count)
+
+        # Display conformation for the polling.
+        print("")
+        print("Polls Completed: " + str(polls))
+        return
+
+    # Daemon mode refreshes every keyword, geo, endpoint and time frame as it falls due, within the request budget.
+    if args.daemon:
+        jobs = run_refresh_daemon(args.keywords, geos or ['GB'], args.hourly_budget, args.job_count)
+
+        # Display conformation for the daemon.
+        print("")
+        print("Jobs Completed: " + str(jobs))
+        return
+
+    # Worker mode splits the keywords, geos, endpoints and time frames with the other workers sharing the directory.
+    if args.worker:
+        units = run_queue_worker(args.keywords, geos or ['GB'], args.round, args.worker_id, args.lease_seconds,
+                                 args.job_count)
+
+        # Display conformation for the worker.
+        print("")
+        print("Units Processed: " + str(units))
+        return
+
+    # 2. OPEN THE STORE.
+
+    # Every run is written into the same indexed database, in a directory created on the first run.
+    os.makedirs(parent_directory, exist_ok=True)
+    store = TrendsStore(os.path.join(parent_directory, 'trends.db'))
+
+    # The dashboard aggregates are updated as every payload is stored.
+    aggregates = DashboardAggregates(store)
+
+    # Display the store for verification.
+    print("")
+    print("Store Opened: " + store.path)
+
+    # Resume the last incomplete run, or start a new one. Runs too old to resume have their results deleted.
+    runs_directory = os.path.join(parent_directory, 'runs')
+    RunManifest.expire(runs_directory)
+    run_id = RunManifest.latest_incomplete(runs_directory) if args.resume else None
+
+    fetched_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+    if run_id is None:
+        run_id = fetched_at.replace(':', '')
+
+    # The manifest records every completed unit of work. All rows stored by the run share the same fetch time.
+    manifest = RunManifest(runs_directory, run_id, settings={
+        'fetched_at': fetched_at, 'keywords': kw_list, 'incremental': incremental, 'geos': geos})
+
+    # A resumed run keeps the settings and fetch time of the run that failed.
+    fetched_at = manifest.settings['fetched_at']
+    incremental = manifest.settings['incremental']
+    geos = manifest.settings['geos']
+
+    # Display the run for verification.
+    print("")
+    print("Run: " + run_id + " (" + str(len(manifest.completed_units())) + " units already completed)")
+
+    # 3. GET ALL PAYLOADS
+
+    # In incremental mode interest over time comes from the stored history, refreshed with one small request.
+    # A history that cannot be refreshed falls back to the full fetch for this run.
+    history = None
+    if incremental:
+        try:
+            history = run_unit(manifest, manifest_unit(refresh_interest_over_time, (kw_list[0], 'GB')),
+                               refresh_interest_over_time, (kw_list[0], 'GB'))
+        except ValueError as error:
+            print("")
+            print("Incremental Refresh Failed, Fetching The Full Time Frames: " + str(error))
+
+    if history is not None:
+        iot_calls = [(get_interest_over_time_from_history, (history, 1)), (get_interest_over_time_from_history, (history, 3))]
+    else:
+        iot_calls = [(get_interest_over_time, (1,)), (get_interest_over_time, (3,))]
+
+    calls = iot_calls + [
+        (get_interest_by_region, (1,)),
+        (get_interest_by_region, (3,)),
+        (get_related_queries, (1,)),
+        (get_related_queries, (3,)),
+    ]
+
+    # Every fetch is a unit of the run manifest: the function and its arguments. Completed units are not fetched again.
+    # The windows cut from the stored history are not fetches, and are cut again on resume.
+    calls = [(run_unit, (manifest, manifest_unit(function, arguments), function, arguments))
+             if function is not get_interest_over_time_from_history else (function, arguments)
+             for function, arguments in calls]
+
+    # The six payloads are independent, so they are fetched concurrently within the limits of the shared rate limiter.
+    pd_iot_thirty, pd_iot_ninety, pd_ibr_thirty, pd_ibr_ninety, pd_srch_thirty, pd_srch_ninety = run_concurrently(calls)
+
+    # 4. INTEREST OVER TIME
+
+    # Display returned payload for verification.
+    print("")
+    print("Interest Over Time For The Last 30-days:")
+    print(pd_iot_thirty)
+
+    # Display returned payload for verification.
+    print("")
+    print("Interest Over Time For The Last 90-days:")
+    print(pd_iot_ninety)
+
+    # Finally store both payloads one after the other, rather than concatenating them first.
+    with metrics.timed('write_store'):
+        for pd_iot in [pd_iot_thirty, pd_iot_ninety]:
+            store.save_interest_over_time(pd_iot, kw_list[0], 'GB', fetched_at)
+            aggregates.update_interest_over_time(pd_iot, kw_list[0], 'GB', fetched_at)
+
+    # Display conformation for storage operation.
+    print("")
+    print("Stored Interest Over Time Payload:")
+    print("Rows: " + str(len(pd_iot_thirty) + len(pd_iot_ninety)))
+
+    # Update the rolling statistics with the days this fetch adds and store any spikes as alerts.
+    detector_path = os.path.join(parent_directory, 'detector.npz')
+    detector = SpikeDetector.load(detector_path)
+
+    with metrics.timed('detect_spikes'):
+        pd_alerts = detector.update_frame(pd_iot_ninety.assign(Series=kw_list[0] + '|GB'))
+        store.save_alerts(pd_alerts, fetched_at)
+        detector.save(detector_path)
+
+    # Display the spikes found for verification.
+    print("")
+    print("Spikes Detected:")
+    print(pd_alerts)
+
+    # 5. INTEREST BY REGION
+
+    # Display returned payload for verification.
+    print("")
+    print("Regional Interest Over Time For The Last 30-days:")
+    print(pd_ibr_thirty)
+
+    # Display returned payload for verification.
+    print("")
+    print("Regional Interest Over Time For The Last 90-days:")
+    print(pd_ibr_ninety)
+
+    # Finally store both payloads one after the other, rather than concatenating them first.
+    with metrics.timed('write_store'):
+        for pd_ibr in [pd_ibr_thirty, pd_ibr_ninety]:
+            store.save_interest_by_region(pd_ibr, kw_list[0], 'GB', fetched_at)
+            aggregates.update_interest_by_region(pd_ibr, kw_list[0], 'GB', fetched_at)
+
+    # Display conformation for storage operation.
+    print("")
+    print("Stored Regional Interest Over Time Payload:")
+    print("Rows: " + str(len(pd_ibr_thirty) + len(pd_ibr_ninety)))
+
+    # 6. RELATED SEARCH TERMS
+
+    # Display returned payload for verification.
+    print("")
+    print("Top Related Search Terms The Last 30-days:")
+    print(pd_srch_thirty)
+
+    # Display returned payload for verification.
+    print("")
+    print("Top Related Search Terms The Last 90-days:")
+    print(pd_srch_ninety)
+
+    # Finally store both payloads one after the other, rather than concatenating them first.
+    with metrics.timed('write_store'):
+        for pd_srch in [pd_srch_thirty, pd_srch_ninety]:
+            store.save_related_queries(pd_srch, kw_list[0], 'GB', fetched_at)
+            aggregates.update_related_queries(pd_srch, kw_list[0], 'GB', fetched_at)
+
+    # Display conformation for storage operation.
+    print("")
+    print("Stored Related Search Terms Payload:")
+    print("Rows: " + str(len(pd_srch_thirty) + len(pd_srch_ninety)))
+
+    # 7. EXPORT FOR THE TABLEAU DASHBOARD
+
+    # The dashboard files are a query over the latest run in the store.
+    export_directory = os.path.join(parent_directory, 'tableau') + "/"
+    os.makedirs(export_directory, exist_ok=True)
+    with metrics.timed('write_csv'):
+        store.export_tableau(kw_list[0], 'GB', export_directory)
+
+    # Display conformation for the export. The final step of the process.
+    print("")
+    print("Exported Tableau Files: " + export_directory)
+    print("Filenames: multiTimeline.csv, geoMap.csv, relatedQueries.csv")
+
+    # Alongside the CSV files, write compact Parquet datasets partitioned by fetch date when pyarrow is installed.
+    # The overlapping 30 and 90-day windows are stored once per date, region or query, with one value column per window.
+    # The run's file replaces any earlier file of the same run once complete.
+    parquet_directory = os.path.join(parent_directory, 'parquet')
+    if parquet_available():
+        with metrics.timed('write_parquet'):
+            for name, keys, payloads in [('multiTimeline', ['Date'], [pd_iot_thirty, pd_iot_ninety]),
+                                         ('geoMap', ['Country', 'Region'], [pd_ibr_thirty, pd_ibr_ninety]),
+                                         ('relatedQueries', ['Keyword'], [pd_srch_thirty, pd_srch_ninety])]:
+                write_stream([compact_windows(payloads, keys)],
+                             [StreamingWriter(dataset_file(parquet_directory, name, fetched_at[:10], run_id))])
+
+        print("")
+        print("Exported Parquet Datasets: " + parquet_directory)
+
+    # 8. INTEREST BY REGION FOR MANY GEOS
+
+    if geos:
+
+        # One regional CSV file for every geo, and one Parquet file per run with the geo code as a column.
+        writers = [StreamingWriter(export_directory + 'geoMapGeos.csv')]
+        if parquet_available():
+            writers.append(StreamingWriter(dataset_file(parquet_directory, 'geoMapGeos', fetched_at[:10], run_id)))
+
+        # Each geo and time frame is stored with its regional ranks.
+        def store_geo(pd_ibr_geo):
+            store.save_interest_by_region(pd_ibr_geo, kw_list[0], None, fetched_at)
+            aggregates.update_interest_by_region(pd_ibr_geo, kw_list[0], None, fetched_at)
+
+        # Fetch and process every geo on the worker pool. Each geo and time frame is stored and appended to the files
+        # as soon as its worker completes, so the run never holds more than one regional payload at a time.
+        with metrics.timed('write_geos'):
+            rows = write_stream(stream_interest_by_region_fan_out(geos, manifest=manifest), writers, on_chunk=store_geo)
+
+        # Display conformation for storage operation.
+        print("")
+        print("Stored Regional Interest Over Time Payload For " + str(len(geos)) + " Geos:")
+        print("Rows: " + str(rows))
+
+    # Interest by region of the UK as a tree of the requested levels below the country, e.g. regions and cities.
+    if args.region_levels:
+        with metrics.timed('region_tree'):
+            pd_trees = [run_unit(manifest, manifest_unit(get_interest_by_region_tree, (month, 'GB', args.region_levels)),
+                                 get_interest_by_region_tree, (month, 'GB', args.region_levels)) for month in (1, 3)]
+
+        # Export both time frames with the path of geo codes of every row as columns.
+        with metrics.timed('write_csv'):
+            write_stream([pd_tree.reset_index() for pd_tree in pd_trees], [StreamingWriter(export_directory + 'geoMapTree.csv')])
+
+        # Display returned payload for verification.
+        print("")
+        print("Regional Interest Tree For The Last 30-days:")
+        print(pd_trees[0])
+
+    # Export the dashboard extracts once every payload of the run is stored. Their size does not grow with the history.
+    with metrics.timed('write_csv'):
+        aggregates.export_extracts(export_directory)
+
+    # Display conformation for the export.
+    print("")
+    print("Exported Dashboard Extracts: " + export_directory)
+    print("Filenames: keywordSummary.csv, regionRank.csv, relatedMovement.csv")
+
+    # 9. RELATED QUERY GRAPH
+
+    if args.crawl_depth:
+
+        # Crawl breadth-first from the keywords within the request budget.
+        pd_edges = run_unit(manifest, manifest_unit(crawl_related, (kw_list, 1, 'GB', args.crawl_depth, args.crawl_budget)),
+                            crawl_related, (kw_list, 1, 'GB', args.crawl_depth, args.crawl_budget))
+
+        # Store the edge list and export it next to the dashboard files.
+        with metrics.timed('write_store'):
+            store.save_related_edges(pd_edges, 'GB', fetched_at)
+        with metrics.timed('write_csv'):
+            write_stream([pd_edges], [StreamingWriter(export_directory + 'relatedGraph.csv')])
+
+        # Display conformation for storage operation.
+        print("")
+        print("Stored Related Query Graph:")
+        print("Edges: " + str(len(pd_edges)))
+
+    # Close the store at the end of the run, which is no longer offered for resuming.
+    store.close()
+    manifest.complete()
+
+    # 10. EXPORT THE RUN METRICS
+
+    # A JSON run report and a Prometheus text file, e.g. for the node exporter's textfile collector.
+    metrics_directory = os.path.join(parent_directory, 'metrics')
+    os.makedirs(metrics_directory, exist_ok=True)
+    metrics.export_json(os.path.join(metrics_directory, 'run_' + fetched_at.replace(':', '') + '.json'))
+    metrics.export_prometheus(os.path.join(metrics_directory, 'google_trends.prom'))
+
+    # Display conformation for the export.
+    print("")
+    print("Exported Run Metrics: " + metrics_directory)
+
+
+# Run the pipeline only when executed as a script, so importing the module has no side effects.
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Description: Compressed, content-addressed archive of the raw responses returned by Google Trends.
+
+Only the post-processed report frames used to survive a run, so any change to the report schema
+meant fetching the history from Google again. The JSON bodies Google returns for a fetch are
+archived as received, before pytrends parses them: each body is named after the SHA-256 hash of its
+bytes and gzip-compressed into objects/<first two characters>/<hash>.json.gz, so a body received
+again unchanged is only stored once. An append-only index.jsonl records every fetch - endpoint,
+keywords, time frame, geo, resolution, fetch time, and the hash and widget request of each body -
+and selects the fetches to re-parse.
+
+Re-parsing decodes the archived JSON again and runs it through the parsing of the installed pytrends
+(ReplayTrendReq), so a fix to the parsing or to the report schema applies to the whole history, and
+the hashes do not depend on the pandas or pickle version.
+
+The index is appended to under a file lock, so worker threads and processes can share the archive.
+
+"""
+
+from collections import deque
+from contextlib import contextmanager
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from pytrends.request import TrendReq
+
+
+class ResponseArchive(object):
+
+    def __init__(self, directory, compression_level=6):
+
+        # Store the settings for the archive.
+        self.directory = directory
+        self.compression_level = compression_level
+        self.objects_directory = os.path.join(directory, 'objects')
+        self.index_path = os.path.join(directory, 'index.jsonl')
+        self.lock_path = os.path.join(directory, 'index.lock')
+        self.lock = threading.Lock()
+
+        # Create the directory on first use.
+        os.makedirs(self.objects_directory, exist_ok=True)
+
+    @contextmanager
+    def locked(self):
+
+        # The thread lock covers this process, the file lock every other process using the directory.
+        with self.lock, open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_directory, digest[:2], digest + '.json.gz')
+
+    # ARCHIVE THE RESPONSES
+
+    def put(self, key, bodies, fetched_at=None):
+
+        # The key is the one of the response cache: (endpoint, kw_list, timeframe, geo, resolution). bodies are the
+        # (widget request, JSON text) pairs received for the fetch, in the order they were requested.
+        endpoint, kw_list, time_frame, geo, resolution = key
+        parts = []
+        size = 0
+
+        with self.locked():
+            for request, body in bodies:
+                data = body.encode('utf-8')
+                digest = hashlib.sha256(data).hexdigest()
+                path = self.object_path(digest)
+                parts.append({'digest': digest, 'request': request})
+                size += len(data)
+
+                # Identical bodies share one object.
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    temporary_path = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+                    with gzip.open(temporary_path, 'wb', compresslevel=self.compression_level) as object_file:
+                        object_file.write(data)
+                    os.replace(temporary_path, path)
+
+            entry = {
+                'endpoint': endpoint,
+                'keywords': list(kw_list),
+                'time_frame': time_frame,
+                'geo': geo,
+                'resolution': resolution,
+                'fetched_at': fetched_at or time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'parts': parts,
+                'size': size,
+            }
+            with open(self.index_path, 'a') as index_file:
+                index_file.write(json.dumps(entry) + '\n')
+
+        return [part['digest'] for part in parts]
+
+    def load(self, digest):
+
+        # The archived body decoded again, as pytrends decodes it.
+        with gzip.open(self.object_path(digest), 'rb') as object_file:
+            return json.loads(object_file.read().decode('utf-8'))
+
+    # SELECT THE RESPONSES TO RE-PARSE
+
+    def entries(self, endpoint=None, keyword=None, geo=None, since=None, until=None):
+
+        # Index entries in the order they were fetched, filtered on endpoint, keyword, geo and fetch time,
+        # e.g. since='2026-01-01' and until='2026-06-30T23:59:59'.
+        if not os.path.exists(self.index_path):
+            return []
+
+        selected = []
+        with open(self.index_path) as index_file:
+            for line in index_file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if endpoint is not None and entry['endpoint'] != endpoint:
+                    continue
+                if keyword is not None and keyword not in entry['keywords']:
+                    continue
+                if geo is not None and entry['geo'] != geo:
+                    continue
+                if since is not None and entry['fetched_at'] < since:
+                    continue
+                if until is not None and entry['fetched_at'] > until:
+                    continue
+                selected.append(entry)
+
+        return selected
+
+    def responses(self, entries):
+
+        # Every selected entry with its decoded bodies. Consecutive fetches of the same bodies decompress them once.
+        loaded = {}
+        for entry in entries:
+            digests = [part['digest'] for part in entry['parts']]
+            loaded = {digest: loaded[digest] if digest in loaded else self.load(digest) for digest in digests}
+            yield entry, [loaded[digest] for digest in digests]
+
+    def stats(self):
+
+        # Fetches recorded, distinct objects and their size before and after compression.
+        entries = self.entries()
+        objects = {part['digest'] for entry in entries for part in entry['parts']}
+        stored = sum(os.path.getsize(self.object_path(digest)) for digest in objects if os.path.exists(self.object_path(digest)))
+
+        return {'fetches': len(entries), 'objects': len(objects), 'bytes': sum(entry['size'] for entry in entries),
+                'stored_bytes': stored}
+
+
+# RE-PARSE WITH PYTRENDS
+
+class ReplayTrendReq(TrendReq):
+
+    def __init__(self, entry, bodies):
+
+        # No cookie is requested: every request of the endpoint calls is answered by the archived bodies, in the
+        # order they were fetched. The widgets hold the archived requests, e.g. the keyword of each related query.
+        self.tz = 0
+        self.kw_list = list(entry['keywords'])
+        self.geo = entry['geo']
+        self.bodies = deque(bodies)
+
+        widgets = [{'request': json.loads(part['request']) if part['request'] else {}, 'token': ''}
+                   for part in entry['parts']]
+        self.interest_over_time_widget = widgets[0] if widgets else {'request': {}, 'token': ''}
+        self.interest_by_region_widget = widgets[0] if widgets else {'request': {}, 'token': ''}
+        self.related_queries_widget_list = widgets
+        self.related_topics_widget_list = widgets
+
+    def _get_data(self, url, method=TrendReq.GET_METHOD, trim_chars=0, **kwargs):
+        return self.bodies.popleft()
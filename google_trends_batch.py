@@ -0,0 +1,72 @@
+"""
+Description: Keyword batching for keyword lists longer than the 5 keywords allowed per payload.
+
+Google scales every payload on its own, so values from two payloads cannot be compared directly.
+Each batch therefore carries the same anchor keyword plus up to 4 other keywords. The anchor's
+series in each batch gives the factor that brings the batch onto the scale of the first batch,
+after which all keywords are rescaled together onto a single 0-100 scale.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+# Google accepts up to 5 keywords per payload.
+max_keywords = 5
+
+
+# PLAN THE PAYLOADS
+
+def plan_batches(keywords, anchor, batch_size=max_keywords):
+
+    # Keep the keyword order but drop duplicates and the anchor itself.
+    others = [keyword for keyword in dict.fromkeys(keywords) if keyword != anchor]
+
+    # One slot in every payload is taken by the anchor.
+    slots = batch_size - 1
+
+    # An anchor on its own still needs one payload.
+    if not others:
+        return [[anchor]]
+
+    return [[anchor] + others[start:start + slots] for start in range(0, len(others), slots)]
+
+
+# BRING THE BATCHES ONTO ONE SCALE
+
+def rescale_batches(frames, batches, anchor):
+
+    # Every payload for the same time frame returns the same dates, taken from the first batch.
+    dates = frames[0].index
+
+    # Anchor series per batch, shape (batches, dates).
+    anchors = np.vstack([frame[anchor].to_numpy(dtype=float) for frame in frames])
+    anchor_totals = anchors.sum(axis=1)
+
+    if (anchor_totals == 0).any():
+        raise ValueError("The anchor keyword '" + anchor + "' has no interest in at least one batch.")
+
+    # Factor that brings each batch onto the scale of the first batch.
+    factors = anchor_totals[0] / anchor_totals
+
+    # Scale every batch in one step and keep the anchor column from the first batch only.
+    columns = [anchor]
+    blocks = [anchors[0][:, np.newaxis]]
+    for frame, batch, factor in zip(frames, batches, factors):
+        others = batch[1:]
+        columns.extend(others)
+        blocks.append(frame[others].to_numpy(dtype=float) * factor)
+
+    values = np.hstack(blocks)
+
+    # Rescale all keywords together so the highest value across the whole list is 100.
+    peak = values.max()
+    if peak > 0:
+        values = values * (100.0 / peak)
+
+    # Return a long-format frame: one row per date and keyword.
+    return pd.DataFrame({
+        'Date': np.repeat(dates.to_numpy(), len(columns)),
+        'Keyword': np.tile(np.array(columns, dtype=object), len(dates)),
+        'Value': values.ravel(),
+    })
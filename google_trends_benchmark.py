@@ -0,0 +1,176 @@
+"""
+Description: Reproducible benchmark suite for the pipeline, run offline against the stub server.
+
+Starts the stand-in of google_trends_stub.py and runs the fetchers of google_trends_api_func.py
+against it for every combination of keyword count, geo count and time frame length, each with an
+empty response cache. For every case it reports the requests per second, the end-to-end run time,
+the peak memory allocated by Python and the time spent post-processing the payloads, so the effect
+of every performance change can be measured without connecting to Google.
+
+Peak memory is traced with tracemalloc, whose overhead applies to every case alike.
+
+python google_trends_benchmark.py --keywords=1,5,20 --geos=1,4 --days=30,90,365 --latency=0.05
+
+"""
+
+import argparse
+import datetime
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import google_trends_api_func as pipeline
+from google_trends_engine import run_concurrently
+from google_trends_metrics import Metrics
+from google_trends_proxy import ProxyScheduler
+from google_trends_stub import StubTrends, StubServer
+
+# Geos taken in order as the geo count grows.
+benchmark_geos = ['GB', 'US', 'DE', 'FR', 'ES', 'IT', 'NL', 'SE', 'JP', 'BR', 'IN', 'AU']
+
+
+# PREPARE THE PIPELINE FOR A CASE
+
+def reset_pipeline(trends_url, cache_directory, rate):
+
+    # Every case starts from an empty cache, fresh metrics, new clients and a fresh scheduler, which paces the
+    # requests at the given rate rather than the few requests per second that are safe with Google. Stub responses
+    # are not archived.
+    pipeline.trends_url = trends_url
+    pipeline.offline = False
+    pipeline.archive_responses = False
+    pipeline.proxies = []
+    pipeline.cache_directory = cache_directory
+    pipeline.response_cache = None
+    pipeline.scheduler = ProxyScheduler([], initial_rate=rate, max_rate=rate, capacity=max(1, int(rate)))
+    pipeline.metrics = Metrics()
+    pipeline.limiter = None
+    pipeline.client_pool.clear()
+    pipeline.payload_cache.clear()
+
+
+def case_calls(keywords, geos, days):
+
+    # The fetches of one run: interest over time for every keyword, interest by region and related queries
+    # for every keyword and geo. Up to 90 days come from the 30 or 90-day time frames, longer ones are stitched.
+    month = 1 if days <= 30 else 3
+    if days <= 90:
+        calls = [(pipeline.get_interest_over_time_batched, (keywords, month))]
+    else:
+        end_date = datetime.date.today()
+        start_date = end_date - datetime.timedelta(days=days - 1)
+        calls = [(pipeline.get_interest_over_time_range, (keyword, start_date, end_date)) for keyword in keywords]
+
+    for geo in geos:
+        for keyword in keywords:
+            calls.append((pipeline.get_interest_by_region, (month, geo, 'REGION', [keyword])))
+            calls.append((pipeline.get_related_queries, (month, geo, [keyword])))
+
+    return calls
+
+
+def processing_seconds(metrics):
+
+    # Time spent in the post-processing stages of the fetchers.
+    return sum(histogram['sum'] for (name, labels), histogram in metrics.histograms.items()
+               if name == 'stage_seconds' and dict(labels).get('stage', '').startswith('process_'))
+
+
+# RUN ONE CASE
+
+def run_case(trends_url, keyword_count, geo_count, days, rate):
+
+    keywords = ['keyword ' + str(index + 1) for index in range(keyword_count)]
+    geos = benchmark_geos[:geo_count]
+
+    cache_directory = tempfile.mkdtemp(prefix='google_trends_benchmark_')
+    reset_pipeline(trends_url, cache_directory, rate)
+
+    try:
+        tracemalloc.start()
+        started = time.perf_counter()
+        frames = run_concurrently(case_calls(keywords, geos, days))
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        shutil.rmtree(cache_directory, ignore_errors=True)
+
+    metrics = pipeline.metrics
+    requests_made = metrics.total('requests_total')
+
+    return {
+        'keywords': keyword_count,
+        'geos': geo_count,
+        'days': days,
+        'requests': requests_made,
+        'throttled': metrics.total('throttled_total'),
+        'retries': metrics.total('retries_total'),
+        'rows': sum(len(frame) for frame in frames),
+        'run_seconds': round(elapsed, 3),
+        'requests_per_second': round(requests_made / elapsed, 2) if elapsed else 0.0,
+        'processing_seconds': round(processing_seconds(metrics), 4),
+        'peak_memory_mb': round(peak / (1024 * 1024), 2),
+    }
+
+
+# RUN THE BENCHMARK SUITE FROM THE COMMAND LINE
+
+def main(argv=None):
+
+    numbers = lambda text: [int(part) for part in text.split(',')]
+
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline offline against the stub Trends server.")
+    parser.add_argument('--keywords', type=numbers, default=[1, 5, 20], help="keyword counts, e.g. 1,5,20")
+    parser.add_argument('--geos', type=numbers, default=[1, 4], help="geo counts, e.g. 1,4")
+    parser.add_argument('--days', type=numbers, default=[30, 90, 365], help="time frame lengths in days, e.g. 30,90,365")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per case, the median run is reported")
+    parser.add_argument('--rate', type=float, default=1000.0, help="requests per second allowed per proxy by the scheduler")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds every stub request waits")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="share of stub requests answered with a 429")
+    parser.add_argument('--regions', type=int, default=40, help="regions per interest by region response")
+    parser.add_argument('--related', type=int, default=25, help="top and rising entries per related response")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the synthetic data and the 429s")
+    parser.add_argument('--output', default='benchmark_results.csv', help="CSV file the results are written to")
+    args = parser.parse_args(argv)
+
+    # Start the stand-in for trends.google.com.
+    server = StubServer(StubTrends(latency=args.latency, throttle_rate=args.throttle_rate, regions=args.regions,
+                                   related=args.related, seed=args.seed))
+    trends_url = server.start()
+
+    # Display the stub server for verification.
+    print("")
+    print("Stub Trends Server: " + trends_url)
+
+    results = []
+    try:
+        for days in args.days:
+            for geo_count in args.geos:
+                for keyword_count in args.keywords:
+                    runs = [run_case(trends_url, keyword_count, geo_count, days, args.rate) for _ in range(args.repeat)]
+                    result = sorted(runs, key=lambda run: run['run_seconds'])[len(runs) // 2]
+                    results.append(dict(result, latency=args.latency, throttle_rate=args.throttle_rate))
+
+                    # Display every case as it completes.
+                    print(str(keyword_count) + " keywords, " + str(geo_count) + " geos, " + str(days) + " days: "
+                          + str(result['run_seconds']) + "s, " + str(result['requests_per_second']) + " requests/s")
+    finally:
+        server.stop()
+
+    # Finally write the results for comparison with other commits.
+    pd_results = pd.DataFrame(results)
+    pd_results.to_csv(args.output, index=False, header=True)
+
+    print("")
+    print("Benchmark Results:")
+    print(pd_results.to_string(index=False))
+    print("")
+    print("Written To: " + args.output)
+
+
+if __name__ == '__main__':
+    main()
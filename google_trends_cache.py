@@ -0,0 +1,176 @@
+"""
+Description: Persistent on-disk cache for the responses returned by the Google Trends API.
+
+Each response is pickled into its own file inside the cache directory. An index file records
+when every entry was fetched, when it was last read and how large it is, so that expired
+entries can be refetched and the least recently used entries removed once the cache grows
+beyond its size limit.
+
+Entries are keyed on (endpoint, kw_list, timeframe, geo, resolution).
+
+The index is reread under a file lock, shared by readers and exclusive for writers, so worker
+threads and processes can share the same cache directory. Reads only record their access time in
+memory, and the access times are written into the index with the next response stored.
+
+"""
+
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+# Seconds a cached response stays fresh, per endpoint.
+default_ttl = {
+    'interest_over_time': 4 * 60 * 60,
+    'interest_by_region': 12 * 60 * 60,
+    'related_queries': 24 * 60 * 60,
+    'related_topics': 24 * 60 * 60,
+}
+
+# Upper limit for the total size of the cached responses.
+default_max_bytes = 256 * 1024 * 1024
+
+
+class ResponseCache(object):
+
+    def __init__(self, directory, ttl=None, max_bytes=default_max_bytes):
+
+        # Store the settings for the cache.
+        self.directory = directory
+        self.ttl = dict(default_ttl, **(ttl or {}))
+        self.max_bytes = max_bytes
+
+        # The index describes every file held in the cache directory.
+        self.index_path = os.path.join(directory, 'index.json')
+        self.lock_path = os.path.join(directory, 'index.lock')
+        self.lock = threading.Lock()
+
+        # Create the directory on first use.
+        os.makedirs(directory, exist_ok=True)
+        self.index = {}
+
+        # Access times of the reads since the index was last written, by digest.
+        self.accessed = {}
+
+    @contextmanager
+    def locked(self, shared=False):
+
+        # The thread lock covers this process, the file lock every other process using the directory. Readers
+        # share the file lock, so processes reading the cache do not wait on each other.
+        with self.lock, open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                # Another process may have changed the index since it was last read.
+                self.index = self.load_index()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def temporary_path(path):
+
+        # Unique per process and thread, so concurrent writers never share a temporary file.
+        return path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+
+    def load_index(self):
+
+        # An empty cache has no index yet.
+        if not os.path.exists(self.index_path):
+            return {}
+
+        with open(self.index_path) as index_file:
+            return json.load(index_file)
+
+    def save_index(self):
+
+        # Write to a temporary file first so an interrupted run never leaves a broken index.
+        temporary_path = self.temporary_path(self.index_path)
+        with open(temporary_path, 'w') as index_file:
+            json.dump(self.index, index_file)
+        os.replace(temporary_path, self.index_path)
+
+    @staticmethod
+    def make_digest(key):
+
+        # Endpoint, keywords, timeframe, geo and resolution hash to a stable file name.
+        endpoint, kw_list, timeframe, geo, resolution = key
+        text = json.dumps([endpoint, list(kw_list), timeframe, geo, resolution])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def is_fresh(self, entry):
+
+        # Entries for endpoints without a TTL never expire.
+        ttl = self.ttl.get(entry['endpoint'])
+        return ttl is None or time.time() - entry['fetched_at'] < ttl
+
+    def get(self, key, allow_expired=False):
+
+        digest = self.make_digest(key)
+
+        with self.locked(shared=True):
+            entry = self.index.get(digest)
+
+            # Missing or stale entries count as a miss, unless replaying offline. An entry whose file is gone
+            # is dropped from the index by the next put.
+            path = os.path.join(self.directory, digest + '.pkl')
+            if entry is None or not (allow_expired or self.is_fresh(entry)) or not os.path.exists(path):
+                return None
+
+            # Record the read for the LRU eviction order, written into the index by the next put.
+            self.accessed[digest] = time.time()
+
+            with open(path, 'rb') as response_file:
+                return pickle.load(response_file)
+
+    def record_accesses(self):
+
+        # Bring the reads of this process into the index just loaded, dropping the entries whose file is gone.
+        for digest, accessed_at in self.accessed.items():
+            if digest in self.index:
+                self.index[digest]['last_access'] = max(self.index[digest]['last_access'], accessed_at)
+        self.accessed = {}
+
+        for digest in [digest for digest in self.index
+                       if not os.path.exists(os.path.join(self.directory, digest + '.pkl'))]:
+            del self.index[digest]
+
+    def put(self, key, response):
+
+        digest = self.make_digest(key)
+        path = os.path.join(self.directory, digest + '.pkl')
+
+        with self.locked():
+
+            # Store the response, again through a temporary file.
+            temporary_path = self.temporary_path(path)
+            with open(temporary_path, 'wb') as response_file:
+                pickle.dump(response, response_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, path)
+
+            now = time.time()
+            self.index[digest] = {
+                'endpoint': key[0],
+                'fetched_at': now,
+                'last_access': now,
+                'size': os.path.getsize(path),
+            }
+
+            self.record_accesses()
+            self.evict()
+            self.save_index()
+
+    def evict(self):
+
+        # Drop the least recently used entries until the cache fits within its size limit.
+        total = sum(entry['size'] for entry in self.index.values())
+        for digest in sorted(self.index, key=lambda name: self.index[name]['last_access']):
+            if total <= self.max_bytes:
+                break
+            total -= self.index.pop(digest)['size']
+            path = os.path.join(self.directory, digest + '.pkl')
+            if os.path.exists(path):
+                os.remove(path)
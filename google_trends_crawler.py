@@ -0,0 +1,87 @@
+"""
+Description: Breadth-first crawler over related queries and related topics, for keyword discovery.
+
+Starting from the seed keywords, each level of the crawl fetches the top and rising related queries
+and topics for every keyword in the frontier, packed into 5-keyword payloads. Newly discovered
+queries, normalised and deduplicated through a set of short hashes, form the next frontier until
+the maximum depth or the request budget is reached. The result is an edge list from each keyword
+to the queries and topics related to it.
+
+"""
+
+import hashlib
+import unicodedata
+
+import pandas as pd
+
+# Google accepts up to 5 keywords per payload.
+batch_size = 5
+
+
+# NORMALISE AND DEDUPLICATE QUERIES
+
+def normalise_query(query):
+
+    # Unicode-normalised, case-folded and with single spaces, so 'Covid  Test' and 'covid test' are one query.
+    return ' '.join(unicodedata.normalize('NFKC', str(query)).casefold().split())
+
+
+def query_digest(query):
+
+    # 8-byte hashes keep the seen-set small however many queries are discovered.
+    return hashlib.blake2b(query.encode('utf-8'), digest_size=8).digest()
+
+
+def batch_cost(batch):
+
+    # One token request per payload, plus one related queries and one related topics request per keyword.
+    return 1 + 2 * len(batch)
+
+
+# CRAWL
+
+def crawl(seeds, fetch_level, max_depth=2, budget=60):
+
+    # fetch_level takes a list of keyword batches and returns, per batch, the related rows found for it
+    # as (source, kind, target, value) tuples.
+    seen = set()
+    frontier = []
+    for seed in seeds:
+        query = normalise_query(seed)
+        if query_digest(query) not in seen:
+            seen.add(query_digest(query))
+            frontier.append(query)
+
+    edges = []
+    spent = 0
+
+    for depth in range(max_depth):
+
+        # Pack the frontier into payloads, as many as the remaining budget allows.
+        batches = []
+        for start in range(0, len(frontier), batch_size):
+            batch = frontier[start:start + batch_size]
+            if spent + batch_cost(batch) > budget:
+                break
+            spent += batch_cost(batch)
+            batches.append(batch)
+
+        if not batches:
+            break
+
+        # Record every edge and queue the queries not seen before for the next level.
+        next_frontier = []
+        for rows in fetch_level(batches):
+            for source, kind, target, value in rows:
+                target = normalise_query(target)
+                edges.append((source, target, kind, value, depth + 1))
+
+                digest = query_digest(target)
+                if digest not in seen:
+                    seen.add(digest)
+                    next_frontier.append(target)
+
+        frontier = next_frontier
+
+    # Finally return the edge list as a DataFrame.
+    return pd.DataFrame(edges, columns=['Source', 'Target', 'Kind', 'Value', 'Depth'])
@@ -0,0 +1,180 @@
+"""
+Description: Long-running refresh daemon with a priority queue of refresh jobs and a request budget.
+
+A job is a (keyword, geo, endpoint, time frame) tuple. Each job is due again once the endpoint's
+TTL has passed since its last refresh, shortened for keywords that have been volatile recently, so
+hot keywords come round often and cold ones rarely. The queue is a heap ordered on the time each
+job falls due: the job that has been stale for longest relative to its refresh interval always
+comes first. Jobs are only started while the global hourly request budget has room for them.
+
+The queue, the refresh times and the requests spent in the last hour are saved to a JSON file
+after every job, so a restarted daemon carries on where it stopped.
+
+"""
+
+import heapq
+import json
+import os
+import time
+
+from google_trends_cache import default_ttl
+
+# Seconds before a failed job is tried again.
+retry_seconds = 15 * 60
+
+
+class RefreshQueue(object):
+
+    def __init__(self, path, hourly_budget=100, volatility_weight=4.0, ttl=None, job_cost=3):
+
+        # Store the settings for the queue. A job costs up to a cookie, a token and an endpoint request. job_cost is
+        # either that number or a function counting the requests a given job will make, e.g. without a cookie request
+        # when a connected client is idle.
+        self.path = path
+        self.hourly_budget = hourly_budget
+        self.volatility_weight = volatility_weight
+        self.ttl = dict(default_ttl, **(ttl or {}))
+        self.job_cost = job_cost
+
+        # Heap of (due_at, job). A rescheduled job leaves its old entry behind, skipped when popped.
+        self.heap = []
+        self.jobs = {}
+
+        # (time, requests) for every job run within the last hour.
+        self.spent = []
+
+    # SCHEDULE
+
+    def add(self, job):
+
+        # A job never refreshed before is due straight away.
+        job = tuple(job)
+        if job not in self.jobs:
+            self.schedule(job, None, time.time())
+
+    def retain(self, jobs):
+
+        # Drop the jobs no longer asked for, e.g. saved by a daemon running an earlier keyword list.
+        jobs = set(tuple(job) for job in jobs)
+        for job in [job for job in self.jobs if job not in jobs]:
+            del self.jobs[job]
+
+    def schedule(self, job, refreshed_at, due_at):
+        self.jobs[job] = {'refreshed_at': refreshed_at, 'due_at': due_at}
+        heapq.heappush(self.heap, (due_at, job))
+
+    def refresh_interval(self, job, volatility=0.0):
+
+        # The endpoint's TTL, shortened in proportion to the volatility of the keyword.
+        return self.ttl.get(job[2], 24 * 60 * 60) / (1.0 + self.volatility_weight * volatility)
+
+    # REQUEST BUDGET
+
+    def cost(self, job):
+        return self.job_cost(job) if callable(self.job_cost) else self.job_cost
+
+    def remaining_budget(self, now=None):
+
+        # Requests left within the last hour.
+        now = time.time() if now is None else now
+        self.spent = [(spent_at, requests) for spent_at, requests in self.spent if spent_at > now - 60 * 60]
+        return self.hourly_budget - sum(requests for spent_at, requests in self.spent)
+
+    # RUN THE JOBS
+
+    def next_job(self, now=None):
+
+        # The job that fell due first, if it is due and the budget has room for it.
+        now = time.time() if now is None else now
+        while self.heap:
+            due_at, job = self.heap[0]
+            if self.jobs.get(job, {}).get('due_at') != due_at:
+                heapq.heappop(self.heap)
+                continue
+            if due_at > now or self.remaining_budget(now) < self.cost(job):
+                return None
+            heapq.heappop(self.heap)
+            return job
+
+        return None
+
+    def wait_seconds(self, now=None):
+
+        # Time until the next job falls due or the budget frees up, whichever is later.
+        now = time.time() if now is None else now
+        due_at, job = min(((entry['due_at'], job) for job, entry in self.jobs.items()), default=(now + 60, None))
+        wait = due_at - now
+        if job is not None and self.remaining_budget(now) < self.cost(job) and self.spent:
+            wait = max(wait, self.spent[0][0] + 60 * 60 - now)
+
+        return max(0.0, wait)
+
+    def complete(self, job, requests, volatility=0.0):
+        now = time.time()
+        self.spent.append((now, requests))
+        self.schedule(job, now, now + self.refresh_interval(job, volatility))
+
+    def fail(self, job, requests=None):
+
+        # A failed job still used up requests, and is tried again after a while.
+        now = time.time()
+        self.spent.append((now, self.cost(job) if requests is None else requests))
+        self.schedule(job, self.jobs[job]['refreshed_at'], now + retry_seconds)
+
+    # PERSIST THE QUEUE ACROSS RESTARTS
+
+    def save(self):
+        state = {
+            'jobs': [{'job': list(job), 'refreshed_at': entry['refreshed_at'], 'due_at': entry['due_at']}
+                     for job, entry in self.jobs.items()],
+            'spent': self.spent,
+        }
+        with open(self.path + '.tmp', 'w') as queue_file:
+            json.dump(state, queue_file)
+        os.replace(self.path + '.tmp', self.path)
+
+    @classmethod
+    def load(cls, path, **settings):
+
+        queue = cls(path, **settings)
+        if not os.path.exists(path):
+            return queue
+
+        with open(path) as queue_file:
+            state = json.load(queue_file)
+
+        for entry in state['jobs']:
+            queue.schedule(tuple(entry['job']), entry['refreshed_at'], entry['due_at'])
+        queue.spent = [tuple(spent) for spent in state['spent']]
+
+        return queue
+
+
+# RUN THE DAEMON
+
+def run_daemon(queue, refresh, volatility, count=0, max_idle_seconds=60, errors=()):
+
+    # refresh runs a job and returns the number of requests it made; volatility gives the recent volatility
+    # of a job's keyword. Runs count jobs, or until interrupted. A job failing with one of the errors is retried later.
+    completed = 0
+    try:
+        while not count or completed < count:
+            job = queue.next_job()
+            if job is None:
+                time.sleep(min(queue.wait_seconds(), max_idle_seconds))
+                continue
+
+            try:
+                requests = refresh(job)
+            except errors as error:
+                print("Refresh Failed: " + ' '.join(str(part) for part in job) + ": " + str(error))
+                queue.fail(job)
+            else:
+                queue.complete(job, requests, volatility(job))
+
+            completed += 1
+            queue.save()
+    finally:
+        queue.save()
+
+    return completed
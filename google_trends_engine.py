@@ -0,0 +1,111 @@
+"""
+Description: Concurrent fetch engine for the Google Trends API.
+
+Independent fetches run on a thread pool, or on a process pool when the post-processing is heavy
+enough to need more than one CPU. Every request sent to Google first takes a token from a shared
+token bucket, so the total request rate stays within the limit however many fetches run at the
+same time.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
+import threading
+import time
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, capacity):
+
+        # Tokens added per second and the largest burst allowed.
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+
+        # Start with a full bucket.
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+
+        while True:
+            with self.lock:
+
+                # Add the tokens earned since the last update, up to the capacity.
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                # Take the tokens when enough are available.
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+
+                # Otherwise work out how long until they are.
+                wait = (tokens - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+
+        # Settle the tokens earned at the old rate before switching to the new one.
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.rate = float(rate)
+
+
+class SharedTokenBucket(object):
+
+    def __init__(self, rate, capacity):
+
+        # Tokens added per second and the largest burst allowed.
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+
+        # The bucket lives in shared memory, so one request budget covers every worker process.
+        self.tokens = multiprocessing.Value('d', self.capacity, lock=False)
+        self.updated = multiprocessing.Value('d', time.time(), lock=False)
+        self.lock = multiprocessing.Lock()
+
+    def acquire(self, tokens=1):
+
+        while True:
+            with self.lock:
+
+                # Add the tokens earned since the last update, up to the capacity.
+                now = time.time()
+                self.tokens.value = min(self.capacity, self.tokens.value + (now - self.updated.value) * self.rate)
+                self.updated.value = now
+
+                # Take the tokens when enough are available.
+                if self.tokens.value >= tokens:
+                    self.tokens.value -= tokens
+                    return
+
+                # Otherwise work out how long until they are.
+                wait = (tokens - self.tokens.value) / self.rate
+
+            time.sleep(wait)
+
+
+# RUN INDEPENDENT FETCHES CONCURRENTLY
+
+def run_concurrently(calls, max_workers=6):
+
+    # Each call is a (function, arguments) pair. Results come back in the order of the calls.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(function, *arguments) for function, arguments in calls]
+        return [future.result() for future in futures]
+
+
+def stream_in_processes(calls, max_workers=4, initializer=None, initargs=()):
+
+    # Every call runs in a worker process. Yields (position, result) pairs as the calls complete, so every result can be
+    # written away on arrival instead of all of them being held until the last call finishes.
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=initializer, initargs=initargs) as executor:
+        futures = {executor.submit(function, *arguments): position for position, (function, arguments) in enumerate(calls)}
+        for future in as_completed(futures):
+            yield futures.pop(future), future.result()
@@ -0,0 +1,91 @@
+"""
+Description: Country names for the ISO 3166-1 alpha-2 geo codes accepted by the Google Trends API,
+and the names of the geographic levels of the interest by region resolutions.
+
+"""
+
+country_names = {
+    'AE': 'United Arab Emirates',
+    'AR': 'Argentina',
+    'AT': 'Austria',
+    'AU': 'Australia',
+    'BD': 'Bangladesh',
+    'BE': 'Belgium',
+    'BR': 'Brazil',
+    'CA': 'Canada',
+    'CH': 'Switzerland',
+    'CL': 'Chile',
+    'CN': 'China',
+    'CO': 'Colombia',
+    'CZ': 'Czechia',
+    'DE': 'Germany',
+    'DK': 'Denmark',
+    'EG': 'Egypt',
+    'ES': 'Spain',
+    'FI': 'Finland',
+    'FR': 'France',
+    'GB': 'United Kingdom',
+    'GR': 'Greece',
+    'HK': 'Hong Kong',
+    'HU': 'Hungary',
+    'ID': 'Indonesia',
+    'IE': 'Ireland',
+    'IL': 'Israel',
+    'IN': 'India',
+    'IT': 'Italy',
+    'JP': 'Japan',
+    'KE': 'Kenya',
+    'KR': 'South Korea',
+    'MT': 'Malta',
+    'MX': 'Mexico',
+    'MY': 'Malaysia',
+    'NG': 'Nigeria',
+    'NL': 'Netherlands',
+    'NO': 'Norway',
+    'NZ': 'New Zealand',
+    'PE': 'Peru',
+    'PH': 'Philippines',
+    'PK': 'Pakistan',
+    'PL': 'Poland',
+    'PT': 'Portugal',
+    'RO': 'Romania',
+    'RU': 'Russia',
+    'SA': 'Saudi Arabia',
+    'SE': 'Sweden',
+    'SG': 'Singapore',
+    'TH': 'Thailand',
+    'TR': 'Turkey',
+    'TW': 'Taiwan',
+    'UA': 'Ukraine',
+    'US': 'United States',
+    'VN': 'Vietnam',
+    'ZA': 'South Africa',
+}
+
+
+# Tree levels of the interest by region resolutions. DMA are the US metro areas.
+resolution_levels = {
+    'COUNTRY': 'Country',
+    'REGION': 'Region',
+    'DMA': 'Metro',
+    'CITY': 'City',
+}
+
+
+def check_levels(geo, levels):
+
+    # The levels below a country, e.g. ['REGION', 'CITY']. Google rejects anything else, and DMA, the US metro areas,
+    # only exist for the US.
+    for level in levels:
+        if level not in resolution_levels or level == 'COUNTRY':
+            raise ValueError("Unknown level below the country: " + level + ", expected REGION, DMA or CITY")
+        if level == 'DMA' and geo != 'US':
+            raise ValueError("DMA levels only exist for the US, not for " + geo)
+
+    return list(levels)
+
+
+def country_name(geo):
+
+    # Sub-national codes such as 'GB-ENG' take the name of their country. Unknown codes are returned as they are.
+    return country_names.get(geo.split('-')[0], geo)
@@ -0,0 +1,89 @@
+"""
+Description: Incremental refresh of stored interest over time series.
+
+Rather than refetching the whole time frame every run, only the days since the last stored date
+are requested, together with a few overlapping days. Google scales every payload on its own, so
+the overlapping days give the factor that brings the stored history onto the scale of the new
+window before the new days are appended.
+
+"""
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# Google returns daily values for time frames of up to 90 days.
+max_daily_days = 90
+
+
+# WORK OUT THE TAIL WINDOW TO REQUEST
+
+def tail_time_frame(last_date, overlap_days=7, today=None):
+
+    # The tail window starts a few days before the last stored date.
+    today = today or datetime.date.today()
+    start = pd.Timestamp(last_date).date() - datetime.timedelta(days=overlap_days)
+
+    # Keep the window short enough for daily values.
+    start = max(start, today - datetime.timedelta(days=max_daily_days - 1))
+
+    # The payload accepts explicit dates in the format 'YYYY-MM-DD YYYY-MM-DD'.
+    return start.strftime('%Y-%m-%d') + ' ' + today.strftime('%Y-%m-%d')
+
+
+# RE-NORMALISE THE HISTORY AND APPEND THE TAIL
+
+def merge_tail(history, tail):
+
+    # Both frames hold a Date and a Value column.
+    history_dates = history['Date'].to_numpy()
+    tail_dates = tail['Date'].to_numpy()
+
+    # The overlapping days are present in both frames.
+    in_tail = np.isin(history_dates, tail_dates)
+    in_history = np.isin(tail_dates, history_dates)
+
+    old_total = history['Value'].to_numpy(dtype=float)[in_tail].sum()
+    new_total = tail['Value'].to_numpy(dtype=float)[in_history].sum()
+
+    # Without an overlap, or without interest on it, there is no factor, and appending the tail unscaled would
+    # put the history on two scales.
+    if not in_tail.any():
+        raise ValueError("The tail window starting " + str(pd.Timestamp(tail_dates.min()).date())
+                         + " does not overlap the stored history ending " + str(pd.Timestamp(history_dates.max()).date()))
+    if old_total == 0 or new_total == 0:
+        raise ValueError("No interest on the " + str(int(in_tail.sum())) + " overlapping days to scale the stored "
+                         "history on (stored total " + str(old_total) + ", new total " + str(new_total) + ")")
+
+    # Bring the stored history onto the scale of the new window.
+    factor = new_total / old_total
+
+    # Keep the history up to the start of the tail window, then append the whole tail.
+    kept = history.loc[history['Date'] < tail['Date'].min(), ['Date', 'Value']]
+    merged = pd.DataFrame({
+        'Date': np.concatenate([kept['Date'].to_numpy(), tail_dates]),
+        'Value': np.concatenate([kept['Value'].to_numpy(dtype=float) * factor, tail['Value'].to_numpy(dtype=float)]),
+    })
+
+    # Rescale so the highest value in the whole history is 100.
+    peak = merged['Value'].max()
+    if peak > 0:
+        merged['Value'] = merged['Value'] * (100.0 / peak)
+
+    return merged
+
+
+# CUT A REPORT WINDOW FROM THE HISTORY
+
+def window_from_history(history, days):
+
+    # Take the last number of days and rescale them so the window peaks at 100, like Google does.
+    start = history['Date'].max() - pd.Timedelta(days=days - 1)
+    window = history.loc[history['Date'] >= start, ['Date', 'Value']].copy()
+
+    peak = window['Value'].max()
+    if peak > 0:
+        window['Value'] = (window['Value'] * (100.0 / peak)).round()
+
+    return window
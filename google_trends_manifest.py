@@ -0,0 +1,157 @@
+"""
+Description: Checkpointed, resumable runs of the data pipeline.
+
+Every run gets its own folder holding a run manifest. Each unit of work - an endpoint, time frame,
+geo and keyword batch - is persisted as soon as it completes, and recorded in the manifest. When a
+run fails part of the way through, resuming it only executes the units that are still missing.
+
+A unit counts as completed once its result file exists. Results are written through a temporary
+file and the manifest is only ever appended to, so worker threads and processes can checkpoint
+units of the same run at the same time. The result files are deleted once the run completes, or
+once an incomplete run is too old to be resumed: its relative time frames have moved on since.
+
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import time
+
+# Seconds after its start during which an incomplete run may still be resumed.
+resume_max_age = 24 * 60 * 60
+
+
+class RunManifest(object):
+
+    def __init__(self, runs_directory, run_id, settings=None):
+
+        # Each run lives in its own folder.
+        self.run_id = run_id
+        self.directory = os.path.join(runs_directory, run_id)
+        self.settings_path = os.path.join(self.directory, 'run.json')
+        self.units_path = os.path.join(self.directory, 'units.jsonl')
+
+        # A new run records its settings, so it can be resumed with the same ones.
+        if not os.path.exists(self.settings_path):
+            os.makedirs(self.directory, exist_ok=True)
+            self.write_settings(dict(settings or {}, run_id=run_id, started_at=time.time(), completed=False))
+
+        with open(self.settings_path) as settings_file:
+            self.settings = json.load(settings_file)
+
+    def write_settings(self, settings):
+        with open(self.settings_path + '.tmp', 'w') as settings_file:
+            json.dump(settings, settings_file)
+        os.replace(self.settings_path + '.tmp', self.settings_path)
+
+    @staticmethod
+    def incomplete_runs(runs_directory):
+
+        # (run_id, started_at) of every run that did not reach the end of the pipeline and has not expired, most
+        # recent first.
+        if not os.path.isdir(runs_directory):
+            return []
+
+        runs = []
+        for run_id in sorted(os.listdir(runs_directory), reverse=True):
+            settings_path = os.path.join(runs_directory, run_id, 'run.json')
+            if os.path.exists(settings_path):
+                with open(settings_path) as settings_file:
+                    settings = json.load(settings_file)
+                if not settings['completed'] and not settings.get('expired'):
+                    runs.append((run_id, settings['started_at']))
+
+        return runs
+
+    @staticmethod
+    def latest_incomplete(runs_directory, max_age=resume_max_age, now=None):
+
+        # The most recent run that did not reach the end of the pipeline and is recent enough to resume, if any.
+        now = time.time() if now is None else now
+        for run_id, started_at in RunManifest.incomplete_runs(runs_directory):
+            if now - started_at <= max_age:
+                return run_id
+
+        return None
+
+    @staticmethod
+    def expire(runs_directory, max_age=resume_max_age, now=None):
+
+        # Delete the results of the incomplete runs too old to be resumed. Returns the number of runs expired.
+        now = time.time() if now is None else now
+        expired = [run_id for run_id, started_at in RunManifest.incomplete_runs(runs_directory)
+                   if now - started_at > max_age]
+        for run_id in expired:
+            manifest = RunManifest(runs_directory, run_id)
+            manifest.delete_results()
+            manifest.settings['expired'] = True
+            manifest.write_settings(manifest.settings)
+
+        return len(expired)
+
+    # UNITS OF WORK
+
+    @staticmethod
+    def unit_digest(unit):
+
+        # A unit is a tuple such as (endpoint, time frame, geo, keywords).
+        return hashlib.sha1(json.dumps(unit, default=list).encode('utf-8')).hexdigest()
+
+    def result_path(self, unit):
+        return os.path.join(self.directory, self.unit_digest(unit) + '.pkl')
+
+    def is_done(self, unit):
+        return os.path.exists(self.result_path(unit))
+
+    def load(self, unit):
+        with open(self.result_path(unit), 'rb') as result_file:
+            return pickle.load(result_file)
+
+    def record(self, unit, result):
+
+        # Persist the result first, then append the unit to the manifest.
+        path = self.result_path(unit)
+        with open(path + '.tmp', 'wb') as result_file:
+            pickle.dump(result, result_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+        line = json.dumps({'unit': unit, 'result': os.path.basename(path), 'completed_at': time.time()}, default=list)
+        with open(self.units_path, 'a') as units_file:
+            units_file.write(line + '\n')
+
+    def completed_units(self):
+
+        # The units recorded in the manifest, in the order they completed.
+        if not os.path.exists(self.units_path):
+            return []
+        with open(self.units_path) as units_file:
+            return [json.loads(line)['unit'] for line in units_file if line.strip()]
+
+    def delete_results(self):
+
+        # The result files, and any left half written, are only needed to resume the run. The manifest is kept.
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl') or name.endswith('.pkl.tmp'):
+                os.remove(os.path.join(self.directory, name))
+
+    def complete(self):
+
+        # Mark the run as finished so it is no longer offered for resuming, then free its results.
+        self.settings['completed'] = True
+        self.write_settings(self.settings)
+        self.delete_results()
+
+
+# RUN A UNIT ONCE PER RUN
+
+def run_unit(manifest, unit, function, arguments):
+
+    # A resumed run reuses the result persisted by the run that failed.
+    if manifest.is_done(unit):
+        return manifest.load(unit)
+
+    result = function(*arguments)
+    manifest.record(unit, result)
+
+    return result
@@ -0,0 +1,159 @@
+"""
+Description: Instrumentation for the data pipeline.
+
+Records stage latencies as histograms, and counts requests, response statuses, bytes sent and
+received, cache hits, retries and rows produced. At the end of a run the figures are exported as
+a JSON run report and as a Prometheus text file, to show whether Google's throttling or our own
+processing limits the throughput.
+
+"""
+
+from contextlib import contextmanager
+import bisect
+import json
+import os
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds.
+latency_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+# Every metric name in the Prometheus file starts with this prefix.
+prefix = 'google_trends_'
+
+
+class Metrics(object):
+
+    def __init__(self):
+
+        # Counters and histograms are keyed on (name, labels), where labels is a sorted tuple of pairs.
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    # RECORD
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, empty_histogram())
+            histogram['buckets'][bisect.bisect_left(latency_buckets, value)] += 1
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['max'] = max(histogram['max'], value)
+
+    @contextmanager
+    def timed(self, stage):
+
+        # Record how long the stage took, also when it fails.
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - started, stage=stage)
+
+    def record_response(self, response, *args, **kwargs):
+
+        # Hook called by requests for every response received from Google, including the cookie request.
+        request = response.request
+        sent = len(request.url) + len(request.body or b'')
+        self.count('requests_total', status=str(response.status_code))
+        self.count('request_bytes_total', sent)
+        self.count('response_bytes_total', len(response.content))
+
+        # Google signals its rate limit with status 429.
+        if response.status_code == 429:
+            self.count('throttled_total')
+
+    # COMBINE THE FIGURES OF WORKER PROCESSES
+
+    def drain(self):
+
+        # The counters and histograms recorded since the last drain, e.g. to send a worker process's figures to the parent.
+        with self.lock:
+            drained = (self.counters, self.histograms)
+            self.counters, self.histograms = {}, {}
+
+        return drained
+
+    def merge(self, counters, histograms):
+
+        # Add the figures drained from another Metrics, bucket by bucket for the histograms.
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+            for key, other in histograms.items():
+                histogram = self.histograms.setdefault(key, empty_histogram())
+                histogram['buckets'] = [mine + theirs for mine, theirs in zip(histogram['buckets'], other['buckets'])]
+                histogram['count'] += other['count']
+                histogram['sum'] += other['sum']
+                histogram['max'] = max(histogram['max'], other['max'])
+
+    def total(self, name):
+
+        # A counter summed over all of its labels, e.g. every request whatever its status.
+        with self.lock:
+            return sum(value for (counter, labels), value in self.counters.items() if counter == name)
+
+    # EXPORT
+
+    def report(self):
+
+        # A plain dictionary describing the run.
+        with self.lock:
+            return {
+                'started': self.started,
+                'duration_seconds': time.time() - self.started,
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'histograms': [{'name': name, 'labels': dict(labels), 'count': histogram['count'],
+                                'sum': histogram['sum'], 'max': histogram['max'],
+                                'buckets': dict(zip([str(bound) for bound in latency_buckets] + ['+Inf'],
+                                                    histogram['buckets']))}
+                               for (name, labels), histogram in sorted(self.histograms.items())],
+            }
+
+    def export_json(self, path):
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+    def export_prometheus(self, path):
+
+        lines = []
+        with self.lock:
+
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(prefix + name + format_labels(labels) + ' ' + repr(float(value)))
+
+            # Histogram buckets are cumulative in the Prometheus text format.
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, bucket in zip([repr(bound) for bound in latency_buckets] + ['+Inf'], histogram['buckets']):
+                    cumulative += bucket
+                    lines.append(prefix + name + '_bucket' + format_labels(labels + (('le', bound),)) + ' ' + str(cumulative))
+                lines.append(prefix + name + '_sum' + format_labels(labels) + ' ' + repr(histogram['sum']))
+                lines.append(prefix + name + '_count' + format_labels(labels) + ' ' + str(histogram['count']))
+
+        # Written through a temporary file so a scraper never reads half a file.
+        with open(path + '.tmp', 'w') as metrics_file:
+            metrics_file.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+
+def empty_histogram():
+    return {'buckets': [0] * (len(latency_buckets) + 1), 'count': 0, 'sum': 0.0, 'max': 0.0}
+
+
+def format_labels(labels):
+
+    # Labels in the Prometheus text format: {name="value",...}
+    if not labels:
+        return ''
+    return '{' + ','.join(name + '="' + str(value).replace('"', '\\"') + '"' for name, value in labels) + '}'
@@ -0,0 +1,119 @@
+"""
+Description: Columnar Parquet output for the payloads received at the end of the data pipeline.
+
+The repeated string columns (Range, Country, Region) are stored dictionary-encoded as categoricals
+and the 0-100 values as small integers. The Label column is a copy of Value, so it is not stored
+and is restored by the reader. The 30 and 90-day windows are stored once per date, region or query
+with one value column per window, see compact_windows, and expanded to the long Range format again
+by the reader. Each dataset is partitioned by fetch date, and holds one file per run in the
+partition of its fetch date, written by google_trends_writer.py.
+
+Requires: pyarrow. Checks are made automatically for the availability of the module.
+
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from google_trends_transform import window_prefix, expand_windows
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Columns stored as dictionary-encoded categoricals.
+categorical_columns = ['Range', 'Country', 'Region']
+
+# Datasets whose reports have no Label column, so the reader does not add one.
+unlabelled_datasets = ['relatedQueries']
+
+
+def parquet_available():
+    return pyarrow is not None
+
+
+# CONVERT TO COMPACT DTYPES
+
+def compact_frame(frame):
+
+    # Label duplicates Value, the reader adds it back.
+    compact = frame.drop(columns=['Label'], errors='ignore')
+
+    # Repeated strings become categoricals, stored as dictionaries in the Parquet file.
+    for column in categorical_columns:
+        if column in compact.columns:
+            compact[column] = compact[column].astype('category')
+
+    # Whole values between 0 and 100 fit in one byte. Rescaled values keep their fraction as float32.
+    # The value columns of compact windows are missing outside their window, and stay nullable.
+    for column in [name for name in compact.columns if name == 'Value' or name.startswith(window_prefix)]:
+        values = compact[column].to_numpy(dtype=float, na_value=np.nan)
+        present = values[~np.isnan(values)]
+        if np.all(np.mod(present, 1) == 0) and present.min(initial=0) >= 0 and present.max(initial=0) <= 255:
+            compact[column] = values.astype(np.uint8) if len(present) == len(values) else pd.array(values, dtype='UInt8')
+        else:
+            compact[column] = values.astype(np.float32)
+
+    return compact
+
+
+def restore_categories(frame):
+
+    # Expanding the compact windows rebuilds the string columns as plain objects.
+    for column in categorical_columns:
+        if column in frame.columns and not isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = frame[column].astype('category')
+
+    return frame
+
+
+def restore_values(frame):
+
+    # Every file picks its own compact dtype, and an integer column with missing values is read back as float64,
+    # so the value columns are brought back to the dtypes of the CSV path: int64, Int64 with missing values, and
+    # float64 for rescaled values. The writer stores whole values as integers, so only those are whole.
+    for column in [name for name in frame.columns if name in ['Value', 'Label'] or name.startswith(window_prefix)]:
+        values = frame[column].to_numpy(dtype=float, na_value=np.nan)
+        present = values[~np.isnan(values)]
+        if not np.all(np.mod(present, 1) == 0):
+            frame[column] = values
+        elif len(present) == len(values):
+            frame[column] = values.astype(np.int64)
+        else:
+            frame[column] = pd.array(values, dtype='Int64')
+
+    return frame
+
+
+# WRITE AND READ THE DATASETS
+
+def dataset_file(directory, name, fetch_date, part):
+
+    # One file per run inside the partition of its fetch date: <directory>/<name>/fetch_date=YYYY-MM-DD/<part>.parquet
+    return os.path.join(directory, name, 'fetch_date=' + fetch_date, part + '.parquet')
+
+
+def read_parquet(directory, name, fetch_date=None, restore_label=True):
+
+    if pyarrow is None:
+        raise ImportError("Parquet input requires the pyarrow package: pip install pyarrow")
+
+    # Read one fetch date or the whole dataset.
+    filters = [('fetch_date', '=', fetch_date)] if fetch_date else None
+    frame = restore_values(pd.read_parquet(os.path.join(directory, name), engine='pyarrow', filters=filters))
+
+    # The Label column dropped by the writer is restored unless restore_label is off. The related queries have none.
+    restore_label = restore_label and name not in unlabelled_datasets
+
+    # Compact windows are expanded to the long Range format, with the categoricals they were stored as.
+    if 'Windows' in frame.columns:
+        frame = restore_values(restore_categories(expand_windows(frame, label=restore_label)))
+        return frame[[column for column in frame.columns if column != 'fetch_date'] + ['fetch_date']]
+
+    if restore_label:
+        frame['Label'] = frame['Value']
+
+    return frame
@@ -0,0 +1,218 @@
+"""
+Description: Adaptive rate limiting, backoff and proxy rotation for the Google Trends API.
+
+Every proxy (or the direct connection) gets its own request rate, adjusted AIMD style: each
+successful request raises the rate by a small fixed step, each 429 or timeout halves it. Proxies
+that keep failing are taken out of rotation for a cooldown that doubles every time it happens
+again, and come back at the minimum rate. The minimum rate, one request every 5 seconds, keeps a
+proxy that hit it a few successes away from its initial rate rather than minutes.
+
+pytrends opens a new requests session for every call. PooledTrendReq keeps one keep-alive session
+per client instead, so consecutive requests through the same proxy reuse their connection. It can
+also be pointed at a stand-in for trends.google.com, such as the stub server used for benchmarks.
+
+"""
+
+from collections import deque
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from pytrends import exceptions
+from pytrends.request import TrendReq, BASE_TRENDS_URL
+
+from google_trends_engine import TokenBucket
+
+# Outcomes reported for a request.
+success = 'success'
+throttled = 'throttled'
+timeout = 'timeout'
+failed = 'failed'
+
+
+class ProxyState(object):
+
+    def __init__(self, proxy, rate, capacity):
+
+        # None stands for the direct connection.
+        self.proxy = proxy
+        self.bucket = TokenBucket(rate, capacity)
+
+        # The most recent outcomes decide whether the proxy is healthy.
+        self.outcomes = deque(maxlen=20)
+        self.consecutive_failures = 0
+        self.strikes = 0
+        self.unhealthy_until = 0.0
+
+    def failure_ratio(self):
+        if not self.outcomes:
+            return 0.0
+        return sum(outcome != success for outcome in self.outcomes) / float(len(self.outcomes))
+
+
+class ProxyScheduler(object):
+
+    def __init__(self, proxies=None, initial_rate=0.5, min_rate=0.2, max_rate=2.0, increase=0.05,
+                 decrease=0.5, capacity=2, cooldown=60.0, max_cooldown=900.0):
+
+        # Rate limits in requests per second, and the AIMD steps.
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+
+        # Cooldown in seconds for a proxy taken out of rotation, doubled on every further strike.
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self.states = [ProxyState(proxy, initial_rate, capacity) for proxy in (proxies or [None])]
+        self.lock = threading.Lock()
+
+    def healthy_states(self, now):
+        return [state for state in self.states if state.unhealthy_until <= now]
+
+    def state(self, proxy):
+
+        # The state of a configured proxy, None for the direct connection.
+        state = next((state for state in self.states if state.proxy == proxy), None)
+        if state is None:
+            raise KeyError("Proxy not configured in the scheduler: " + str(proxy))
+
+        return state
+
+    def choose(self):
+
+        while True:
+            now = time.time()
+            with self.lock:
+                healthy = self.healthy_states(now)
+
+                # Prefer the healthy proxy allowed the highest rate.
+                if healthy:
+                    state = max(healthy, key=lambda candidate: candidate.bucket.rate)
+                    break
+
+                # Every proxy is cooling down, so wait for the first one to come back.
+                wait = min(state.unhealthy_until for state in self.states) - now
+
+            time.sleep(max(wait, 0.0))
+
+        # Wait for the proxy's own rate limit outside the scheduler lock.
+        state.bucket.acquire()
+        return state.proxy
+
+    def acquire(self, proxy):
+
+        # Wait for the rate limit of a given proxy, e.g. for the cookie and token requests of its clients.
+        with self.lock:
+            state = self.state(proxy)
+        state.bucket.acquire()
+
+    def total_rate(self):
+
+        # Requests per second currently allowed over every healthy proxy.
+        with self.lock:
+            return sum(state.bucket.rate for state in self.healthy_states(time.time()))
+
+    def record(self, proxy, outcome):
+
+        with self.lock:
+            state = self.state(proxy)
+            state.outcomes.append(outcome)
+
+            if outcome == success:
+
+                # Additive increase.
+                state.consecutive_failures = 0
+                state.bucket.set_rate(min(self.max_rate, state.bucket.rate + self.increase))
+                return
+
+            state.consecutive_failures += 1
+
+            # Multiplicative decrease when Google pushes back.
+            if outcome in (throttled, timeout):
+                state.bucket.set_rate(max(self.min_rate, state.bucket.rate * self.decrease))
+
+            # Take the proxy out of rotation when it keeps failing.
+            if state.consecutive_failures >= 3 or (len(state.outcomes) >= 5 and state.failure_ratio() > 0.5):
+                state.unhealthy_until = time.time() + min(self.max_cooldown, self.cooldown * 2 ** state.strikes)
+                state.strikes += 1
+                state.consecutive_failures = 0
+                state.outcomes.clear()
+                state.bucket.set_rate(self.min_rate)
+
+    def backoff(self, attempt):
+
+        # Wait before retrying, longer when every proxy is in trouble.
+        with self.lock:
+            healthy = len(self.healthy_states(time.time()))
+        return min(60.0, (2 ** attempt) * (1.0 if healthy else 4.0))
+
+
+class PooledTrendReq(TrendReq):
+
+    def __init__(self, *args, **kwargs):
+
+        # Requests to trends.google.com go to base_url instead when one is given, e.g. http://127.0.0.1:8765/trends
+        self.base_url = kwargs.pop('base_url', None)
+
+        # A list while the raw bodies of the requests are recorded, as (widget request, JSON text) pairs.
+        self.raw_bodies = None
+
+        # The keep-alive session is created before TrendReq requests its cookie.
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        self.session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        super(PooledTrendReq, self).__init__(*args, **kwargs)
+        self.session.headers.update(self.headers)
+
+        # Route the session through the client's proxy, if any.
+        if self.proxies:
+            self.session.proxies.update({'https': self.proxies[0]})
+
+    def GetGoogleCookie(self):
+
+        # The stand-in hands out its cookie through the client's session.
+        if self.base_url is None:
+            return super(PooledTrendReq, self).GetGoogleCookie()
+
+        response = self.session.get(self.base_url + '/explore/?geo=' + self.hl[-2:], timeout=self.timeout,
+                                    **self.requests_args)
+        return dict(filter(lambda item: item[0] == 'NID', response.cookies.items()))
+
+    def _get_data(self, url, method=TrendReq.GET_METHOD, trim_chars=0, **kwargs):
+
+        if self.base_url is not None:
+            url = url.replace(BASE_TRENDS_URL, self.base_url, 1)
+
+        # Same as TrendReq._get_data, but on the client's own session rather than a new one per call.
+        request = self.session.post if method == TrendReq.POST_METHOD else self.session.get
+        response = request(url, timeout=self.timeout, cookies=self.cookies, **dict(kwargs, **self.requests_args))
+
+        content_type = response.headers.get('Content-Type', '')
+        if response.status_code == 200 and ('application/json' in content_type
+                                            or 'application/javascript' in content_type
+                                            or 'text/javascript' in content_type):
+            body = response.text[trim_chars:]
+            if self.raw_bodies is not None:
+                self.raw_bodies.append((kwargs.get('params', {}).get('req'), body))
+            return json.loads(body)
+
+        # Google signals its rate limit with status 429.
+        message = "The request failed: Google returned a response with code " + str(response.status_code)
+        if response.status_code == 429:
+            raise getattr(exceptions, 'TooManyRequestsError', exceptions.ResponseError)(message, response=response)
+        raise exceptions.ResponseError(message, response=response)
+
+
+def classify_error(error):
+
+    # Map a failed request onto the outcome reported to the scheduler.
+    response = getattr(error, 'response', None)
+    if response is not None and response.status_code == 429:
+        return throttled
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return timeout
+    return failed
@@ -0,0 +1,245 @@
+"""
+Description: Shared, lease-based work queue that splits one keyword list between worker nodes.
+
+A fetch unit is an (endpoint, time frame, geo, keyword batch) tuple. Every unit of a refresh round
+is added to one SQLite queue, shared by the worker processes of one machine or by several machines
+on a shared filesystem with working file locks. A worker claims a unit inside an exclusive
+transaction, so no two workers ever hold the same unit, and holds it on a lease that it renews
+while the unit is being fetched. When a worker dies the lease expires and the unit is claimed again
+by another worker. Results are written idempotently: every row of a unit carries the time the unit
+was added to the round as its fetch time, whichever worker fetches it, and is upserted on its natural
+key, so a unit completed twice after its lease was reclaimed overwrites its own rows.
+
+Every node adds the same units: a unit already in the round is not added again, so any node can
+start the round and the others join it.
+
+"""
+
+from contextlib import contextmanager
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from google_trends_manifest import RunManifest
+
+# Seconds before a failed unit is offered again.
+retry_seconds = 60
+
+schema = [
+    """CREATE TABLE IF NOT EXISTS units (
+        unit_id TEXT PRIMARY KEY,
+        round TEXT NOT NULL,
+        unit TEXT NOT NULL,
+        state TEXT NOT NULL,
+        added_at REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        available_at REAL NOT NULL,
+        worker TEXT,
+        lease_id TEXT,
+        error TEXT,
+        completed_at REAL
+    )""",
+    """CREATE INDEX IF NOT EXISTS units_available
+        ON units (round, state, available_at)""",
+]
+
+
+class WorkQueue(object):
+
+    def __init__(self, path, round_id, lease_seconds=300, max_attempts=5):
+
+        # A pending unit can be claimed from available_at on, a leased unit is reclaimed once available_at,
+        # the end of its lease, has passed.
+        self.path = path
+        self.round_id = round_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        # Transactions are started explicitly. Other workers may hold the database for a moment, so wait for them.
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.transaction():
+            for statement in schema:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    @contextmanager
+    def transaction(self):
+
+        # BEGIN IMMEDIATE takes the write lock up front, so a unit selected within the transaction
+        # cannot be claimed by another worker before it is leased.
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def unit_id(self, unit):
+        return RunManifest.unit_digest([self.round_id, unit])
+
+    # ADD THE UNITS OF THE ROUND
+
+    def add(self, units, now=None):
+
+        # Units already in the round, whatever their state, are left untouched. Returns the number added.
+        now = time.time() if now is None else now
+        with self.transaction() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                'INSERT OR IGNORE INTO units (unit_id, round, unit, state, added_at, available_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(self.unit_id(unit), self.round_id, json.dumps(unit, default=list), 'pending', now, now)
+                 for unit in units])
+            return connection.total_changes - before
+
+    def fetched_at(self, unit):
+
+        # The fetch time stored with the results of the unit: the time it was added, the same for every worker
+        # and every attempt.
+        with self.lock:
+            row = self.connection.execute('SELECT added_at FROM units WHERE unit_id = ?',
+                                          (self.unit_id(unit),)).fetchone()
+        if row is None:
+            raise KeyError("Unit not in round " + self.round_id + ": " + json.dumps(unit))
+
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(row[0]))
+
+    # CLAIM AND LEASE
+
+    def claim(self, worker, count=1, now=None):
+
+        # Up to count units as (unit, lease_id), pending units and units whose lease expired alike, those
+        # tried least often first. A unit that used up its attempts is given up rather than claimed again.
+        now = time.time() if now is None else now
+        with self.transaction() as connection:
+            connection.execute("""
+                UPDATE units SET state = 'failed', lease_id = NULL
+                WHERE round = ? AND state = 'leased' AND available_at <= ? AND attempts >= ?""",
+                (self.round_id, now, self.max_attempts))
+
+            rows = connection.execute("""
+                SELECT unit_id, unit FROM units
+                WHERE round = ? AND state IN ('pending', 'leased') AND available_at <= ?
+                ORDER BY attempts, available_at LIMIT ?""", (self.round_id, now, count)).fetchall()
+
+            leases = []
+            for unit_id, unit in rows:
+                lease_id = uuid.uuid4().hex
+                connection.execute("""
+                    UPDATE units SET state = 'leased', attempts = attempts + 1, available_at = ?, worker = ?, lease_id = ?
+                    WHERE unit_id = ?""", (now + self.lease_seconds, worker, lease_id, unit_id))
+                leases.append((json.loads(unit), lease_id))
+
+        return leases
+
+    def renew(self, lease_id, now=None):
+
+        # Extend the lease. False once the lease has been reclaimed by another worker.
+        now = time.time() if now is None else now
+        with self.transaction() as connection:
+            cursor = connection.execute("""
+                UPDATE units SET available_at = ? WHERE lease_id = ? AND state = 'leased'""",
+                (now + self.lease_seconds, lease_id))
+            return cursor.rowcount == 1
+
+    @contextmanager
+    def heartbeat(self, lease_id, interval=None):
+
+        # Renew the lease from a background thread while the unit is being fetched, e.g. through retries.
+        interval = interval or self.lease_seconds / 3.0
+        stopped = threading.Event()
+
+        def renew_until_stopped():
+            while not stopped.wait(interval):
+                if not self.renew(lease_id):
+                    return
+
+        thread = threading.Thread(target=renew_until_stopped, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    # FINISH THE UNITS
+
+    def complete(self, unit, lease_id, now=None):
+
+        # The unit is done whoever holds its lease, its results being idempotent. False when the lease had already
+        # been reclaimed, i.e. the unit was fetched twice.
+        now = time.time() if now is None else now
+        with self.transaction() as connection:
+            held = connection.execute('SELECT lease_id FROM units WHERE unit_id = ?',
+                                      (self.unit_id(unit),)).fetchone()
+            connection.execute("""
+                UPDATE units SET state = 'done', lease_id = NULL, error = NULL, completed_at = ?
+                WHERE unit_id = ?""", (now, self.unit_id(unit)))
+
+        return held is not None and held[0] == lease_id
+
+    def fail(self, unit, lease_id, error, now=None):
+
+        # Offer the unit again after a while, unless another worker has taken it over in the meantime.
+        now = time.time() if now is None else now
+        with self.transaction() as connection:
+            connection.execute("""
+                UPDATE units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                                 available_at = ?, lease_id = NULL, error = ?
+                WHERE unit_id = ? AND lease_id = ?""",
+                (self.max_attempts, now + retry_seconds, str(error), self.unit_id(unit), lease_id))
+
+    # PROGRESS OF THE ROUND
+
+    def counts(self):
+
+        # Units per state: pending, leased, done and failed.
+        with self.lock:
+            rows = self.connection.execute('SELECT state, COUNT(*) FROM units WHERE round = ? GROUP BY state',
+                                           (self.round_id,)).fetchall()
+
+        return dict(rows)
+
+    def outstanding(self):
+
+        # Units still to be done by some worker.
+        counts = self.counts()
+        return counts.get('pending', 0) + counts.get('leased', 0)
+
+
+# RUN A WORKER
+
+def run_worker(queue, worker, process, count=0, idle_seconds=5, errors=()):
+
+    # process fetches and stores one unit. Runs count units, or until every unit of the round is done or failed,
+    # waiting while other workers still hold the remaining units. A unit failing with one of the errors is retried.
+    processed = 0
+    while not count or processed < count:
+        leases = queue.claim(worker)
+        if not leases:
+            if not queue.outstanding():
+                break
+            time.sleep(idle_seconds)
+            continue
+
+        unit, lease_id = leases[0]
+        try:
+            with queue.heartbeat(lease_id):
+                process(unit)
+        except errors as error:
+            print("Unit Failed: " + json.dumps(unit) + ": " + str(error))
+            queue.fail(unit, lease_id, error)
+        else:
+            queue.complete(unit, lease_id)
+
+        processed += 1
+
+    return processed
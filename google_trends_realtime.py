@@ -0,0 +1,219 @@
+"""
+Description: Near-real-time interest over time, polled every few minutes.
+
+Google returns values per minute for 'now 1-H' and per hour for 'now 7-d'. The poller fetches the
+short window on a schedule and merges every poll into a fixed-size ring buffer per keyword, backed
+by one array of timestamps and one of values, so polling never grows a DataFrame. Google scales
+every poll on its own: the timestamps a poll shares with the buffer give the factor that brings the
+buffered values onto the scale of the newest poll, whose points then replace the overlapping ones.
+
+The latest window is served from memory. The buffers are flushed to disk periodically as a single
+.npz file, from which the poller picks up again after a restart.
+
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from google_trends_transform import concat_reports
+
+# Google accepts up to 5 keywords per payload.
+batch_size = 5
+
+# Points kept per keyword: a week of minutes for the hourly time frames, four weeks of hours for 'now 7-d'.
+default_capacity = {
+    'now 1-H': 7 * 24 * 60,
+    'now 4-H': 7 * 24 * 60,
+    'now 1-d': 7 * 24 * 60,
+    'now 7-d': 4 * 7 * 24,
+}
+
+# Range labels for the report, as for the 30 and 90-day payloads.
+range_labels = {
+    'now 1-H': 'Last-Hour',
+    'now 4-H': 'Last-4-Hours',
+    'now 1-d': 'Last-Day',
+    'now 7-d': 'Last-7-Days',
+}
+
+
+class RingBuffer(object):
+
+    def __init__(self, capacity):
+
+        # Timestamps in seconds since the epoch and their values, written in a circle.
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity)
+        self.start = 0
+        self.size = 0
+
+    def positions(self):
+
+        # Array positions of the buffered points, oldest first.
+        return (self.start + np.arange(self.size)) % self.capacity
+
+    def merge(self, times, values):
+
+        times = np.asarray(times, dtype=np.int64)
+        values = np.asarray(values, dtype=float)
+        if not len(times):
+            return
+
+        positions = self.positions()
+        buffered = self.times[positions]
+
+        # Rescale the buffer onto the scale of the poll through the points both hold. A poll that does not
+        # overlap the buffer, e.g. after the poller was stopped for longer than the window, cannot be chained.
+        common, buffered_index, poll_index = np.intersect1d(buffered, times, return_indices=True)
+        old = self.values[positions[buffered_index]]
+        new = values[poll_index]
+        usable = (old > 0) & (new > 0)
+        if usable.any():
+            self.values[positions] *= new[usable].sum() / old[usable].sum()
+
+        # The buffer is in time order, so the points replaced by the poll are at its end.
+        self.size -= int(np.count_nonzero(buffered >= times[0]))
+
+        # Append the poll, overwriting the oldest points once the buffer is full.
+        times, values = times[-self.capacity:], values[-self.capacity:]
+        slots = (self.start + self.size + np.arange(len(times))) % self.capacity
+        self.times[slots] = times
+        self.values[slots] = values
+
+        self.size += len(times)
+        if self.size > self.capacity:
+            self.start = (self.start + self.size - self.capacity) % self.capacity
+            self.size = self.capacity
+
+    def window(self, seconds=None):
+
+        # The buffered points, or only those of the last given number of seconds, oldest first.
+        positions = self.positions()
+        times, values = self.times[positions], self.values[positions]
+        if seconds is not None and len(times):
+            selected = times > times[-1] - seconds
+            times, values = times[selected], values[selected]
+
+        return times, values
+
+
+class HourlyPoller(object):
+
+    def __init__(self, keywords, fetch, time_frame='now 1-H', capacity=None):
+
+        # fetch takes a batch of up to 5 keywords and a time frame and returns the interest over time
+        # payload: a DataFrame indexed on date with one column per keyword.
+        self.keywords = list(keywords)
+        self.fetch = fetch
+        self.time_frame = time_frame
+        self.capacity = capacity or default_capacity.get(time_frame, 7 * 24 * 60)
+        self.buffers = {keyword: RingBuffer(self.capacity) for keyword in self.keywords}
+
+    # POLL
+
+    def poll(self):
+
+        # One payload per batch of keywords. Returns the number of points received.
+        received = 0
+        for start in range(0, len(self.keywords), batch_size):
+            batch = self.keywords[start:start + batch_size]
+            pd_poll = self.fetch(batch, self.time_frame)
+            if pd_poll.empty:
+                continue
+
+            times = pd_poll.index.to_numpy().astype('datetime64[s]').astype(np.int64)
+            for keyword in batch:
+                self.buffers[keyword].merge(times, pd_poll[keyword].to_numpy())
+                received += len(times)
+
+        return received
+
+    def run(self, path, interval=300, flush_interval=900, count=0, errors=(), on_flush=None):
+
+        # Poll every interval seconds, count times or until interrupted, and flush every flush_interval seconds.
+        # A poll failing with one of the given errors is skipped, the next poll covers the same window.
+        polls = 0
+        last_flush = time.time()
+        try:
+            while not count or polls < count:
+                started = time.time()
+                try:
+                    self.poll()
+                except errors as error:
+                    print("Poll Failed: " + str(error))
+                polls += 1
+
+                if time.time() - last_flush >= flush_interval:
+                    self.flush(path, on_flush)
+                    last_flush = time.time()
+
+                if not count or polls < count:
+                    time.sleep(max(0.0, interval - (time.time() - started)))
+        finally:
+            self.flush(path, on_flush)
+
+        return polls
+
+    # SERVE THE LATEST WINDOW FROM MEMORY
+
+    def latest(self, keyword, seconds=None):
+
+        # The buffered points for one keyword in the report format.
+        times, values = self.buffers[keyword].window(seconds)
+        return pd.DataFrame({
+            'Date': pd.to_datetime(times, unit='s'),
+            'Value': values,
+            'Label': values,
+            'Range': range_labels.get(self.time_frame, self.time_frame),
+        })
+
+    def frame(self, seconds=None):
+
+        # Every keyword in one long-format DataFrame.
+        return concat_reports([self.latest(keyword, seconds) for keyword in self.keywords], Keyword=self.keywords)
+
+    # PERSIST THE BUFFERS BETWEEN RESTARTS
+
+    def flush(self, path, on_flush=None):
+
+        # One row per keyword, written oldest first so the buffers load back unwrapped.
+        times = np.zeros((len(self.keywords), self.capacity), dtype=np.int64)
+        values = np.zeros((len(self.keywords), self.capacity))
+        sizes = np.zeros(len(self.keywords), dtype=np.int64)
+        for row, keyword in enumerate(self.keywords):
+            window_times, window_values = self.buffers[keyword].window()
+            sizes[row] = len(window_times)
+            times[row, :sizes[row]] = window_times
+            values[row, :sizes[row]] = window_values
+
+        np.savez(path + '.tmp.npz', keywords=np.array(json.dumps(self.keywords)), time_frame=np.array(self.time_frame),
+                 times=times, values=values, sizes=sizes)
+        os.replace(path + '.tmp.npz', path)
+
+        if on_flush is not None:
+            on_flush(self)
+
+    @classmethod
+    def load(cls, path, keywords, fetch, time_frame='now 1-H', capacity=None):
+
+        poller = cls(keywords, fetch, time_frame, capacity)
+        if not os.path.exists(path):
+            return poller
+
+        with np.load(path) as state:
+
+            # Buffers saved for another time frame do not share the same resolution.
+            if str(state['time_frame']) != time_frame:
+                return poller
+
+            for row, keyword in enumerate(json.loads(str(state['keywords']))):
+                if keyword in poller.buffers:
+                    size = state['sizes'][row]
+                    poller.buffers[keyword].merge(state['times'][row, :size], state['values'][row, :size])
+
+        return poller
@@ -0,0 +1,81 @@
+"""
+Description: Daily interest over time for date ranges longer than 90 days.
+
+Google only returns daily values for time frames of up to 90 days and switches to weekly values
+for anything longer. A long date range is therefore split into overlapping windows of up to 90
+days. Google scales every window on its own, so the overlapping days between neighbouring windows
+give the factors that chain all windows onto the scale of the first one, after which the whole
+series is rescaled onto a single 0-100 scale.
+
+"""
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# Google returns daily values for time frames of up to 90 days.
+max_window_days = 90
+
+
+# PLAN THE WINDOWS
+
+def plan_windows(start_date, end_date, window_days=max_window_days, overlap_days=14):
+
+    start = pd.Timestamp(start_date).date()
+    end = pd.Timestamp(end_date).date()
+
+    if end < start:
+        raise ValueError("The end date is before the start date.")
+
+    # Each window after the first one moves on by the window length less the overlap.
+    step = datetime.timedelta(days=window_days - overlap_days)
+    length = datetime.timedelta(days=window_days - 1)
+
+    windows = []
+    window_start = start
+    while True:
+        window_end = min(window_start + length, end)
+        windows.append((window_start, window_end))
+        if window_end == end:
+            break
+        window_start = window_start + step
+
+    return windows
+
+
+def window_time_frame(window):
+
+    # The payload accepts explicit dates in the format 'YYYY-MM-DD YYYY-MM-DD'.
+    return window[0].strftime('%Y-%m-%d') + ' ' + window[1].strftime('%Y-%m-%d')
+
+
+# STITCH THE WINDOWS INTO ONE SERIES
+
+def stitch_windows(frames):
+
+    # Every frame holds a Date and a Value column. Align them on the union of their dates.
+    dates = pd.DatetimeIndex(np.unique(np.concatenate([frame['Date'].to_numpy() for frame in frames])))
+    matrix = np.full((len(frames), len(dates)), np.nan)
+    for row, frame in enumerate(frames):
+        matrix[row, dates.get_indexer(frame['Date'])] = frame['Value'].to_numpy(dtype=float)
+
+    # Days covered by each pair of neighbouring windows.
+    both = ~np.isnan(matrix[:-1]) & ~np.isnan(matrix[1:])
+    previous_totals = np.where(both, matrix[:-1], 0.0).sum(axis=1)
+    next_totals = np.where(both, matrix[1:], 0.0).sum(axis=1)
+
+    if (next_totals == 0).any() or (previous_totals == 0).any():
+        raise ValueError("Neighbouring windows have no interest in common to stitch on.")
+
+    # Chain the overlap ratios so every window ends up on the scale of the first one.
+    factors = np.concatenate([[1.0], np.cumprod(previous_totals / next_totals)])
+    scaled = matrix * factors[:, np.newaxis]
+
+    # Average the overlapping days and rescale so the highest value is 100.
+    values = np.nanmean(scaled, axis=0)
+    peak = values.max()
+    if peak > 0:
+        values = values * (100.0 / peak)
+
+    return pd.DataFrame({'Date': dates, 'Value': values})
@@ -0,0 +1,268 @@
+"""
+Description: Indexed local store for the payloads received at the end of the data pipeline.
+
+Every run is written into one SQLite database with a table per endpoint, rather than into a new
+folder of CSV files. Rows are upserted on their natural key, so rerunning the same fetch updates
+the stored values instead of duplicating them, and the tables are indexed on keyword, geo,
+date/range and fetch time, so questions across runs are answered with a single query. The CSV
+files for the Tableau dashboard are exported from the store, streamed in chunks of rows.
+
+"""
+
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from google_trends_stitch import stitch_windows
+from google_trends_writer import StreamingWriter, write_stream
+
+# Rows per chunk when streaming the exports.
+export_chunksize = 10000
+
+# Table definitions. The primary keys give the upsert semantics, the indexes the fast lookups.
+schema = [
+    """CREATE TABLE IF NOT EXISTS interest_over_time (
+        keyword TEXT NOT NULL,
+        geo TEXT NOT NULL,
+        range TEXT NOT NULL,
+        date TEXT NOT NULL,
+        value INTEGER,
+        label INTEGER,
+        fetched_at TEXT NOT NULL,
+        PRIMARY KEY (keyword, geo, range, date, fetched_at)
+    )""",
+    """CREATE INDEX IF NOT EXISTS interest_over_time_date
+        ON interest_over_time (keyword, geo, date)""",
+    """CREATE INDEX IF NOT EXISTS interest_over_time_fetched
+        ON interest_over_time (keyword, geo, range, fetched_at)""",
+    """CREATE TABLE IF NOT EXISTS interest_by_region (
+        keyword TEXT NOT NULL,
+        geo TEXT NOT NULL,
+        country TEXT,
+        region TEXT NOT NULL,
+        range TEXT NOT NULL,
+        value INTEGER,
+        label INTEGER,
+        fetch_date TEXT NOT NULL,
+        fetched_at TEXT NOT NULL,
+        PRIMARY KEY (keyword, geo, region, range, fetch_date)
+    )""",
+    """CREATE INDEX IF NOT EXISTS interest_by_region_fetched
+        ON interest_by_region (keyword, geo, range, fetched_at)""",
+    """CREATE TABLE IF NOT EXISTS related_queries (
+        keyword TEXT NOT NULL,
+        geo TEXT NOT NULL,
+        query TEXT NOT NULL,
+        range TEXT NOT NULL,
+        value INTEGER,
+        fetch_date TEXT NOT NULL,
+        fetched_at TEXT NOT NULL,
+        PRIMARY KEY (keyword, geo, query, range, fetch_date)
+    )""",
+    """CREATE INDEX IF NOT EXISTS related_queries_fetched
+        ON related_queries (keyword, geo, range, fetched_at)""",
+    """CREATE TABLE IF NOT EXISTS related_edges (
+        source TEXT NOT NULL,
+        target TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        geo TEXT NOT NULL,
+        range TEXT NOT NULL,
+        value INTEGER,
+        depth INTEGER,
+        fetch_date TEXT NOT NULL,
+        fetched_at TEXT NOT NULL,
+        PRIMARY KEY (source, target, kind, geo, range, fetch_date)
+    )""",
+    """CREATE INDEX IF NOT EXISTS related_edges_target
+        ON related_edges (target, geo, fetch_date)""",
+    """CREATE TABLE IF NOT EXISTS alerts (
+        keyword TEXT NOT NULL,
+        geo TEXT NOT NULL,
+        date TEXT NOT NULL,
+        value REAL,
+        robust_z REAL,
+        ewma_z REAL,
+        change REAL,
+        detected_at TEXT NOT NULL,
+        PRIMARY KEY (keyword, geo, date)
+    )""",
+    """CREATE INDEX IF NOT EXISTS alerts_detected
+        ON alerts (detected_at)""",
+]
+
+
+class TrendsStore(object):
+
+    def __init__(self, path):
+
+        # One connection shared by the pipeline, guarded for use from several threads.
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        # Create the tables and indexes on first use.
+        with self.lock, self.connection:
+            for statement in schema:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    def bulk_upsert(self, table, columns, key, rows):
+
+        # Insert every row in a single transaction, updating the rows that already exist.
+        updates = ', '.join(column + ' = excluded.' + column for column in columns if column not in key)
+        statement = ('INSERT INTO ' + table + ' (' + ', '.join(columns) + ') VALUES ('
+                     + ', '.join('?' * len(columns)) + ') ON CONFLICT (' + ', '.join(key) + ') DO UPDATE SET ' + updates)
+
+        with self.lock, self.connection:
+            self.connection.executemany(statement, rows)
+
+    # STORE THE PAYLOADS
+
+    def save_interest_over_time(self, pd_iot, keyword, geo, fetched_at):
+
+        # Every fetch is kept, on its own scale, so later fetches can be rescaled onto each other on the days they share.
+
+        rows = zip([keyword] * len(pd_iot), [geo] * len(pd_iot), pd_iot['Range'],
+                   pd.to_datetime(pd_iot['Date']).dt.strftime('%Y-%m-%d'),
+                   pd_iot['Value'].astype(float), pd_iot['Label'].astype(float), [fetched_at] * len(pd_iot))
+
+        self.bulk_upsert('interest_over_time',
+                         ['keyword', 'geo', 'range', 'date', 'value', 'label', 'fetched_at'],
+                         ['keyword', 'geo', 'range', 'date', 'fetched_at'], rows)
+
+    def save_interest_by_region(self, pd_ibr, keyword, geo, fetched_at):
+
+        # Without a geo, every row carries its own in a Geo column, as in the multi-geo fan-out.
+        geos = pd_ibr['Geo'] if geo is None else [geo] * len(pd_ibr)
+        rows = zip([keyword] * len(pd_ibr), geos, pd_ibr['Country'], pd_ibr['Region'], pd_ibr['Range'],
+                   pd_ibr['Value'].astype(float), pd_ibr['Label'].astype(float),
+                   [fetched_at[:10]] * len(pd_ibr), [fetched_at] * len(pd_ibr))
+
+        self.bulk_upsert('interest_by_region',
+                         ['keyword', 'geo', 'country', 'region', 'range', 'value', 'label', 'fetch_date', 'fetched_at'],
+                         ['keyword', 'geo', 'region', 'range', 'fetch_date'], rows)
+
+    def save_related_queries(self, pd_srch, keyword, geo, fetched_at):
+
+        rows = zip([keyword] * len(pd_srch), [geo] * len(pd_srch), pd_srch['Keyword'], pd_srch['Range'],
+                   pd_srch['Value'].astype(float), [fetched_at[:10]] * len(pd_srch), [fetched_at] * len(pd_srch))
+
+        self.bulk_upsert('related_queries',
+                         ['keyword', 'geo', 'query', 'range', 'value', 'fetch_date', 'fetched_at'],
+                         ['keyword', 'geo', 'query', 'range', 'fetch_date'], rows)
+
+    def save_related_edges(self, pd_edges, geo, fetched_at):
+
+        rows = zip(pd_edges['Source'], pd_edges['Target'], pd_edges['Kind'], [geo] * len(pd_edges), pd_edges['Range'],
+                   pd_edges['Value'].astype(float), pd_edges['Depth'].astype(int),
+                   [fetched_at[:10]] * len(pd_edges), [fetched_at] * len(pd_edges))
+
+        self.bulk_upsert('related_edges',
+                         ['source', 'target', 'kind', 'geo', 'range', 'value', 'depth', 'fetch_date', 'fetched_at'],
+                         ['source', 'target', 'kind', 'geo', 'range', 'fetch_date'], rows)
+
+    def save_alerts(self, pd_alerts, detected_at):
+
+        # Series are keyed on 'keyword|geo'.
+        series = pd_alerts['Series'].str.rsplit('|', n=1, expand=True) if len(pd_alerts) else None
+        rows = [] if series is None else zip(
+            series[0], series[1], pd.to_datetime(pd_alerts['Date']).dt.strftime('%Y-%m-%d'),
+            pd_alerts['Value'].astype(float), pd_alerts['RobustZ'].astype(float), pd_alerts['EwmaZ'].astype(float),
+            pd_alerts['Change'].astype(float), [detected_at] * len(pd_alerts))
+
+        self.bulk_upsert('alerts',
+                         ['keyword', 'geo', 'date', 'value', 'robust_z', 'ewma_z', 'change', 'detected_at'],
+                         ['keyword', 'geo', 'date'], rows)
+
+    # QUERY THE STORE
+
+    def query(self, sql, parameters=(), chunksize=None):
+
+        # The whole result, or with a chunksize a generator of chunks of rows.
+        if chunksize is not None:
+            return self.iter_query(sql, parameters, chunksize)
+
+        with self.lock:
+            return pd.read_sql_query(sql, self.connection, params=parameters)
+
+    def iter_query(self, sql, parameters=(), chunksize=export_chunksize):
+
+        # The store stays locked until the last chunk has been read.
+        with self.lock:
+            for chunk in pd.read_sql_query(sql, self.connection, params=parameters, chunksize=chunksize):
+                yield chunk
+
+    def interest_over_time(self, keyword, geo, start_date, end_date, range_label='Last-90-Days'):
+
+        # One consistently scaled daily series for one keyword, geo and range, for example the last year of UK interest.
+        pd_rows = self.query("""
+            SELECT date AS Date, value AS Value, fetched_at
+            FROM interest_over_time
+            WHERE keyword = ? AND geo = ? AND range = ? AND date BETWEEN ? AND ?
+            ORDER BY fetched_at, date
+        """, (keyword, geo, range_label, start_date, end_date))
+
+        frames = [pd.DataFrame({'Date': pd.to_datetime(pd_fetch['Date']).to_numpy(), 'Value': pd_fetch['Value'].to_numpy()})
+                  for fetched_at, pd_fetch in pd_rows.groupby('fetched_at', sort=True)]
+        if not frames:
+            return pd.DataFrame({'Date': pd.Series(dtype='datetime64[ns]'), 'Value': pd.Series(dtype=float),
+                                 'Range': pd.Series(dtype=object)})
+
+        # Every fetch is on its own 0-100 scale. Going back from the latest fetch, keep the fetches sharing interest with
+        # the next one, e.g. not across a gap of more than the range, and stitch them onto one scale.
+        first = len(frames) - 1
+        while first > 0:
+            older, newer = frames[first - 1], frames[first]
+            older_shared = np.isin(older['Date'].to_numpy(), newer['Date'].to_numpy())
+            newer_shared = np.isin(newer['Date'].to_numpy(), older['Date'].to_numpy())
+            if older['Value'].to_numpy()[older_shared].sum() == 0 or newer['Value'].to_numpy()[newer_shared].sum() == 0:
+                break
+            first -= 1
+
+        pd_iot = stitch_windows(frames[first:])
+        pd_iot['Range'] = range_label
+
+        return pd_iot
+
+    # EXPORT THE LATEST RUN FOR THE TABLEAU DASHBOARD
+
+    def export_multi_timeline(self, keyword, geo, chunksize=None):
+        return self.query("""
+            SELECT t.date AS Date, t.value AS Value, t.label AS Label, t.range AS Range
+            FROM interest_over_time t
+            WHERE t.keyword = ? AND t.geo = ? AND t.fetched_at = (
+                SELECT MAX(l.fetched_at) FROM interest_over_time l
+                WHERE l.keyword = t.keyword AND l.geo = t.geo AND l.range = t.range)
+            ORDER BY t.range, t.date
+        """, (keyword, geo), chunksize)
+
+    def export_geo_map(self, keyword, geo, chunksize=None):
+        return self.query("""
+            SELECT t.country AS Country, t.region AS Region, t.value AS Value, t.label AS Label, t.range AS Range
+            FROM interest_by_region t
+            WHERE t.keyword = ? AND t.geo = ? AND t.fetched_at = (
+                SELECT MAX(l.fetched_at) FROM interest_by_region l
+                WHERE l.keyword = t.keyword AND l.geo = t.geo AND l.range = t.range)
+            ORDER BY t.range, t.value DESC
+        """, (keyword, geo), chunksize)
+
+    def export_related_queries(self, keyword, geo, chunksize=None):
+        return self.query("""
+            SELECT t.query AS Keyword, t.value AS Value, t.range AS Range
+            FROM related_queries t
+            WHERE t.keyword = ? AND t.geo = ? AND t.fetched_at = (
+                SELECT MAX(l.fetched_at) FROM related_queries l
+                WHERE l.keyword = t.keyword AND l.geo = t.geo AND l.range = t.range)
+            ORDER BY t.range, t.value DESC
+        """, (keyword, geo), chunksize)
+
+    def export_tableau(self, keyword, geo, directory):
+
+        # Stream the three files read by the dashboard, each replaced in one step once complete.
+        write_stream(self.export_multi_timeline(keyword, geo, export_chunksize), [StreamingWriter(directory + 'multiTimeline.csv')])
+        write_stream(self.export_geo_map(keyword, geo, export_chunksize), [StreamingWriter(directory + 'geoMap.csv')])
+        write_stream(self.export_related_queries(keyword, geo, export_chunksize), [StreamingWriter(directory + 'relatedQueries.csv')])
@@ -0,0 +1,329 @@
+"""
+Description: Local stand-in for the Google Trends endpoints used by the pipeline.
+
+Serves the cookie, token, interest over time, interest by region and related queries and topics
+endpoints in the same format as Google, so the pipeline runs unchanged against it through
+--trends-url. Responses are synthetic, generated from a seed so every run receives the same data,
+or replayed from recorded response files. The latency of every request, the share of requests
+answered with a 429 and the size of the payloads (points per time series, regions and related
+queries) are configurable, which makes the throughput of the pipeline measurable offline.
+
+Run the server on its own:
+python google_trends_stub.py --port=8765 --latency=0.05 --throttle-rate=0.05
+
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import argparse
+import datetime
+import json
+import os
+import random
+import threading
+import time
+import zlib
+
+from google_trends_geo import country_names
+
+# Google prefixes its JSON responses with these characters, trimmed again by pytrends.
+token_prefix = ")]}'"
+widget_prefix = ")]}',\n"
+
+# Recorded responses are read from files with these names, one per endpoint.
+recording_names = {
+    '/trends/api/explore': 'explore.txt',
+    '/trends/api/widgetdata/multiline': 'multiline.txt',
+    '/trends/api/widgetdata/comparedgeo': 'comparedgeo.txt',
+    '/trends/api/widgetdata/relatedsearches': 'relatedsearches.txt',
+}
+
+
+# SYNTHETIC RESPONSES
+
+def time_frame_points(time_frame, now=None):
+
+    # Timestamps of the points Google returns for a time frame, oldest first.
+    now = int(time.time() if now is None else now)
+    minute, hour, day = 60, 60 * 60, 24 * 60 * 60
+    relative = {
+        'now 1-H': (60, minute),
+        'now 4-H': (240, minute),
+        'now 1-d': (24 * 60 // 8, 8 * minute),
+        'now 7-d': (7 * 24, hour),
+        'today 1-m': (30, day),
+        'today 3-m': (90, day),
+        'today 12-m': (52, 7 * day),
+        'today 5-y': (260, 7 * day),
+    }
+    if time_frame in relative:
+        count, step = relative[time_frame]
+        end = now - now % step
+        return [end - step * (count - 1 - index) for index in range(count)]
+
+    # Explicit dates: daily values for up to 90 days, weekly values beyond.
+    start_date, end_date = [datetime.date.fromisoformat(part) for part in time_frame.split(' ')]
+    start = int(datetime.datetime(start_date.year, start_date.month, start_date.day, tzinfo=datetime.timezone.utc).timestamp())
+    days = (end_date - start_date).days + 1
+    step = day if days <= 90 else 7 * day
+    return list(range(start, start + days * day, step))
+
+
+def values(generator, count):
+
+    # A 0-100 series scaled so its maximum is 100, as Google does.
+    raw = [generator.random() for _ in range(count)]
+    top = max(raw) or 1.0
+    return [int(round(100 * value / top)) for value in raw]
+
+
+class StubTrends(object):
+
+    def __init__(self, latency=0.05, jitter=0.0, throttle_rate=0.0, points=None, regions=40, related=25,
+                 recordings=None, seed=0):
+
+        # Settings of the stand-in.
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.points = points
+        self.regions = regions
+        self.related = related
+        self.recordings = recordings
+        self.seed = seed
+
+        # 429s are injected from their own generator so they are reproducible too.
+        self.throttle_generator = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def generator(self, text):
+
+        # Each distinct request always receives the same synthetic data.
+        return random.Random(zlib.crc32(text.encode('utf-8')) ^ self.seed)
+
+    def recording(self, path):
+        if self.recordings is None or path not in recording_names:
+            return None
+        recording_path = os.path.join(self.recordings, recording_names[path])
+        if not os.path.exists(recording_path):
+            return None
+        with open(recording_path) as recording_file:
+            return recording_file.read()
+
+    def throttled(self):
+        with self.lock:
+            return self.throttle_generator.random() < self.throttle_rate
+
+    # ENDPOINTS
+
+    def explore(self, params):
+
+        # One widget per section, and one related topics and queries widget per keyword, as Google returns them.
+        request = json.loads(params['req'][0])
+        items = request['comparisonItem']
+        keywords = [item['keyword'] for item in items]
+        time_frame = items[0]['time'] if items else 'today 1-m'
+        geo = items[0]['geo'] if items else ''
+
+        shared = {'keywords': keywords, 'time': time_frame, 'geo': geo}
+        widgets = [
+            {'id': 'TIMESERIES', 'token': 'stub', 'request': dict(shared, kind='timeseries')},
+            {'id': 'GEO_MAP', 'token': 'stub', 'request': dict(shared, kind='geo_map', resolution='COUNTRY')},
+        ]
+        for keyword in keywords:
+            restriction = {'complexKeywordsRestriction': {'keyword': [{'type': 'BROAD', 'value': keyword}]}}
+            for widget_id, kind in [('RELATED_TOPICS', 'topics'), ('RELATED_QUERIES', 'queries')]:
+                widgets.append({'id': widget_id, 'token': 'stub',
+                                'request': dict(shared, kind=kind, keyword=keyword, restriction=restriction)})
+
+        return token_prefix + json.dumps({'widgets': widgets})
+
+    def multiline(self, params):
+
+        request = json.loads(params['req'][0])
+        generator = self.generator(params['req'][0])
+        timestamps = time_frame_points(request['time'])
+        if self.points is not None:
+            timestamps = timestamps[-self.points:]
+
+        # One value per keyword per point, the latest point of a relative time frame is still partial.
+        series = [values(generator, len(timestamps)) for keyword in request['keywords']]
+        timeline = []
+        for index, timestamp in enumerate(timestamps):
+            point = {'time': str(timestamp), 'formattedTime': str(timestamp),
+                     'value': [column[index] for column in series], 'hasData': [True] * len(series)}
+            if index == len(timestamps) - 1 and request['time'].startswith(('now', 'today')):
+                point['isPartial'] = True
+            timeline.append(point)
+
+        return widget_prefix + json.dumps({'default': {'timelineData': timeline, 'averages': []}})
+
+    def comparedgeo(self, params):
+
+        request = json.loads(params['req'][0])
+        generator = self.generator(params['req'][0])
+        geo = request['geo']
+
+        # The worldwide map lists every country, any other geo numbered regions below it.
+        if geo:
+            places = [(geo + '-' + str(index + 1), geo + ' Region ' + str(index + 1)) for index in range(self.regions)]
+        else:
+            places = sorted(country_names.items())
+        series = [values(generator, len(places)) for keyword in request['keywords']]
+
+        regions = [{'geoCode': code, 'geoName': name, 'value': [column[index] for column in series],
+                    'hasData': [True] * len(series), 'maxValueIndex': 0}
+                   for index, (code, name) in enumerate(places)]
+
+        return widget_prefix + json.dumps({'default': {'geoMapData': regions}})
+
+    def relatedsearches(self, params):
+
+        request = json.loads(params['req'][0])
+        generator = self.generator(params['req'][0])
+        keyword = request.get('keyword', '')
+
+        # Top lists are scaled to 100, rising lists are growth percentages.
+        ranked = []
+        for top in [True, False]:
+            scores = values(generator, self.related) if top else [generator.randint(50, 5000) for _ in range(self.related)]
+            scores = sorted(scores, reverse=True)
+            items = []
+            for index, score in enumerate(scores):
+                name = keyword + (' top ' if top else ' rising ') + str(index + 1)
+                item = {'value': score, 'formattedValue': str(score), 'hasData': True, 'link': '/'}
+                if request.get('kind') == 'topics':
+                    item['topic'] = {'mid': '/m/stub' + str(index), 'title': name.title(), 'type': 'Topic'}
+                else:
+                    item['query'] = name
+                items.append(item)
+            ranked.append({'rankedKeyword': items})
+
+        return widget_prefix + json.dumps({'default': {'rankedList': ranked}})
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    # Set on the handler class by StubServer.
+    stub = None
+
+    def log_message(self, format, *args):
+
+        # Keep the benchmark output readable.
+        pass
+
+    def send_text(self, status, content_type, text, headers=()):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond(self):
+
+        stub = self.stub
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        # Every request waits for the configured latency.
+        delay = stub.latency + (stub.generator(self.path).uniform(0, stub.jitter) if stub.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+        # The cookie request is never throttled.
+        if url.path.startswith('/trends/explore'):
+            return self.send_text(200, 'text/html; charset=utf-8', '<html></html>', [('Set-Cookie', 'NID=stub; Path=/')])
+
+        endpoints = {
+            '/trends/api/explore': stub.explore,
+            '/trends/api/widgetdata/multiline': stub.multiline,
+            '/trends/api/widgetdata/comparedgeo': stub.comparedgeo,
+            '/trends/api/widgetdata/relatedsearches': stub.relatedsearches,
+        }
+        if url.path not in endpoints:
+            return self.send_text(404, 'text/html; charset=utf-8', 'Not Found')
+
+        if stub.throttled():
+            return self.send_text(429, 'text/html; charset=utf-8', 'Too Many Requests')
+
+        text = stub.recording(url.path)
+        if text is None:
+            text = endpoints[url.path](params)
+
+        self.send_text(200, 'application/json; charset=utf-8', text)
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+
+    # The pipeline opens many connections at once, more than the default backlog of 5.
+    request_queue_size = 128
+
+
+class StubServer(object):
+
+    def __init__(self, stub=None, host='127.0.0.1', port=0):
+
+        # Port 0 picks a free port.
+        handler = type('BoundStubHandler', (StubHandler,), {'stub': stub or StubTrends()})
+        self.server = StubHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+
+        # The value for --trends-url.
+        host, port = self.server.server_address[:2]
+        return 'http://' + host + ':' + str(port) + '/trends'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# RUN THE STUB SERVER FROM THE COMMAND LINE
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the Google Trends endpoints.")
+    parser.add_argument('--port', type=int, default=8765, help="port to listen on")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds every request waits")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many seconds added to the latency")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument('--points', type=int, help="points per time series, by default as many as Google returns")
+    parser.add_argument('--regions', type=int, default=40, help="regions per interest by region response below a country")
+    parser.add_argument('--related', type=int, default=25, help="top and rising entries per related response")
+    parser.add_argument('--recordings', help="folder of recorded responses to replay instead of synthetic ones")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the synthetic data and the 429s")
+    args = parser.parse_args(argv)
+
+    stub = StubTrends(args.latency, args.jitter, args.throttle_rate, args.points, args.regions, args.related,
+                      args.recordings, args.seed)
+    server = StubServer(stub, port=args.port)
+
+    # Display the URL to pass to the pipeline.
+    print("Stub Trends Server: " + server.url)
+    print("python google_trends_api_func.py --trends-url=" + server.url)
+
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""
+Description: Shared, copy-free post-processing of the payloads into the report schema.
+
+The fetchers used to chain reset_index, rename, column assignment, column reselection and
+sort_values on every payload, each step copying the data, and concat_payloads copied everything
+again. Here every report frame is built in a single pass instead: the columns are taken from the
+payload as NumPy arrays, put in order with one argsort, and handed to a single DataFrame
+constructor, with constant columns such as Range broadcast. concat_reports joins any number of
+report frames by filling one preallocated array per column.
+
+The windows of one payload overlap: the last 30 days are also the last 30 days of the 90-day window.
+compact_windows stores every date, region or query once, with one value column per window, each
+still on its own scale, and a Windows bitmask of the windows the row belongs to. expand_windows
+gives back the long Range format read by the Tableau dashboard.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+# Range labels of the 30 and 90-day payloads.
+range_labels = {1: 'Last-30-Days', 3: 'Last-90-Days'}
+
+# Value columns of the compact windows are named after their Range label, e.g. Value_Last-30-Days.
+window_prefix = 'Value_'
+
+
+# BUILD ONE REPORT FRAME
+
+def constant(value, length):
+
+    # One value for every row, e.g. the Range label.
+    column = np.empty(length, dtype=object)
+    column.fill(value)
+    return column
+
+
+def build_report(columns, order=None):
+
+    # columns is a list of (name, array or constant). Every array is put in order once, even when it is used for
+    # several columns such as Value and Label, and constants are broadcast to the length of the arrays.
+    length = next((len(values) for name, values in columns if isinstance(values, np.ndarray)), 0)
+
+    ordered = {}
+    data = {}
+    for name, values in columns:
+        if not isinstance(values, np.ndarray):
+            data[name] = constant(values, length)
+        elif order is None:
+            data[name] = values
+        else:
+            if id(values) not in ordered:
+                ordered[id(values)] = values[order]
+            data[name] = ordered[id(values)]
+
+    return pd.DataFrame(data, copy=False)
+
+
+def descending(values):
+
+    # Stable order from the highest value down, ties keep the order Google returned them in.
+    return np.argsort(-values, kind='stable')
+
+
+# REPORT FRAMES PER ENDPOINT
+
+def series_report(dates, values, range_label):
+
+    # Interest over time: one row per date, oldest first.
+    dates = np.asarray(dates)
+    values = np.asarray(values)
+    order = None if len(dates) < 2 or (dates[1:] >= dates[:-1]).all() else np.argsort(dates, kind='stable')
+
+    return build_report([('Date', dates), ('Value', values), ('Label', values), ('Range', range_label)], order)
+
+
+def interest_over_time_report(payload, keyword, range_label):
+
+    # The payload is indexed on date with one column per keyword, and has no columns when Google found no interest.
+    if payload.empty:
+        return series_report(np.empty(0, dtype='datetime64[ns]'), np.empty(0, dtype=np.int64), range_label)
+
+    return series_report(payload.index.to_numpy(), payload[keyword].to_numpy(), range_label)
+
+
+def keyword_series_report(pd_long, range_label):
+
+    # A long-format frame with Date, Keyword and Value columns, ordered by keyword and then date. The rows of
+    # every keyword are already in date order, so a stable sort on the keyword alone is enough.
+    keywords = pd_long['Keyword'].to_numpy()
+    values = pd_long['Value'].to_numpy()
+
+    return build_report([('Date', pd_long['Date'].to_numpy()), ('Keyword', keywords), ('Value', values),
+                         ('Label', values), ('Range', range_label)], np.argsort(keywords, kind='stable'))
+
+
+def interest_by_region_report(payload, keyword, country, range_label):
+
+    # The payload is indexed on region name, and has no columns when Google found no interest. Highest interest first.
+    if payload.empty:
+        regions = np.empty(0, dtype=object)
+        values = np.empty(0, dtype=np.int64)
+    else:
+        regions = payload.index.to_numpy()
+        values = payload[keyword].to_numpy()
+
+    return build_report([('Country', country), ('Region', regions), ('Value', values),
+                         ('Label', values), ('Range', range_label)], descending(values))
+
+
+def related_queries_report(top, range_label):
+
+    # The top related queries of one keyword, None when Google found none. Highest value first.
+    if top is None:
+        return build_report([('Keyword', np.empty(0, dtype=object)), ('Value', np.empty(0, dtype=np.int64)),
+                             ('Range', range_label)])
+
+    values = top['value'].to_numpy()
+
+    return build_report([('Keyword', top['query'].to_numpy()), ('Value', values), ('Range', range_label)],
+                        descending(values))
+
+
+def region_level_report(payload, keyword, path, index_names, level, range_label):
+
+    # One level of the region tree: the children of the node at path, e.g. ('GB',) for the regions of the UK.
+    # Rows are keyed on their geo code, cities on their name, as Google returns them with coordinates instead.
+    if payload.empty:
+        names = codes = np.empty(0, dtype=object)
+        values = np.empty(0, dtype=np.int64)
+    else:
+        names = payload.index.to_numpy()
+        codes = payload['geoCode'].to_numpy() if 'geoCode' in payload.columns else names
+        values = payload[keyword].to_numpy()
+
+    # The codes of the ancestors, the row's own code, and empty codes for the levels below.
+    depth = len(path)
+    columns = [(name, path[position]) for position, name in enumerate(index_names[:depth])]
+    columns.append((index_names[depth], codes))
+    columns.extend((name, '') for name in index_names[depth + 1:])
+
+    return build_report(columns + [('Name', names), ('Level', level), ('Value', values), ('Label', values),
+                                   ('Range', range_label)], descending(values))
+
+
+def region_tree_report(frames, index_names):
+
+    # Every level in one frame indexed on the path of geo codes, sorted so drilling down into a node is a slice,
+    # e.g. tree.loc['GB'] or tree.loc[('GB', 'GB-ENG')], and rolling up is a groupby on an index level.
+    return concat_reports(frames).set_index(list(index_names)).sort_index()
+
+
+# JOIN ANY NUMBER OF REPORT FRAMES
+
+def concat_reports(frames, **constants):
+
+    # Every frame has the same columns. Each keyword argument adds a column holding one value per frame,
+    # e.g. Geo=['GB', 'US'], written in the same pass.
+    frames = list(frames)
+    lengths = [len(frame) for frame in frames]
+    total = sum(lengths)
+
+    data = {}
+    for name, values in constants.items():
+        data[name] = np.repeat(np.array(values, dtype=object), lengths)
+
+    for name in (frames[0].columns if frames else []):
+        arrays = [frame[name].to_numpy() for frame in frames]
+        column = np.empty(total, dtype=np.result_type(*arrays))
+
+        # Fill the preallocated column frame by frame.
+        position = 0
+        for array in arrays:
+            column[position:position + len(array)] = array
+            position += len(array)
+        data[name] = column
+
+    return pd.DataFrame(data, copy=False)
+
+
+# STORE OVERLAPPING WINDOWS ONCE
+
+def is_ranked(keys):
+
+    # Time series are ordered on date, everything else, e.g. regions and related queries, highest value first.
+    return 'Date' not in keys
+
+
+def window_column(values, positions, length):
+
+    # The values of one window at the rows of the compact frame, missing where the row is not in the window.
+    # Whole values stay integers through a nullable integer column.
+    column = np.zeros(length, dtype=values.dtype if values.dtype != object else float)
+    column[positions] = values
+    missing = np.ones(length, dtype=bool)
+    missing[positions] = False
+
+    if np.issubdtype(column.dtype, np.integer):
+        return pd.arrays.IntegerArray(column.astype(np.int64), missing)
+
+    column = column.astype(float)
+    column[missing] = np.nan
+    return column
+
+
+def compact_windows(frames, keys):
+
+    # frames are report frames with a Range column, one per window or already joined, and keys the columns
+    # identifying a row within a window, e.g. ['Date'] or ['Country', 'Region']. Label duplicates Value and
+    # is dropped, the expansion adds it back.
+    pd_long = frames if isinstance(frames, pd.DataFrame) else concat_reports(frames)
+    ranges = pd_long['Range'].to_numpy()
+    labels = list(pd.unique(ranges))
+
+    # One row per distinct key, in date order for time series and in order of first appearance otherwise.
+    key_index = pd.MultiIndex.from_frame(pd_long[keys]) if len(keys) > 1 else pd.Index(pd_long[keys[0]])
+    codes, uniques = pd.factorize(key_index, sort=not is_ranked(keys))
+    length = len(uniques)
+
+    data = {}
+    if len(keys) > 1:
+        for level, name in enumerate(keys):
+            data[name] = uniques.get_level_values(level).to_numpy()
+    else:
+        data[keys[0]] = np.asarray(uniques)
+
+    # One value column per window, and one bit per window in the order of the value columns.
+    windows = np.zeros(length, dtype=np.uint8 if len(labels) <= 8 else np.uint32)
+    values = pd_long['Value'].to_numpy()
+    for bit, label in enumerate(labels):
+        selected = ranges == label
+        data[window_prefix + label] = window_column(values[selected], codes[selected], length)
+        windows[codes[selected]] |= windows.dtype.type(1 << bit)
+    data['Windows'] = windows
+
+    return pd.DataFrame(data, copy=False)
+
+
+def window_values(column, member):
+
+    # The values of one window. Nullable integer columns have no missing values within their window.
+    values = column[member]
+    if isinstance(values.dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_integer_dtype(values.dtype):
+        values = values.astype(values.dtype.numpy_dtype)
+
+    return values.to_numpy()
+
+
+def expand_windows(compact, label=True):
+
+    # Back to the long Range format, window by window in the order of the value columns. Every column that is
+    # neither a value column nor the Windows bitmask, e.g. Date or fetch_date, is repeated for each window.
+    window_columns = [name for name in compact.columns if name.startswith(window_prefix)]
+    keys = [name for name in compact.columns if name not in window_columns and name != 'Windows']
+    windows = compact['Windows'].to_numpy()
+
+    frames = []
+    for bit, name in enumerate(window_columns):
+        member = (windows & (1 << bit)) != 0
+        values = window_values(compact[name], member)
+        columns = [(key, compact[key].to_numpy()[member]) for key in keys] + [('Value', values)]
+        if label:
+            columns.append(('Label', values))
+        columns.append(('Range', name[len(window_prefix):]))
+        frames.append(build_report(columns, descending(values) if is_ranked(keys) else None))
+
+    return concat_reports(frames)
@@ -0,0 +1,136 @@
+"""
+Description: Streaming writers for the files exported by the pipeline.
+
+Rather than collecting every payload, concatenating them and writing the result with one to_csv
+call, processed chunks are appended to an open file as they arrive, so memory holds one chunk at a
+time however many payloads a run produces. CSV chunks are appended as text, Parquet chunks become
+row groups of a single file. The rows go to a temporary file that only replaces the final file once
+the last chunk is written, so the dashboard never reads a partial file and a failed run leaves the
+previous file in place.
+
+Parquet output requires: pyarrow. Checks are made automatically for the availability of the module.
+
+"""
+
+import os
+import threading
+
+from google_trends_parquet import compact_frame
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+
+class StreamingWriter(object):
+
+    def __init__(self, path, file_format=None):
+
+        # The format follows the file extension unless given.
+        self.path = path
+        self.file_format = file_format or ('parquet' if path.endswith('.parquet') else 'csv')
+        if self.file_format == 'parquet' and pyarrow is None:
+            raise ImportError("Parquet output requires the pyarrow package: pip install pyarrow")
+
+        # Unique per process and thread, so concurrent writers of the same file never share a temporary file.
+        self.temporary_path = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        self.csv_file = None
+        self.parquet_writer = None
+        self.schema = None
+        self.chunks = 0
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+
+        # Only a complete stream replaces the final file.
+        if error_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    # APPEND THE CHUNKS
+
+    def write(self, chunk):
+
+        if self.file_format == 'csv':
+
+            # The header is written with the first chunk only.
+            if self.csv_file is None:
+                self.csv_file = open(self.temporary_path, 'w', newline='')
+            chunk.to_csv(self.csv_file, index=False, header=self.chunks == 0)
+            self.csv_file.flush()
+
+        else:
+
+            # Every chunk is written as a row group with the schema of the first chunk. Dictionary indexes are
+            # widened so chunks with more distinct values than the first one still fit.
+            table = pyarrow.Table.from_pandas(compact_frame(chunk), preserve_index=False)
+            if self.parquet_writer is None:
+                self.schema = pyarrow.schema([
+                    field.with_type(pyarrow.dictionary(pyarrow.int32(), field.type.value_type))
+                    if pyarrow.types.is_dictionary(field.type) else field
+                    for field in table.schema])
+                self.parquet_writer = pq.ParquetWriter(self.temporary_path, self.schema)
+            self.parquet_writer.write_table(table.select(self.schema.names).cast(self.schema))
+
+        self.chunks += 1
+        self.rows += len(chunk)
+
+    # FINISH THE FILE
+
+    def close(self):
+
+        # An empty stream still gives an empty CSV file. A Parquet file needs at least one chunk for its schema.
+        if self.file_format == 'csv' and self.csv_file is None:
+            self.csv_file = open(self.temporary_path, 'w', newline='')
+
+        if self.csv_file is not None:
+            self.csv_file.close()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+        # Move the complete file into place.
+        if os.path.exists(self.temporary_path):
+            os.replace(self.temporary_path, self.path)
+
+    def abort(self):
+
+        # Discard the temporary file, keeping the previous final file.
+        if self.csv_file is not None:
+            self.csv_file.close()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        if os.path.exists(self.temporary_path):
+            os.remove(self.temporary_path)
+
+
+# WRITE A STREAM OF CHUNKS
+
+def write_stream(chunks, writers, on_chunk=None):
+
+    # Append every chunk to every writer as it arrives, e.g. one CSV and one Parquet file, calling on_chunk first,
+    # e.g. to store it. The files only replace the final files once the stream is complete.
+    rows = 0
+    try:
+        for chunk in chunks:
+            if on_chunk is not None:
+                on_chunk(chunk)
+            for writer in writers:
+                writer.write(chunk)
+            rows += len(chunk)
+    except BaseException:
+        for writer in writers:
+            writer.abort()
+        raise
+
+    for writer in writers:
+        writer.close()
+
+    return rows
@@ -0,0 +1,12 @@
+"""
+Description: Shared setup for the tests of the Google Trends pipeline.
+
+The modules live at the root of the repository rather than in a package, so the root is put on the
+import path whichever directory pytest is run from.
+
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,63 @@
+"""
+Description: Tests for the spike detector of google_trends_anomaly.py.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from google_trends_anomaly import SpikeDetector
+
+
+def series_frame(series, values, start='2026-01-01'):
+    return pd.DataFrame({'Series': series, 'Date': pd.date_range(start, periods=len(values)), 'Value': values})
+
+
+def test_spike_after_a_steady_baseline_is_flagged():
+
+    values = [20, 22, 21, 19, 20, 23, 21, 20, 22, 21, 80]
+    alerts = SpikeDetector().update_frame(series_frame('flu|GB', values))
+
+    assert list(alerts['Series']) == ['flu|GB']
+    assert alerts['Date'].iloc[0] == pd.Timestamp('2026-01-11')
+    assert alerts['Value'].iloc[0] == 80
+
+
+def test_no_alert_before_enough_history():
+
+    alerts = SpikeDetector(min_periods=7).update_frame(series_frame('flu|GB', [20, 21, 80]))
+    assert alerts.empty
+
+
+def test_low_values_are_not_flagged():
+
+    values = [1, 1, 2, 1, 1, 2, 1, 1, 1, 9]
+    alerts = SpikeDetector(min_value=10).update_frame(series_frame('flu|GB', values))
+
+    assert alerts.empty
+
+
+def test_days_already_seen_are_skipped():
+
+    detector = SpikeDetector()
+    frame = series_frame('flu|GB', [20, 22, 21, 19, 20, 23, 21, 20, 22, 21, 80])
+    assert len(detector.update_frame(frame)) == 1
+
+    # A refetch of the same days adds nothing to the statistics.
+    count = detector.count.copy()
+    assert detector.update_frame(frame).empty
+    np.testing.assert_array_equal(detector.count, count)
+
+
+def test_state_survives_save_and_load(tmp_path):
+
+    path = str(tmp_path / 'detector.npz')
+    detector = SpikeDetector()
+    detector.update_frame(series_frame('flu|GB', [20, 22, 21, 19, 20, 23, 21, 20, 22, 21]))
+    detector.save(path)
+
+    loaded = SpikeDetector.load(path)
+    alerts = loaded.update_frame(series_frame('flu|GB', [80], start='2026-01-11'))
+
+    assert loaded.keys == ['flu|GB']
+    assert list(alerts['Series']) == ['flu|GB']
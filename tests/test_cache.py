@@ -0,0 +1,70 @@
+"""
+Description: Tests for the on-disk response cache of google_trends_cache.py.
+
+"""
+
+import os
+import time
+
+from google_trends_cache import ResponseCache
+
+
+def cache_key(keyword):
+    return ('interest_over_time', [keyword], 'today 1-m', 'GB', '')
+
+
+def test_put_then_get_returns_the_response(tmp_path):
+
+    cache = ResponseCache(str(tmp_path))
+    cache.put(cache_key('flu'), {'values': [1, 2, 3]})
+
+    assert cache.get(cache_key('flu')) == {'values': [1, 2, 3]}
+    assert cache.get(cache_key('covid')) is None
+
+
+def test_expired_entries_are_a_miss_unless_allowed(tmp_path):
+
+    cache = ResponseCache(str(tmp_path), ttl={'interest_over_time': 0})
+    cache.put(cache_key('flu'), 'response')
+
+    assert cache.get(cache_key('flu')) is None
+    assert cache.get(cache_key('flu'), allow_expired=True) == 'response'
+
+
+def test_get_does_not_rewrite_the_index(tmp_path):
+
+    cache = ResponseCache(str(tmp_path))
+    cache.put(cache_key('flu'), 'response')
+    modified = os.path.getmtime(cache.index_path)
+    time.sleep(0.05)
+
+    for _ in range(3):
+        assert cache.get(cache_key('flu')) == 'response'
+
+    assert os.path.getmtime(cache.index_path) == modified
+
+
+def test_least_recently_read_entry_is_evicted_first(tmp_path):
+
+    # Room for two entries: the entry read last survives the third put, the one never read is evicted.
+    cache = ResponseCache(str(tmp_path))
+    cache.put(cache_key('flu'), 'x' * 1000)
+    cache.put(cache_key('covid'), 'x' * 1000)
+    cache.max_bytes = 2 * os.path.getsize(os.path.join(str(tmp_path), cache.make_digest(cache_key('flu')) + '.pkl'))
+
+    time.sleep(0.01)
+    assert cache.get(cache_key('flu')) is not None
+    cache.put(cache_key('cold'), 'x' * 1000)
+
+    assert cache.get(cache_key('flu')) is not None
+    assert cache.get(cache_key('covid')) is None
+    assert cache.get(cache_key('cold')) is not None
+
+
+def test_caches_sharing_a_directory_see_each_other(tmp_path):
+
+    writer = ResponseCache(str(tmp_path))
+    reader = ResponseCache(str(tmp_path))
+    writer.put(cache_key('flu'), 'response')
+
+    assert reader.get(cache_key('flu')) == 'response'
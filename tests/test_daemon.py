@@ -0,0 +1,96 @@
+"""
+Description: Tests for the refresh queue of google_trends_daemon.py.
+
+"""
+
+import time
+
+from google_trends_daemon import RefreshQueue, run_daemon
+
+
+def job(keyword, endpoint='interest_over_time'):
+    return (keyword, 'GB', endpoint, 'today 1-m')
+
+
+def test_new_jobs_are_due_straight_away(tmp_path):
+
+    queue = RefreshQueue(str(tmp_path / 'queue.json'))
+    queue.add(job('flu'))
+
+    assert queue.next_job() == job('flu')
+    assert queue.next_job() is None
+
+
+def test_job_waits_for_the_budget(tmp_path):
+
+    queue = RefreshQueue(str(tmp_path / 'queue.json'), hourly_budget=5, job_cost=3)
+    queue.add(job('flu'))
+    queue.add(job('covid'))
+
+    first = queue.next_job()
+    queue.complete(first, 3)
+
+    assert queue.remaining_budget() == 2
+    assert queue.next_job() is None
+    assert queue.wait_seconds() > 60 * 59
+
+
+def test_job_cost_can_depend_on_the_job(tmp_path):
+
+    queue = RefreshQueue(str(tmp_path / 'queue.json'), hourly_budget=2,
+                         job_cost=lambda queued: 2 if queued[0] == 'flu' else 3)
+    queue.add(job('covid'))
+    queue.add(job('flu'))
+
+    # The job due first does not fit within the budget, so the queue waits rather than skipping it.
+    assert queue.next_job() is None
+    queue.retain([job('flu')])
+    assert queue.next_job() == job('flu')
+
+
+def test_volatile_keywords_fall_due_sooner(tmp_path):
+
+    queue = RefreshQueue(str(tmp_path / 'queue.json'), volatility_weight=4.0)
+
+    assert queue.refresh_interval(job('flu'), volatility=1.0) == queue.refresh_interval(job('flu')) / 5.0
+
+
+def test_saved_queue_carries_on_after_a_restart(tmp_path):
+
+    path = str(tmp_path / 'queue.json')
+    queue = RefreshQueue(path)
+    queue.add(job('flu'))
+    queue.add(job('covid'))
+    queue.complete(queue.next_job(), 3)
+    queue.save()
+
+    loaded = RefreshQueue.load(path)
+
+    assert loaded.remaining_budget() == 97
+    assert loaded.next_job() == job('covid')
+    assert loaded.next_job() is None
+
+
+def test_retain_drops_jobs_no_longer_asked_for(tmp_path):
+
+    queue = RefreshQueue(str(tmp_path / 'queue.json'))
+    queue.add(job('flu'))
+    queue.add(job('covid'))
+    queue.retain([job('covid')])
+
+    assert list(queue.jobs) == [job('covid')]
+    assert queue.next_job() == job('covid')
+    assert queue.next_job() is None
+
+
+def test_failed_job_is_retried_later(tmp_path):
+
+    queue = RefreshQueue(str(tmp_path / 'queue.json'))
+    queue.add(job('flu'))
+
+    def refresh(queued):
+        raise LookupError('throttled')
+
+    assert run_daemon(queue, refresh, lambda queued: 0.0, count=1, errors=(LookupError,)) == 1
+    assert queue.jobs[job('flu')]['due_at'] > time.time() + 60
+    assert queue.remaining_budget() == 97
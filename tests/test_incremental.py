@@ -0,0 +1,67 @@
+"""
+Description: Tests for the incremental refresh of google_trends_incremental.py.
+
+"""
+
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from google_trends_incremental import tail_time_frame, merge_tail, window_from_history
+
+
+def test_tail_window_starts_before_the_last_stored_date():
+
+    today = datetime.date(2026, 3, 31)
+    assert tail_time_frame('2026-03-20', overlap_days=7, today=today) == '2026-03-13 2026-03-31'
+
+
+def test_tail_window_is_capped_at_ninety_days():
+
+    today = datetime.date(2026, 3, 31)
+    assert tail_time_frame('2025-06-01', today=today) == '2026-01-01 2026-03-31'
+
+
+def test_merge_rescales_the_history_onto_the_tail():
+
+    # The tail is the same interest at half the scale, plus five new days.
+    history = pd.DataFrame({'Date': pd.date_range('2026-01-01', periods=20), 'Value': np.arange(20) + 50.0})
+    tail = pd.DataFrame({'Date': pd.date_range('2026-01-14', periods=12),
+                         'Value': np.concatenate([(np.arange(13, 20) + 50.0) / 2, [40, 41, 42, 43, 44]])})
+
+    merged = merge_tail(history, tail)
+
+    assert list(merged['Date']) == list(pd.date_range('2026-01-01', periods=25))
+    assert merged['Value'].max() == pytest.approx(100.0)
+    np.testing.assert_allclose(merged['Value'].iloc[:13] / merged['Value'].iloc[13],
+                               (np.arange(13) + 50.0) / 63.0)
+
+
+def test_merge_without_overlap_raises():
+
+    history = pd.DataFrame({'Date': pd.date_range('2026-01-01', periods=10), 'Value': 50.0})
+    tail = pd.DataFrame({'Date': pd.date_range('2026-03-01', periods=10), 'Value': 50.0})
+
+    with pytest.raises(ValueError, match='does not overlap'):
+        merge_tail(history, tail)
+
+
+def test_merge_without_interest_on_the_overlap_raises():
+
+    history = pd.DataFrame({'Date': pd.date_range('2026-01-01', periods=10), 'Value': 0.0})
+    tail = pd.DataFrame({'Date': pd.date_range('2026-01-05', periods=10), 'Value': 50.0})
+
+    with pytest.raises(ValueError, match='No interest'):
+        merge_tail(history, tail)
+
+
+def test_window_is_rescaled_to_peak_at_one_hundred():
+
+    history = pd.DataFrame({'Date': pd.date_range('2026-01-01', periods=60), 'Value': np.arange(60) + 1.0})
+    window = window_from_history(history, 30)
+
+    assert len(window) == 30
+    assert window['Value'].max() == 100
+    assert window['Date'].iloc[-1] == pd.Timestamp('2026-03-01')
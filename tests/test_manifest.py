@@ -0,0 +1,75 @@
+"""
+Description: Tests for the resumable run manifest of google_trends_manifest.py.
+
+"""
+
+import os
+
+from google_trends_manifest import RunManifest, run_unit
+
+
+def test_completed_units_are_not_run_again(tmp_path):
+
+    calls = []
+
+    def fetch(month, geo):
+        calls.append((month, geo))
+        return {'month': month, 'geo': geo}
+
+    manifest = RunManifest(str(tmp_path), 'run1')
+    unit = ('get_interest_by_region', 1, 'GB', 'REGION')
+    assert run_unit(manifest, unit, fetch, (1, 'GB')) == {'month': 1, 'geo': 'GB'}
+
+    # A resumed run reads the result back instead of fetching it.
+    resumed = RunManifest(str(tmp_path), 'run1')
+    assert run_unit(resumed, unit, fetch, (1, 'GB')) == {'month': 1, 'geo': 'GB'}
+    assert calls == [(1, 'GB')]
+    assert resumed.completed_units() == [list(unit)]
+
+
+def test_units_differing_in_any_argument_are_distinct(tmp_path):
+
+    manifest = RunManifest(str(tmp_path), 'run1')
+    run_unit(manifest, ('get_interest_by_region', 1, 'GB', 'REGION'), lambda: 'region', ())
+
+    assert not manifest.is_done(('get_interest_by_region', 1, 'GB', 'CITY'))
+    assert not manifest.is_done(('get_interest_by_region', 1, 'US', 'REGION'))
+
+
+def test_resumed_run_keeps_its_settings(tmp_path):
+
+    RunManifest(str(tmp_path), 'run1', settings={'fetched_at': '2026-01-01T00:00:00'})
+    resumed = RunManifest(str(tmp_path), 'run1', settings={'fetched_at': '2026-01-02T00:00:00'})
+
+    assert resumed.settings['fetched_at'] == '2026-01-01T00:00:00'
+
+
+def test_latest_incomplete_run_is_offered_for_resuming(tmp_path):
+
+    RunManifest(str(tmp_path), '2026-01-01T000000')
+    RunManifest(str(tmp_path), '2026-01-02T000000')
+    RunManifest(str(tmp_path), '2026-01-03T000000').complete()
+
+    assert RunManifest.latest_incomplete(str(tmp_path)) == '2026-01-02T000000'
+
+
+def test_complete_deletes_the_results(tmp_path):
+
+    manifest = RunManifest(str(tmp_path), 'run1')
+    run_unit(manifest, ('get_related_queries', 1, 'GB'), lambda: 'queries', ())
+    manifest.complete()
+
+    assert not [name for name in os.listdir(manifest.directory) if name.endswith('.pkl')]
+    assert RunManifest.latest_incomplete(str(tmp_path)) is None
+
+
+def test_runs_too_old_to_resume_expire(tmp_path):
+
+    manifest = RunManifest(str(tmp_path), 'run1')
+    run_unit(manifest, ('get_related_queries', 1, 'GB'), lambda: 'queries', ())
+    started_at = manifest.settings['started_at']
+
+    assert RunManifest.latest_incomplete(str(tmp_path), max_age=60, now=started_at + 120) is None
+    assert RunManifest.expire(str(tmp_path), max_age=60, now=started_at + 120) == 1
+    assert not manifest.is_done(('get_related_queries', 1, 'GB'))
+    assert RunManifest.incomplete_runs(str(tmp_path)) == []
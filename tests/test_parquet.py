@@ -0,0 +1,78 @@
+"""
+Description: Tests for the Parquet round trip of google_trends_parquet.py and google_trends_writer.py.
+
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from google_trends_parquet import parquet_available, dataset_file, read_parquet
+from google_trends_transform import compact_windows, series_report, interest_by_region_report
+from google_trends_writer import StreamingWriter, write_stream
+
+pytestmark = pytest.mark.skipif(not parquet_available(), reason="requires pyarrow")
+
+
+def timeline(days_thirty):
+
+    # The 90-day window and a 30-day window that may be missing some of its days.
+    dates = pd.date_range('2026-01-01', periods=90)
+    return pd.concat([series_report(dates.to_numpy(), np.arange(90) % 101, 'Last-90-Days'),
+                      series_report(dates[-days_thirty:].to_numpy(), np.arange(days_thirty) + 1, 'Last-30-Days')],
+                     ignore_index=True)
+
+
+def write_both(directory, name, frame, fetch_date, keys):
+
+    # One compact Parquet file and the CSV file of the same report.
+    csv_path = str(directory / (name + fetch_date + '.csv'))
+    write_stream([compact_windows(frame, keys)], [StreamingWriter(dataset_file(str(directory), name, fetch_date, 'run1'))])
+    write_stream([frame], [StreamingWriter(csv_path)])
+    return csv_path
+
+
+def same_rows(parquet_frame, csv_frame, columns):
+    return (parquet_frame[columns].astype(str).sort_values(columns).reset_index(drop=True)
+            .equals(csv_frame[columns].astype(str).sort_values(columns).reset_index(drop=True)))
+
+
+def test_timeline_round_trip_matches_the_csv(tmp_path):
+
+    frame = timeline(30)
+    csv_path = write_both(tmp_path, 'multiTimeline', frame, '2026-03-31', ['Date'])
+    restored = read_parquet(str(tmp_path), 'multiTimeline')
+    csv_frame = pd.read_csv(csv_path)
+
+    assert len(restored) == len(frame)
+    assert restored['Value'].dtype == csv_frame['Value'].dtype
+    assert (restored['Label'] == restored['Value']).all()
+    assert isinstance(restored['Range'].dtype, pd.CategoricalDtype)
+    assert same_rows(restored, csv_frame, ['Value', 'Label', 'Range'])
+
+
+def test_value_dtypes_agree_between_files(tmp_path):
+
+    # A complete 30-day window is stored as uint8, one missing days as nullable UInt8.
+    write_both(tmp_path, 'multiTimeline', timeline(30), '2026-03-31', ['Date'])
+    write_both(tmp_path, 'multiTimeline', timeline(20), '2026-04-01', ['Date'])
+
+    complete = read_parquet(str(tmp_path), 'multiTimeline', '2026-03-31')
+    partial = read_parquet(str(tmp_path), 'multiTimeline', '2026-04-01')
+    both = read_parquet(str(tmp_path), 'multiTimeline')
+
+    assert complete['Value'].dtype == partial['Value'].dtype == both['Value'].dtype == np.int64
+    assert len(both) == 120 + 110
+
+
+def test_regions_round_trip_in_order(tmp_path):
+
+    payload = pd.DataFrame({'flu': [40, 100, 75]}, index=pd.Index(['Wales', 'England', 'Scotland'], name='geoName'))
+    frame = pd.concat([interest_by_region_report(payload, 'flu', 'United Kingdom', 'Last-30-Days'),
+                       interest_by_region_report(payload, 'flu', 'United Kingdom', 'Last-90-Days')],
+                      ignore_index=True)
+    csv_path = write_both(tmp_path, 'geoMap', frame, '2026-03-31', ['Country', 'Region'])
+    restored = read_parquet(str(tmp_path), 'geoMap')
+
+    assert list(restored.loc[restored['Range'] == 'Last-30-Days', 'Region']) == ['England', 'Scotland', 'Wales']
+    assert same_rows(restored, pd.read_csv(csv_path), ['Country', 'Region', 'Value', 'Range'])
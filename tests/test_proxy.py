@@ -0,0 +1,68 @@
+"""
+Description: Tests for the adaptive rate limiting and proxy rotation of google_trends_proxy.py.
+
+"""
+
+import time
+
+import pytest
+
+from google_trends_proxy import ProxyScheduler, success, throttled, failed
+
+
+def test_success_raises_the_rate_up_to_the_maximum():
+
+    scheduler = ProxyScheduler(['a'], initial_rate=1.0, max_rate=1.1, increase=0.05)
+    scheduler.record('a', success)
+    assert scheduler.state('a').bucket.rate == pytest.approx(1.05)
+
+    for _ in range(5):
+        scheduler.record('a', success)
+    assert scheduler.state('a').bucket.rate == pytest.approx(1.1)
+
+
+def test_throttling_halves_the_rate_down_to_the_minimum():
+
+    scheduler = ProxyScheduler(['a'], initial_rate=1.0, min_rate=0.2)
+    scheduler.record('a', throttled)
+    assert scheduler.state('a').bucket.rate == pytest.approx(0.5)
+
+    scheduler.record('a', throttled)
+    assert scheduler.state('a').bucket.rate == pytest.approx(0.25)
+
+
+def test_failing_proxy_is_taken_out_of_rotation():
+
+    scheduler = ProxyScheduler(['a', 'b'], initial_rate=100, capacity=100, cooldown=60)
+    for _ in range(3):
+        scheduler.record('a', failed)
+
+    assert scheduler.state('a').unhealthy_until > time.time()
+    assert scheduler.state('a').bucket.rate == scheduler.min_rate
+    assert all(scheduler.choose() == 'b' for _ in range(5))
+
+
+def test_choose_prefers_the_fastest_healthy_proxy():
+
+    scheduler = ProxyScheduler(['a', 'b'], initial_rate=100, capacity=100)
+    scheduler.record('a', throttled)
+
+    assert scheduler.choose() == 'b'
+
+
+def test_unknown_proxy_raises_a_key_error():
+
+    scheduler = ProxyScheduler(['a'])
+    with pytest.raises(KeyError):
+        scheduler.record('b', success)
+    with pytest.raises(KeyError):
+        scheduler.acquire('b')
+
+
+def test_total_rate_counts_only_healthy_proxies():
+
+    scheduler = ProxyScheduler(['a', 'b'], initial_rate=1.0)
+    for _ in range(3):
+        scheduler.record('a', failed)
+
+    assert scheduler.total_rate() == pytest.approx(1.0)
@@ -0,0 +1,94 @@
+"""
+Description: Tests for the lease-based work queue of google_trends_queue.py.
+
+"""
+
+from google_trends_queue import WorkQueue, run_worker
+
+
+def unit(keyword):
+    return ['interest_over_time', 'today 1-m', 'GB', [keyword]]
+
+
+def test_units_are_added_once_per_round(tmp_path):
+
+    path = str(tmp_path / 'queue.db')
+    assert WorkQueue(path, 'round1').add([unit('flu'), unit('covid')]) == 2
+    assert WorkQueue(path, 'round1').add([unit('flu'), unit('covid')]) == 0
+    assert WorkQueue(path, 'round2').add([unit('flu')]) == 1
+
+
+def test_a_leased_unit_is_not_claimed_twice(tmp_path):
+
+    queue = WorkQueue(str(tmp_path / 'queue.db'), 'round1', lease_seconds=60)
+    queue.add([unit('flu')], now=100)
+
+    assert len(queue.claim('a', now=100)) == 1
+    assert queue.claim('b', now=110) == []
+
+
+def test_an_expired_lease_is_reclaimed(tmp_path):
+
+    queue = WorkQueue(str(tmp_path / 'queue.db'), 'round1', lease_seconds=60)
+    queue.add([unit('flu')], now=100)
+    [(first, first_lease)] = queue.claim('a', now=100)
+
+    # Worker a stops renewing its lease, so worker b takes the unit over.
+    [(second, second_lease)] = queue.claim('b', now=200)
+    assert second == first
+
+    # Completing the unit with the lease given up reports it was fetched twice.
+    assert queue.complete(second, second_lease) is True
+    assert queue.complete(first, first_lease) is False
+    assert queue.counts() == {'done': 1}
+
+
+def test_renewed_lease_is_kept(tmp_path):
+
+    queue = WorkQueue(str(tmp_path / 'queue.db'), 'round1', lease_seconds=60)
+    queue.add([unit('flu')], now=100)
+    [(claimed, lease_id)] = queue.claim('a', now=100)
+
+    assert queue.renew(lease_id, now=150)
+    assert queue.claim('b', now=200) == []
+
+
+def test_every_worker_stores_a_unit_under_the_same_fetch_time(tmp_path):
+
+    queue = WorkQueue(str(tmp_path / 'queue.db'), 'round1', lease_seconds=60)
+    queue.add([unit('flu')], now=100)
+    [(first, first_lease)] = queue.claim('a', now=100)
+    fetched_at = queue.fetched_at(first)
+    [(second, second_lease)] = queue.claim('b', now=200)
+
+    assert queue.fetched_at(second) == fetched_at
+
+
+def test_failed_unit_is_retried_then_given_up(tmp_path):
+
+    queue = WorkQueue(str(tmp_path / 'queue.db'), 'round1', lease_seconds=60, max_attempts=2)
+    queue.add([unit('flu')], now=100)
+
+    [(claimed, lease_id)] = queue.claim('a', now=100)
+    queue.fail(claimed, lease_id, 'throttled', now=100)
+    assert queue.counts() == {'pending': 1}
+
+    [(claimed, lease_id)] = queue.claim('a', now=1000)
+    queue.fail(claimed, lease_id, 'throttled', now=1000)
+    assert queue.counts() == {'failed': 1}
+
+
+def test_worker_processes_every_unit_of_the_round(tmp_path):
+
+    queue = WorkQueue(str(tmp_path / 'queue.db'), 'round1')
+    queue.add([unit('flu'), unit('covid'), unit('cold')])
+    processed = []
+
+    def process(claimed):
+        if claimed == unit('cold') and unit('cold') not in processed:
+            processed.append(claimed)
+            raise LookupError('no data')
+        processed.append(claimed)
+
+    assert run_worker(queue, 'a', process, count=3, errors=(LookupError,)) == 3
+    assert queue.counts() == {'done': 2, 'pending': 1}
@@ -0,0 +1,62 @@
+"""
+Description: Tests for the window planning and stitching of google_trends_stitch.py.
+
+"""
+
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from google_trends_stitch import plan_windows, window_time_frame, stitch_windows
+
+
+def test_windows_cover_the_range_with_overlaps():
+
+    windows = plan_windows('2025-01-01', '2025-12-31', window_days=90, overlap_days=14)
+
+    assert windows[0][0] == datetime.date(2025, 1, 1)
+    assert windows[-1][1] == datetime.date(2025, 12, 31)
+    for (start, end), (next_start, next_end) in zip(windows, windows[1:]):
+        assert (end - start).days == 89
+        assert (end - next_start).days + 1 == 14
+
+
+def test_short_range_is_one_window():
+
+    assert plan_windows('2025-01-01', '2025-01-31') == [(datetime.date(2025, 1, 1), datetime.date(2025, 1, 31))]
+    assert window_time_frame(plan_windows('2025-01-01', '2025-01-31')[0]) == '2025-01-01 2025-01-31'
+
+
+def test_end_before_start_is_rejected():
+
+    with pytest.raises(ValueError):
+        plan_windows('2025-02-01', '2025-01-01')
+
+
+def test_stitched_windows_recover_one_scale():
+
+    # One series split into two overlapping windows, each scaled by Google to its own peak of 100.
+    dates = pd.date_range('2025-01-01', periods=120)
+    truth = np.linspace(10, 200, 120)
+    windows = []
+    for start, end in [(0, 90), (76, 120)]:
+        values = truth[start:end]
+        windows.append(pd.DataFrame({'Date': dates[start:end], 'Value': values * 100.0 / values.max()}))
+
+    stitched = stitch_windows(windows)
+
+    assert list(stitched['Date']) == list(dates)
+    assert stitched['Value'].max() == pytest.approx(100.0)
+    np.testing.assert_allclose(stitched['Value'].to_numpy(), truth * 100.0 / truth.max())
+
+
+def test_windows_without_shared_interest_are_rejected():
+
+    dates = pd.date_range('2025-01-01', periods=10)
+    first = pd.DataFrame({'Date': dates[:6], 'Value': [50, 60, 70, 0, 0, 0]})
+    second = pd.DataFrame({'Date': dates[3:], 'Value': [0, 0, 0, 80, 90, 100, 70]})
+
+    with pytest.raises(ValueError):
+        stitch_windows([first, second])
@@ -0,0 +1,48 @@
+"""
+Description: Offline tests of the fetchers of google_trends_api_func.py against the stub server.
+
+"""
+
+import pytest
+
+import google_trends_api_func as pipeline
+from google_trends_benchmark import reset_pipeline
+from google_trends_stub import StubServer
+
+
+@pytest.fixture
+def stub_pipeline(tmp_path):
+
+    # A stand-in for trends.google.com on a free port, and an empty cache paced at the stub's speed.
+    server = StubServer()
+    reset_pipeline(server.start(), str(tmp_path / 'cache'), 1000)
+    yield pipeline
+    server.stop()
+
+
+def test_interest_over_time_report(stub_pipeline):
+
+    report = stub_pipeline.get_interest_over_time_batched(['flu', 'covid'], 1)
+
+    assert set(report['Keyword']) == {'flu', 'covid'}
+    assert set(report['Range']) == {'Last-30-Days'}
+    assert report['Value'].between(0, 100).all()
+
+
+def test_interest_by_region_report(stub_pipeline):
+
+    report = stub_pipeline.get_interest_by_region(3, 'GB', 'REGION', ['flu'])
+
+    assert len(report)
+    assert set(report['Country']) == {'United Kingdom'}
+    assert list(report['Value']) == sorted(report['Value'], reverse=True)
+
+
+def test_second_fetch_comes_from_the_cache(stub_pipeline):
+
+    stub_pipeline.get_related_queries(1, 'GB', ['flu'])
+    requests_made = stub_pipeline.metrics.total('requests_total')
+    stub_pipeline.get_related_queries(1, 'GB', ['flu'])
+
+    assert requests_made
+    assert stub_pipeline.metrics.total('requests_total') == requests_made